@@ -0,0 +1,137 @@
+"""
+Benchmarks the memory taken by loading and preprocessing very large scans, decoded at
+full resolution and at the reduced resolution chosen for IMAGE_TARGET_DPI.
+
+Every measurement runs in a fresh process, whose peak RSS is reset once the modules are
+imported, so that it is only raised by the images it handles. The scan is a synthetic
+A4 report at --dpi, saved as JPEG (decoded at the reduced size by libjpeg) and PNG
+(decoded at full size, then reduced by OpenCV).
+
+Reports, per format and mode, the peak RSS for a single image and per image when
+--concurrency images are preprocessed at once, with and without the image memory
+budget, and the peak memory the budget accounted for.
+
+Run from the project root:
+
+    python -m benchmarks.image_memory --dpi 600 --concurrency 4
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import subprocess
+import resource
+import tempfile
+import json
+import sys
+import os
+
+A4_INCHES = (8.27, 11.69)
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of the process, in MB."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def reset_peak_rss() -> float:
+    """
+    Resets the peak resident memory to the current one, where Linux allows it, so that
+    the memory briefly taken by the imports is not counted.
+
+    Returns:
+        float: The resident memory the peak is measured from, in MB.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+def make_scan(path: str, dpi: int) -> None:
+    import cv2 as cv
+    import numpy as np
+    from PIL import Image
+
+    width, height = int(A4_INCHES[0] * dpi), int(A4_INCHES[1] * dpi)
+    scale = dpi / 300
+    image = np.full((height, width), 235, np.uint8)
+    for row, y in enumerate(range(int(300 * scale), height - int(300 * scale), int(60 * scale))):
+        text = f"Haemoglobin {row % 20}.3 gm/dl 14 - 18"
+        cv.putText(image, text, (int(300 * scale), y), cv.FONT_HERSHEY_SIMPLEX, 1.2 * scale, 20, max(1, int(2 * scale)))
+    noise = np.random.default_rng(0).integers(0, 20, image.shape, dtype=np.uint8)
+    Image.fromarray(cv.subtract(image, noise)).convert("RGB").save(path, dpi=(dpi, dpi))
+
+def child(path: str, concurrency: int) -> None:
+    """Preprocesses `concurrency` copies of the scan at once and prints the memory taken."""
+    import logging
+    logging.disable(logging.CRITICAL)
+    from server.processor import Processor
+    from server.modules.image_memory import image_budget
+
+    baseline = reset_peak_rss()
+
+    def run(_) -> tuple:
+        processor = Processor()
+        original, preprocessed, profile = processor.load_and_preprocess(path)
+        return original.shape, processor.metadata.get("decode_reduction", 1)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run, range(concurrency)))
+
+    peak = peak_rss_mb() - baseline
+    print(json.dumps({
+        "decoded_shape": list(results[0][0]),
+        "reduction": results[0][1],
+        "peak_rss_mb": round(peak, 1),
+        "peak_rss_mb_per_image": round(peak / concurrency, 1),
+        "budget_peak_mb": round(image_budget.snapshot()["peak_bytes"] / 2**20, 1),
+        "budget_waits": image_budget.snapshot()["waits"],
+    }))
+
+def measure(path: str, concurrency: int, env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.image_memory", "--child", path, "--concurrency", str(concurrency)],
+        env={**os.environ, **env}, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dpi", type=int, default=600, help="Resolution of the synthetic scan")
+    parser.add_argument("--concurrency", type=int, default=4, help="Images preprocessed at once")
+    parser.add_argument("--budget", type=int, default=128 * 2**20, help="Image memory budget of the bounded runs, in bytes")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.concurrency)
+        return
+
+    unbounded = str(2**50)
+    modes = {
+        "full_resolution": {"IMAGE_TARGET_DPI": "0", "IMAGE_MEMORY_BUDGET": unbounded},
+        "reduced": {"IMAGE_TARGET_DPI": "300", "IMAGE_MEMORY_BUDGET": unbounded},
+        "reduced_budgeted": {"IMAGE_TARGET_DPI": "300", "IMAGE_MEMORY_BUDGET": str(args.budget)},
+    }
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in ("jpg", "png"):
+            path = os.path.join(directory, f"scan.{extension}")
+            make_scan(path, args.dpi)
+            report[extension] = {
+                name: {
+                    "single": measure(path, 1, env),
+                    "concurrent": measure(path, args.concurrency, env),
+                }
+                for name, env in modes.items()
+            }
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
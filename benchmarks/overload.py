@@ -0,0 +1,113 @@
+"""
+Benchmarks /process under a burst of image requests, with admission control and
+without it (limits high enough to admit every request).
+
+The OCR is replaced by a stub that sleeps for --ocr-latency seconds and returns a
+formatted table, so the rest of the pipeline runs locally and no remote model is
+called. The results are stored in a temporary database.
+
+Reports the status codes, the latency of the accepted requests and of the rejected
+ones, and the admission metrics.
+
+Run from the project root:
+
+    python -m benchmarks.overload --requests 200 --ocr-latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+import os
+
+os.environ.setdefault("RESULTS_DB", os.path.join(tempfile.mkdtemp(), "results.db"))
+os.environ["WARM_UP"] = "0"
+
+import cv2 as cv
+import httpx
+import numpy as np
+
+from server.api import app
+from server.processor import Processor
+from server.modules.admission import admission, AdmissionController
+
+FORMATTED = """## **COMPLETE BLOOD COUNT**
+
+| TEST | RESULT | UNIT | REFERENCE RANGE |
+|---|---|---|---|
+| Haemoglobin | 11.3 | gm/dl | 14 - 18 |
+| Total WBC Count | 5800 | /cmm | 4000 - 10000 |
+| Platelets | 246000 | /cmm | 150000 - 450000 |
+"""
+
+def stub_ocr(latency: float) -> None:
+    def perform_ocr(self, file_path=None, **options):
+        time.sleep(latency)
+        self.metadata = {"pipeline": "stub"}
+        self.markdown = FORMATTED
+        self.formatted = True
+
+    Processor.perform_ocr = perform_ocr
+
+def percentile(values: list[float], percentile: float) -> float:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * percentile))], 3)
+
+async def burst(requests: int, image_path: str) -> list[tuple[int, float]]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+
+        async def send() -> tuple[int, float]:
+            start = time.perf_counter()
+            response = await client.post("/process", json={"file_path": {"file_path": image_path}})
+            return response.status_code, time.perf_counter() - start
+
+        return await asyncio.gather(*(send() for _ in range(requests)))
+
+def run(mode: str, requests: int, image_path: str) -> dict:
+    controller = admission["image"]
+    if mode == "unbounded":
+        admission["image"] = AdmissionController("image", requests, requests)
+    try:
+        start = time.perf_counter()
+        results = asyncio.run(burst(requests, image_path))
+        elapsed = time.perf_counter() - start
+        metrics = admission["image"].snapshot()
+    finally:
+        admission["image"] = controller
+
+    accepted = [latency for status, latency in results if status == 200]
+    rejected = [latency for status, latency in results if status in (429, 503)]
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        "statuses": dict(sorted(statuses.items())),
+        "seconds": round(elapsed, 3),
+        "accepted_p50": percentile(accepted, 0.5),
+        "accepted_p99": percentile(accepted, 0.99),
+        "rejected_p50": percentile(rejected, 0.5),
+        "rejected_p99": percentile(rejected, 0.99),
+        "peak_queued": metrics["peak_queued"],
+        "wait_p99": metrics["wait_p99"],
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Requests sent at once")
+    parser.add_argument("--ocr-latency", type=float, default=0.5, help="Seconds the stubbed OCR takes")
+    args = parser.parse_args()
+
+    stub_ocr(args.ocr_latency)
+    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as image_file:
+        image_file.write(cv.imencode(".png", np.full((64, 64, 3), 255, np.uint8))[1].tobytes())
+
+    report = {mode: run(mode, args.requests, image_file.name) for mode in ("admission", "unbounded")}
+    os.unlink(image_file.name)
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Benchmarks the 'chain' pipeline (validation, OCR and formatting calls), with and without
+speculative OCR during validation, against the 'combined' pipeline (a single multimodal
+call) on end-to-end latency and accuracy.
+
+By default the remote providers are replaced by stubs that sleep for a configurable
+latency, so the benchmark measures the pipeline overhead and the number of round
+trips. With --live the real providers are called on --image.
+
+Accuracy is the share of the expected (test, result) pairs found in the output. The
+expected pairs come from --expected (a JSON object of test to result) or, when it is
+not given, from the output of the chain pipeline.
+
+Run from the project root:
+
+    python -m benchmarks.pipeline_modes --runs 5
+    python -m benchmarks.pipeline_modes --live --image report.jpg --expected expected.json
+"""
+from types import SimpleNamespace
+import argparse
+import json
+import statistics
+import tempfile
+import time
+import os
+import cv2 as cv
+import numpy as np
+import google.generativeai as genai
+
+from server.processor import Processor
+from server.modules import llama_ocr, rate_limiter
+
+REPORT_ROWS = [
+    ("Haemoglobin", "11.3", "gm/dl", "14 - 18"),
+    ("Total WBC Count", "5800", "/cmm", "4000 - 10000"),
+    ("Platelets", "246000", "/cmm", "150000 - 450000"),
+    ("Neutrophils", "52", "%", "40 - 75"),
+    ("Lymphocytes", "39", "%", "20 - 45"),
+]
+
+# Unstructured OCR output, which the local normalizer cannot fix.
+RAW_OCR = "# Clinical Analysis Lab\n" + "\n".join(
+    f"{test} {result} {unit} {reference_range}" for test, result, unit, reference_range in REPORT_ROWS
+)
+
+FORMATTED = "## **COMPLETE BLOOD COUNT**\n\n| TEST | RESULT | UNIT | REFERENCE RANGE |\n|---|---|---|---|\n" + "\n".join(
+    f"| {test} | {result} | {unit} | {reference_range} |" for test, result, unit, reference_range in REPORT_ROWS
+)
+
+class StubProviders:
+    """Replaces Gemini and Together AI with stubs that sleep and return canned responses."""
+
+    def __init__(self, validation_latency: float, ocr_latency: float, format_latency: float, combined_latency: float):
+        self.latencies = {
+            "validation": validation_latency,
+            "ocr": ocr_latency,
+            "format": format_latency,
+            "combined": combined_latency,
+        }
+        self.calls = 0
+
+    def respond(self, kind: str, text: str) -> str:
+        self.calls += 1
+        time.sleep(self.latencies[kind])
+        return text
+
+    def install(self) -> None:
+        stubs = self
+
+        class GenerativeModel:
+            def __init__(self, model_name):
+                self.model_name = model_name
+
+            def generate_content(self, contents, request_options=None):
+                prompt = contents[0] if isinstance(contents, list) else contents
+                if "respond only with 'valid'" in prompt:
+                    return SimpleNamespace(text=stubs.respond("validation", "valid"))
+                if isinstance(contents, list):
+                    return SimpleNamespace(text=stubs.respond("combined", f"VALID\n{FORMATTED}"))
+                return SimpleNamespace(text=stubs.respond("format", FORMATTED))
+
+        class Completions:
+            def create(self, model, messages):
+                message = SimpleNamespace(content=stubs.respond("ocr", RAW_OCR))
+                return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+        def together_client(**kwargs):
+            return SimpleNamespace(chat=SimpleNamespace(completions=Completions()))
+
+        genai.GenerativeModel = GenerativeModel
+        llama_ocr.together_client = together_client
+        # The stubs have no quota.
+        rate_limiter.RATE_LIMITS.clear()
+
+def make_report_image(path: str) -> None:
+    """Draws a noisy synthetic report, so that it goes through the full preprocessing."""
+    image = np.full((1400, 1000, 3), 255, np.uint8)
+    for i, row in enumerate(REPORT_ROWS):
+        cv.putText(image, "   ".join(row), (40, 100 + i * 60), cv.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 0), 2)
+    noise = np.random.default_rng(0).normal(0, 25, image.shape)
+    cv.imwrite(path, np.clip(image + noise, 0, 255).astype(np.uint8))
+
+def extract_results(data: list[dict]) -> dict:
+    """Flattens the processor output into a test to result mapping."""
+    return {test: values["result"] for entry in data or [] for test, values in entry.items()}
+
+def accuracy(results: dict, expected: dict) -> float:
+    if not expected:
+        return None
+    matches = sum(
+        1 for test, value in expected.items()
+        if test in results and abs(float(results[test]) - float(value)) < 1e-6
+    )
+    return matches / len(expected)
+
+# Benchmarked modes: (pipeline, speculative)
+MODES = {
+    "chain": ("chain", "off"),
+    "chain_speculative": ("chain", "preprocessed"),
+    "chain_speculative_both": ("chain", "both"),
+    "combined": ("combined", "off"),
+}
+
+def run(image_path: str, pipeline: str, speculative: str = "off") -> tuple[float, dict]:
+    processor = Processor()
+    start = time.perf_counter()
+    processor.perform_ocr(image_path, pipeline=pipeline, speculative=speculative)
+    data = processor.process()
+    return time.perf_counter() - start, extract_results(data)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--live", action="store_true", help="Call the real providers")
+    parser.add_argument("--image", help="Report image, required with --live")
+    parser.add_argument("--expected", help="JSON file mapping tests to their expected results")
+    parser.add_argument("--validation-latency", type=float, default=0.8)
+    parser.add_argument("--ocr-latency", type=float, default=2.5)
+    parser.add_argument("--format-latency", type=float, default=2.0)
+    parser.add_argument("--combined-latency", type=float, default=3.0)
+    args = parser.parse_args()
+
+    stubs = None
+    if args.live:
+        if not args.image:
+            parser.error("--image is required with --live")
+        image_path = args.image
+    else:
+        stubs = StubProviders(args.validation_latency, args.ocr_latency, args.format_latency, args.combined_latency)
+        stubs.install()
+        image_path = os.path.join(tempfile.mkdtemp(), "report.png")
+        make_report_image(image_path)
+
+    expected = None
+    if args.expected:
+        with open(args.expected) as expected_file:
+            expected = json.load(expected_file)
+
+    report = {}
+    for mode, (pipeline, speculative) in MODES.items():
+        latencies, scores, calls = [], [], 0
+        for _ in range(args.runs):
+            calls_before = stubs.calls if stubs else 0
+            latency, results = run(image_path, pipeline, speculative)
+            calls += (stubs.calls - calls_before) if stubs else 0
+            if expected is None and mode == "chain":
+                expected = results
+            latencies.append(latency)
+            scores.append(accuracy(results, expected))
+
+        report[mode] = {
+            "latency_mean": round(statistics.mean(latencies), 3),
+            "latency_p50": round(statistics.median(latencies), 3),
+            "latency_max": round(max(latencies), 3),
+            "accuracy": statistics.mean(scores) if None not in scores else None,
+            "remote_calls_per_report": calls / args.runs if stubs else None,
+        }
+
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
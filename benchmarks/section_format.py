@@ -0,0 +1,146 @@
+"""
+Benchmarks formatting multi-section reports, from a single panel up to a full health
+package (CBC to vitamin profile), in a single call against section-parallel formatting.
+
+The formatting model is replaced by a stub that sleeps for --call-latency seconds,
+plus --input-token-latency seconds per token of the prompt, which repeats the
+instructions in every call, plus --token-latency seconds per output token. It turns
+every test line into a table row. No remote model is called.
+
+For every report size, reports the estimated tokens of the minimized markdown that
+plan_sections sees, the number of parts and the wall-clock time of the formatting
+with the shipped settings against a single call, and whether the parsed rows are the
+same, in the same order. --min-tokens and --parallelism override the settings.
+
+Run from the project root:
+
+    python -m benchmarks.section_format
+"""
+from functools import partial
+import argparse
+import json
+import statistics
+import time
+import re
+import os
+
+os.environ["WARM_UP"] = "0"
+
+import server.processor as processor_module
+from server.processor import Processor
+from server.modules.sections import plan_sections, FORMAT_PARALLELISM, PARALLEL_FORMAT_MIN_TOKENS
+from server.modules.prompt_minimizer import estimate_tokens, minimize_markdown
+from server.modules.format_data import build_prompt
+
+# A test line of the synthetic report: name, result, unit and reference range.
+TEST_LINE = re.compile(r"^(.+) (\S+) (\S+) (\S+ - \S+)$")
+
+PANELS = {
+    "COMPLETE BLOOD COUNT": [
+        ("Haemoglobin", "11.3", "gm/dl", "14 - 18"), ("Total WBC Count", "5800", "/cmm", "4000 - 10000"),
+        ("Platelets", "246000", "/cmm", "150000 - 450000"), ("Neutrophils", "52", "%", "40 - 75"),
+        ("Lymphocytes", "39", "%", "20 - 45"), ("Eosinophils", "1", "%", "1 - 6"),
+        ("Monocytes", "8", "%", "2 - 10"), ("Packed Cell Volume", "32.7", "%", "40 - 54"),
+    ],
+    "LIVER FUNCTION TEST": [
+        ("Bilirubin Total", "0.8", "mg/dl", "0.2 - 1.2"), ("Bilirubin Direct", "0.2", "mg/dl", "0 - 0.3"),
+        ("SGOT", "32", "U/L", "5 - 40"), ("SGPT", "41", "U/L", "5 - 45"),
+        ("Alkaline Phosphatase", "98", "U/L", "40 - 130"), ("Total Protein", "7.1", "g/dl", "6 - 8.3"),
+        ("Albumin", "4.2", "g/dl", "3.5 - 5.2"), ("Globulin", "2.9", "g/dl", "2 - 3.5"),
+    ],
+    "KIDNEY FUNCTION TEST": [
+        ("Blood Urea", "28", "mg/dl", "15 - 40"), ("Serum Creatinine", "0.9", "mg/dl", "0.6 - 1.3"),
+        ("Uric Acid", "5.6", "mg/dl", "3.5 - 7.2"), ("Sodium", "139", "mmol/L", "135 - 145"),
+        ("Potassium", "4.3", "mmol/L", "3.5 - 5.1"), ("Chloride", "102", "mmol/L", "98 - 107"),
+    ],
+    "LIPID PROFILE": [
+        ("Total Cholesterol", "212", "mg/dl", "0 - 200"), ("Triglycerides", "168", "mg/dl", "0 - 150"),
+        ("HDL Cholesterol", "42", "mg/dl", "40 - 60"), ("LDL Cholesterol", "136", "mg/dl", "0 - 100"),
+        ("VLDL Cholesterol", "34", "mg/dl", "0 - 30"),
+    ],
+    "THYROID PROFILE": [
+        ("Total T3", "1.2", "ng/ml", "0.8 - 2"), ("Total T4", "8.1", "ug/dl", "5.1 - 14.1"),
+        ("TSH", "3.4", "uIU/ml", "0.27 - 4.2"),
+    ],
+    "URINE ROUTINE": [
+        ("Specific Gravity", "1.015", "-", "1.005 - 1.030"), ("Urine pH", "6.0", "-", "5 - 8"),
+        ("Pus Cells", "2", "/hpf", "0 - 5"), ("Epithelial Cells", "1", "/hpf", "0 - 5"),
+    ],
+    "IRON STUDIES": [
+        ("Serum Iron", "48", "ug/dl", "60 - 170"), ("TIBC", "410", "ug/dl", "250 - 450"),
+        ("Transferrin Saturation", "11.7", "%", "20 - 50"), ("Ferritin", "9", "ng/ml", "30 - 400"),
+    ],
+    "DIABETES PROFILE": [
+        ("Fasting Blood Sugar", "104", "mg/dl", "70 - 100"), ("Post Prandial Blood Sugar", "142", "mg/dl", "70 - 140"),
+        ("HbA1c", "6.1", "%", "4 - 5.6"), ("Mean Blood Glucose", "128", "mg/dl", "90 - 120"),
+    ],
+    "VITAMIN PROFILE": [
+        ("Vitamin B12", "182", "pg/ml", "211 - 911"), ("Vitamin D Total", "14.2", "ng/ml", "30 - 100"),
+    ],
+}
+
+def make_report(panels: int = len(PANELS)) -> str:
+    lines = ["# **City Diagnostics**", "", "### **NAME: John Doe**", "### **AGE: 45 Years**", "### **DATE: 23/11/2024**", ""]
+    for panel, rows in list(PANELS.items())[:panels]:
+        lines += [f"### **{panel}**", ""]
+        # Written as plain text, as the OCR sometimes does, so it needs the LLM.
+        lines += [f"{name} {result} {unit} {reference}" for name, result, unit, reference in rows]
+        lines.append("")
+    return "\n".join(lines)
+
+def stub_format(call_latency: float, input_token_latency: float, token_latency: float):
+    def format_markdown(markdown: str, model_name: str = None) -> str:
+        output = []
+        for line in markdown.split("\n"):
+            match = TEST_LINE.match(line)
+            if match:
+                output += ["| " + " | ".join(match.groups()) + " |"]
+            elif line.startswith("#"):
+                output += ["", line, "", "| TEST | RESULT | UNIT | REFERENCE RANGE |", "|---|---|---|---|"]
+        formatted = "\n".join(output)
+        input_tokens = estimate_tokens(build_prompt(markdown))
+        time.sleep(call_latency + input_token_latency * input_tokens + token_latency * estimate_tokens(formatted))
+        return formatted
+
+    processor_module.format_markdown = format_markdown
+
+def run(markdown: str, parallelism: int, min_tokens: int) -> tuple[float, int, list]:
+    processor_module.plan_sections = partial(plan_sections, max_parallel=parallelism, min_tokens=min_tokens)
+    processor = Processor()
+    processor.metadata = {}
+    start = time.perf_counter()
+    processor.format_markdown(markdown)
+    elapsed = time.perf_counter() - start
+    rows = processor.process_chunks()
+    return elapsed, len(processor.metadata.get("format_parts", [None])), rows["test"].tolist()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=1, help="Runs per report size and mode")
+    parser.add_argument("--call-latency", type=float, default=0.3, help="Seconds of every stubbed call")
+    parser.add_argument("--input-token-latency", type=float, default=0.0002, help="Seconds per prompt token of the stub")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Seconds per output token of the stub")
+    parser.add_argument("--parallelism", type=int, default=FORMAT_PARALLELISM, help="Most sections formatted at once")
+    parser.add_argument("--min-tokens", type=int, default=PARALLEL_FORMAT_MIN_TOKENS, help="Shorter reports are formatted in a single call")
+    args = parser.parse_args()
+
+    stub_format(args.call_latency, args.input_token_latency, args.token_latency)
+    report = {"parallelism": args.parallelism, "min_tokens": args.min_tokens, "reports": []}
+    for panels in range(1, len(PANELS) + 1):
+        markdown = make_report(panels)
+        size = {"panels": panels, "estimated_tokens": estimate_tokens(minimize_markdown(markdown)[0])}
+        rows = {}
+        for mode, parallelism in (("single_call", 1), ("section_parallel", args.parallelism)):
+            results = [run(markdown, parallelism, args.min_tokens) for _ in range(args.runs)]
+            rows[mode] = results[0][2]
+            size[mode] = {
+                "parts": results[0][1],
+                "seconds_median": round(statistics.median(elapsed for elapsed, _, _ in results), 3),
+            }
+        size["rows"] = len(rows["single_call"])
+        size["same_rows_in_order"] = rows["single_call"] == rows["section_parallel"]
+        report["reports"].append(size)
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
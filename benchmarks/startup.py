@@ -0,0 +1,87 @@
+"""
+Benchmarks the cold start of an API worker: the time to import the app, to run its
+startup, and the latency of the first requests.
+
+Every run starts a fresh interpreter, so nothing is cached in memory. The first
+/process request converts markdown which the local normalizer can format, so no
+remote model is called and the result store is a temporary database.
+
+Run from the project root:
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --runs 5 --no-warm-up
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+MARKDOWN = """## **COMPLETE BLOOD COUNT**
+
+| TEST | RESULT | UNIT | REFERENCE RANGE |
+|---|---|---|---|
+| Haemoglobin | 11.3 | gm/dl | 14 - 18 |
+| Total WBC Count | 5800 | /cmm | 4000 - 10000 |
+| Platelets | 246000 | /cmm | 150000 - 450000 |
+"""
+
+# Runs in the fresh interpreter, prints the timings as JSON.
+RUN = """
+import json, sys, time
+from fastapi.testclient import TestClient
+
+start = time.perf_counter()
+import server.api
+imported = time.perf_counter()
+with TestClient(server.api.app) as client:
+    ready = time.perf_counter()
+    client.get("/")
+    root = time.perf_counter()
+    response = client.post("/process", json={"input_data": {"markdown": sys.argv[1]}})
+    processed = time.perf_counter()
+
+print(json.dumps({
+    "import": imported - start,
+    "startup": ready - imported,
+    "first_root_request": root - ready,
+    "first_process_request": processed - root,
+    "ready": ready - start,
+    "process_status": response.status_code,
+}))
+"""
+
+def run_once(warm_up: bool) -> dict:
+    environment = {
+        **os.environ,
+        "WARM_UP": "1" if warm_up else "0",
+        "RESULTS_DB": os.path.join(tempfile.mkdtemp(), "results.db"),
+        "PYTHONWARNINGS": "ignore",
+    }
+    completed = subprocess.run(
+        [sys.executable, "-c", RUN, MARKDOWN], env=environment, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-warm-up", action="store_true", help="Do not import the pipeline in the background on startup")
+    args = parser.parse_args()
+
+    runs = [run_once(not args.no_warm_up) for _ in range(args.runs)]
+    report = {
+        name: {
+            "mean": round(statistics.mean(run[name] for run in runs), 3),
+            "p50": round(statistics.median(run[name] for run in runs), 3),
+            "max": round(max(run[name] for run in runs), 3),
+        }
+        for name in ("import", "startup", "ready", "first_root_request", "first_process_request")
+    }
+    report["process_status"] = sorted({run["process_status"] for run in runs})
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
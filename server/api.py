@@ -1,9 +1,24 @@
-from fastapi import FastAPI
+from dotenv import load_dotenv
+
+# Load environment variables before the modules read their settings
+load_dotenv()
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from .routes import router
+from contextlib import asynccontextmanager
+from .routes import router, get_processor
+from .modules.providers import warm_up
+from .modules.image_fetcher import close_client
+from .modules.model_executor import executor
+from .modules.ocr_backends import OCR_BACKENDS
+from .modules.result_store import result_store
+from .modules.tracing import start_trace, exporter
+from .modules.profiler import profiler, install_signal_handler
+import threading
 import logging
 import colorlog
+import os
 
 logger = logging.getLogger("server")
 logger.setLevel(logging.DEBUG)
@@ -36,11 +51,38 @@ handler.setFormatter(formatter)
 if not logger.hasHandlers():
     logger.addHandler(handler)
 
+def warm_up_pipeline() -> None:
+    """Imports the processing pipeline and the provider SDKs ahead of the first request."""
+    get_processor()
+    warm_up()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts serving without waiting for the pipeline and the provider SDKs, which are
+    imported in the background (unless WARM_UP=0), lets SIGUSR2 start a profile, and
+    releases the shared clients and pools and writes the queued traces on shutdown.
+    """
+    if os.environ.get("WARM_UP", "1") != "0":
+        threading.Thread(target=warm_up_pipeline, name="warm-up", daemon=True).start()
+    if threading.current_thread() is threading.main_thread():
+        install_signal_handler()
+    yield
+    logger.info("Shutting down...")
+    close_client()
+    executor.shutdown()
+    for backend in OCR_BACKENDS.values():
+        if hasattr(backend, "shutdown"):
+            backend.shutdown()
+    result_store.close()
+    exporter.close()
+
 # Initialize FastAPI app with metadata
 app = FastAPI(
     title="TATA Blood Report Processor API",
     description="An API to process blood report markdown and extract structured data.",
-    version="1.2.0"
+    version="1.2.0",
+    lifespan=lifespan,
 )
 
 # Add CORS middleware (optional but useful)
@@ -52,6 +94,23 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers (Authorization, Content-Type, etc.)
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Traces the processing requests, and counts them for the profiles limited to a number
+    of requests. The trace continues the caller's W3C traceparent header, if any, and its
+    id is returned in the X-Trace-Id header.
+    """
+    if not request.url.path.startswith("/process"):
+        return await call_next(request)
+    with start_trace(f"{request.method} {request.url.path}", traceparent=request.headers.get("traceparent"), http_method=request.method, http_route=request.url.path) as root:
+        response = await call_next(request)
+        if root:
+            root.set_attributes(http_status_code=response.status_code)
+            response.headers["X-Trace-Id"] = root.trace.trace_id
+    profiler.request_finished()
+    return response
+
 # Include the router
 app.include_router(router)
 
@@ -0,0 +1,372 @@
+"""
+Command line entry point for processing reports without the HTTP API.
+
+Run from the project root:
+
+    python -m server.cli process report.jpg
+    python -m server.cli reprocess
+    python -m server.cli reprocess --report 3f2a9c0d1e4b5a67 --force classify
+    python -m server.cli backfill archive/ --processes 4 --threads 8 --output results.jsonl
+    python -m server.cli aliases list
+    python -m server.cli aliases export reviewed_aliases.json --min-hits 3
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import Counter
+from functools import partial
+from itertools import islice
+from typing import Iterable, Iterator
+import argparse
+import json
+import re
+import time
+import os
+import logging
+from pathlib import Path
+from dotenv import load_dotenv
+
+from .processor import Processor
+from .modules.artifacts import ArtifactStore, STAGES, report_id_for
+from .modules.result_store import ResultStore, RESULTS_DB
+from .modules.alias_cache import AliasCache, ALIAS_CACHE_PATH
+from .modules import rate_limiter
+
+logger = logging.getLogger("server")
+
+# Extensions of the files read as OCR markdown rather than images.
+MARKDOWN_EXTENSIONS = {".md", ".markdown", ".txt"}
+
+# Results of a backfill are stored in batches of this many reports.
+STORE_BATCH_SIZE = 100
+
+# Extensions of the report files picked up when walking a directory.
+REPORT_EXTENSIONS = {".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp", ".pdf"} | MARKDOWN_EXTENSIONS
+
+# Report ids given in a manifest, used as the directory of the report artifacts.
+REPORT_ID = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9._-]{0,127}$")
+
+def process_report(store: ArtifactStore, source: str, force: list[str] = None, report_id: str = None, **ocr_options) -> tuple[str, Processor]:
+    """
+    Processes a report through the stages, reusing its up to date artifacts.
+
+    Args:
+        store (ArtifactStore): Store of the stage artifacts.
+        source (str): Path or URL of an image, or path of a markdown file.
+        force (list[str], optional): Stages to recompute even if their output is up to date.
+        report_id (str, optional): Id to process the report under. Defaults to the id
+            derived from the source.
+        **ocr_options: Options of `Processor.perform_ocr`.
+
+    Returns:
+        tuple[str, Processor]: The id of the report, and the processor holding its data and metadata.
+    """
+    if report_id is not None and not REPORT_ID.match(report_id):
+        raise ValueError(f"Invalid report id: {report_id!r}")
+    processor = Processor()
+    if Path(source).suffix.lower() in MARKDOWN_EXTENSIONS:
+        markdown = Path(source).read_text(encoding="utf-8")
+        report_id = report_id or report_id_for(markdown)
+        processor.run_stages(store, report_id, markdown=markdown, force=force)
+    else:
+        report_id = report_id or report_id_for(source)
+        processor.run_stages(store, report_id, source=source, force=force, **ocr_options)
+    return report_id, processor
+
+def get_result_store(args: argparse.Namespace) -> ResultStore:
+    """Returns the store the results are saved to, or None with --no-store."""
+    return None if args.no_store else ResultStore(args.results_db)
+
+def process_command(args: argparse.Namespace) -> None:
+    store = ArtifactStore(args.artifacts)
+    results = get_result_store(args)
+    ocr_options = {"tile": args.tile, "ocr_backend": args.ocr_backend, "pipeline": args.pipeline}
+    for source in args.sources:
+        report_id, processor = process_report(store, source, force=args.force, **ocr_options)
+        if results:
+            results.save_report(report_id, processor.data, source=source, metadata=processor.metadata)
+        print(json.dumps({"report_id": report_id, "source": source, "data": processor.data, "metadata": processor.metadata}, default=str))
+
+def reprocess_command(args: argparse.Namespace) -> None:
+    store = ArtifactStore(args.artifacts)
+    results = get_result_store(args)
+    report_ids = args.report or store.reports()
+    counts = Counter()
+    failed = []
+    for report_id in report_ids:
+        processor = Processor()
+        try:
+            processor.run_stages(store, report_id, force=args.force)
+        except Exception as e:
+            logger.error(f"Error while reprocessing report {report_id}: {e}")
+            failed.append(report_id)
+            continue
+        stages = processor.metadata["stages"]
+        if results and stages["convert"] == "computed":
+            # Keep the patient and lab the report was stored with.
+            stored = results.get_report(report_id) or {}
+            results.save_report(
+                report_id, processor.data, patient_id=stored.get("patient_id"), lab_id=stored.get("lab_id"),
+                report_date=stored.get("report_date"), source=stored.get("source"), metadata=processor.metadata,
+            )
+        counts.update(f"{stage}_{status}" for stage, status in stages.items())
+        print(json.dumps({"report_id": report_id, "stages": stages}))
+
+    print(json.dumps({"reports": len(report_ids), "failed": failed, **dict(sorted(counts.items()))}, indent=4))
+
+def find_reports(path: str) -> Iterator[dict]:
+    """
+    Lists the reports of a backfill.
+
+    Args:
+        path (str): A directory, walked recursively for report files, or a manifest
+            file listing one report per line: either its path or URL, or a JSON object
+            with a 'source' and optionally the 'report_id', 'patient_id', 'lab_id' and
+            'report_date' to store its results with. Blank lines and lines starting
+            with '#' are skipped.
+
+    Yields:
+        dict: Every report, with at least its 'source'.
+    """
+    if os.path.isdir(path):
+        for root, directories, files in os.walk(path):
+            directories.sort()
+            for name in sorted(files):
+                if Path(name).suffix.lower() in REPORT_EXTENSIONS:
+                    yield {"source": os.path.join(root, name)}
+        return
+
+    with open(path, "r", encoding="utf-8") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            yield json.loads(line) if line.startswith("{") else {"source": line}
+
+def load_checkpoint(path: str) -> set[str]:
+    """Returns the reports recorded as successfully processed in a checkpoint file."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as checkpoint:
+        for line in checkpoint:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Line cut short by an interrupted run.
+                continue
+            if entry.get("status") == "ok":
+                done.add(entry["source"])
+    return done
+
+def batches(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def init_backfill_worker(processes: int) -> None:
+    """Shares the rate limits of the providers between the worker processes."""
+    for name in rate_limiter.RATE_LIMITS:
+        rate_limiter.RATE_LIMITS[name] /= processes
+
+def backfill_report(report: dict, artifacts: str = None, force: list[str] = None, **ocr_options) -> dict:
+    """
+    Processes one report of a backfill at batch priority, so that interactive API
+    requests sharing the rate limits go first.
+
+    Artifacts, checkpoint and results all use the 'report_id' of the manifest when
+    it has one, so that `reprocess` later updates the same results.
+
+    Args:
+        report (dict): The report, as listed by `find_reports`.
+
+    Returns:
+        dict: The report with its status, and its data and metadata or the error.
+    """
+    start = time.perf_counter()
+    source = report["source"]
+    with rate_limiter.priority(rate_limiter.BATCH):
+        try:
+            report_id, processor = process_report(
+                ArtifactStore(artifacts), source, force=force, report_id=report.get("report_id"), **ocr_options
+            )
+            result = {**report, "report_id": report_id, "status": "ok", "data": processor.data, "metadata": processor.metadata}
+        except Exception as e:
+            logger.error(f"Error while processing {source}: {e}")
+            result = {**report, "status": "error", "error": str(e)}
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+def backfill_batch(reports: list[dict], threads: int = 1, **options) -> list[dict]:
+    """Processes a batch of reports with a pool of threads, inside a worker process."""
+    if threads <= 1:
+        return [backfill_report(report, **options) for report in reports]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(partial(backfill_report, **options), reports))
+
+def run_backfill(reports: Iterable[dict], processes: int = 1, threads: int = 1, batch_size: int = None, **options) -> Iterator[dict]:
+    """
+    Processes reports in parallel, yielding every result as soon as it is ready.
+
+    With several processes, reports are sent to the workers in batches which are
+    processed by `threads` threads each. Only a bounded number of batches is in
+    flight, so the list of reports is consumed lazily.
+
+    Args:
+        reports (Iterable[dict]): The reports, as listed by `find_reports`.
+        processes (int, optional): Worker processes, for the CPU bound stages.
+        threads (int, optional): Threads per process, for the remote model calls.
+        batch_size (int, optional): Reports per batch. Defaults to twice the threads.
+        **options: Options of `backfill_report`.
+
+    Yields:
+        dict: The result of every report, in completion order.
+    """
+    if processes > 1:
+        pool = ProcessPoolExecutor(max_workers=processes, initializer=init_backfill_worker, initargs=(processes,))
+        task = partial(backfill_batch, threads=threads, **options)
+        items = batches(reports, batch_size or 2 * threads)
+        max_in_flight = 2 * processes
+    else:
+        pool = ThreadPoolExecutor(max_workers=threads)
+        task = partial(backfill_batch, **options)
+        items = batches(reports, 1)
+        max_in_flight = 2 * threads
+
+    with pool:
+        pending = set()
+        for item in items:
+            pending.add(pool.submit(task, item))
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        for future in pending:
+            yield from future.result()
+
+def backfill_command(args: argparse.Namespace) -> None:
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint"
+    done = load_checkpoint(checkpoint_path)
+    reports = (report for report in find_reports(args.path) if report["source"] not in done)
+    if done:
+        logger.warning(f"Resuming backfill, skipping {len(done)} processed reports")
+
+    options = {
+        "artifacts": args.artifacts,
+        "force": args.force,
+        "tile": args.tile,
+        "ocr_backend": args.ocr_backend,
+        "pipeline": args.pipeline,
+    }
+    results = get_result_store(args)
+    counts = Counter()
+    start = time.perf_counter()
+    with open(args.output, "a", encoding="utf-8") as output, open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+
+        def record(batch: list[dict]) -> None:
+            """Stores a batch of results, then marks its reports as done."""
+            if results:
+                results.save_reports([result for result in batch if result["status"] == "ok"])
+            # Written last, so that a report is never recorded as done without its results.
+            for result in batch:
+                checkpoint.write(json.dumps({"source": result["source"], "status": result["status"], "report_id": result.get("report_id")}) + "\n")
+            checkpoint.flush()
+
+        pending = []
+        for result in run_backfill(reports, args.processes, args.threads, args.batch_size, **options):
+            output.write(json.dumps(result, default=str) + "\n")
+            output.flush()
+            pending.append(result)
+            if len(pending) >= (STORE_BATCH_SIZE if results else 1):
+                record(pending)
+                pending = []
+            counts[result["status"]] += 1
+            if sum(counts.values()) % 100 == 0:
+                logger.warning(f"Backfilled {sum(counts.values())} reports ({dict(counts)})")
+        record(pending)
+
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    print(json.dumps({
+        "processed": total,
+        "skipped": len(done),
+        **counts,
+        "seconds": round(elapsed, 3),
+        "reports_per_second": round(total / elapsed, 3) if elapsed else None,
+    }, indent=4))
+
+def aliases_command(args: argparse.Namespace) -> None:
+    cache = AliasCache(args.cache)
+    if args.action == "list":
+        for entry in cache.entries()[:args.limit]:
+            print(json.dumps(entry))
+    elif args.action == "export":
+        exported = cache.export(min_hits=args.min_hits)
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(exported, output, indent=4)
+        print(json.dumps({"exported": sum(len(aliases) for aliases in exported.values()), "output": args.output}))
+    elif args.action == "remove":
+        print(json.dumps({"removed": cache.remove(args.phrases)}))
+    elif args.action == "clear":
+        cache.clear()
+        print(json.dumps({"removed": "all"}))
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--artifacts", help="Directory of the stage artifacts")
+    parser.add_argument("--results-db", default=RESULTS_DB, help="SQLite database the results are stored in")
+    parser.add_argument("--no-store", action="store_true", help="Do not store the results in the database")
+    parser.add_argument("--log-level", default="WARNING")
+    stage_names = [stage.name for stage in STAGES]
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    process_parser = subparsers.add_parser("process", help="Process reports and persist their stage artifacts")
+    process_parser.add_argument("sources", nargs="+", help="Images, URLs or markdown files")
+    process_parser.add_argument("--tile", action="store_true")
+    process_parser.add_argument("--ocr-backend")
+    process_parser.add_argument("--pipeline", choices=["chain", "combined"], default="chain")
+    process_parser.add_argument("--force", action="append", choices=stage_names, help="Recompute this stage")
+    process_parser.set_defaults(handler=process_command)
+
+    reprocess_parser = subparsers.add_parser(
+        "reprocess", help="Recompute the stages of processed reports whose code or data version changed"
+    )
+    reprocess_parser.add_argument("--report", action="append", help="Id of a report, all reports by default")
+    reprocess_parser.add_argument("--force", action="append", choices=stage_names, help="Recompute this stage")
+    reprocess_parser.set_defaults(handler=reprocess_command)
+
+    backfill_parser = subparsers.add_parser(
+        "backfill", help="Process an archive of reports in parallel, resuming from a checkpoint"
+    )
+    backfill_parser.add_argument("path", help="Directory of reports, or manifest file with one path or URL per line")
+    backfill_parser.add_argument("--output", default="backfill_results.jsonl", help="JSON lines file the results are appended to")
+    backfill_parser.add_argument("--checkpoint", help="Checkpoint file, '<output>.checkpoint' by default")
+    backfill_parser.add_argument("--processes", type=int, default=1, help="Worker processes")
+    backfill_parser.add_argument("--threads", type=int, default=4, help="Threads per worker process")
+    backfill_parser.add_argument("--batch-size", type=int, help="Reports sent to a worker process at once")
+    backfill_parser.add_argument("--tile", action="store_true")
+    backfill_parser.add_argument("--ocr-backend")
+    backfill_parser.add_argument("--pipeline", choices=["chain", "combined"], default="chain")
+    backfill_parser.add_argument("--force", action="append", choices=stage_names, help="Recompute this stage")
+    backfill_parser.set_defaults(handler=backfill_command)
+
+    aliases_parser = subparsers.add_parser("aliases", help="Review the aliases learned from fuzzy phrase matches")
+    aliases_parser.add_argument("--cache", default=ALIAS_CACHE_PATH, help="File of the learned aliases")
+    aliases_actions = aliases_parser.add_subparsers(dest="action", required=True)
+    list_parser = aliases_actions.add_parser("list", help="Print the aliases, most recently used first")
+    list_parser.add_argument("--limit", type=int, help="Most aliases printed")
+    export_parser = aliases_actions.add_parser("export", help="Write the aliases in the format of phrase.json")
+    export_parser.add_argument("output", help="JSON file the aliases are written to")
+    export_parser.add_argument("--min-hits", type=int, default=0, help="Leave out the aliases used fewer times")
+    remove_parser = aliases_actions.add_parser("remove", help="Forget wrong aliases")
+    remove_parser.add_argument("phrases", nargs="+")
+    aliases_actions.add_parser("clear", help="Forget all aliases")
+    aliases_parser.set_defaults(handler=aliases_command)
+    return parser
+
+def main() -> None:
+    args = build_parser().parse_args()
+    load_dotenv()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s - %(levelname)-8s - %(module)s: %(message)s")
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,61 @@
 from pydantic import BaseModel, HttpUrl, field_validator
+from typing import Literal, Optional
+from datetime import date
 import os
+from .modules.image_fetcher import is_allowed_host
+from .modules.ocr_backends import available_backends, DEFAULT_BACKEND
 # Define a Pydantic model for the input data
 class Markdown(BaseModel):
     markdown: str
 
-class FilePath(BaseModel):
+class ReportInfo(BaseModel):
+    """Identifiers the processed results are stored and looked up with."""
+    report_id: Optional[str] = None  # Derived from the file or markdown when not given
+    patient_id: Optional[str] = None
+    lab_id: Optional[str] = None
+    report_date: Optional[date] = None
+
+class OCROptions(BaseModel):
+    tile: bool = False  # Split very tall or dense pages into tiles for OCR
+    ocr_backend: str = DEFAULT_BACKEND  # OCR engine, e.g. 'llama' or 'tesseract'
+    pipeline: Literal["chain", "combined"] = "chain"  # Separate validation/OCR/formatting calls, or a single one
+    speculative: Literal["off", "preprocessed", "both"] = "off"  # Start OCR while the preprocessed image is validated
+
+    @field_validator("ocr_backend")
+    def validate_ocr_backend(cls, value):
+        """
+        Validates that the OCR backend is registered.
+        """
+        if value not in available_backends():
+            raise ValueError(f"Unknown OCR backend: {value}. Available backends: {available_backends()}")
+        return value
+
+    def ocr_options(self) -> dict:
+        """Returns the keyword arguments of `Processor.perform_ocr`."""
+        return {"tile": self.tile, "ocr_backend": self.ocr_backend, "pipeline": self.pipeline, "speculative": self.speculative}
+
+class UploadOptions(OCROptions, ReportInfo):
+    """Query parameters of an uploaded report."""
+
+class FilePath(OCROptions):
     file_path: str
+
     @field_validator("file_path")
     def validate_file_path(cls, value):
         """
         Validates the file path.
         - If it's a local path, checks if the file exists.
-        - If it's a URL, checks if it's a valid HTTP(S) URL.
+        - If it's a URL, checks if it's a valid HTTP(S) URL from an allowed host.
         """
         if value.startswith(("http://", "https://")):
             # Validate URL using Pydantic
-            return HttpUrl(value)
+            url = HttpUrl(value)
+            if not is_allowed_host(str(url)):
+                raise ValueError(f"Host is not allowed: {url.host}")
+            return str(url)
         
         # Validate local file path
         if not os.path.exists(value):
             raise ValueError(f"File does not exist: {value}")
 
-        return value
+        return value
\ No newline at end of file
@@ -0,0 +1,170 @@
+from contextlib import asynccontextmanager
+from collections import deque
+import asyncio
+import math
+import time
+import os
+import logging
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Default requests processed at once and waiting per pipeline. Markdown only goes
+# through formatting, images and PDFs also through preprocessing and OCR.
+DEFAULT_MAX_IN_FLIGHT = {"markdown": 16, "image": 4}
+DEFAULT_MAX_QUEUED = {"markdown": 32, "image": 8}
+
+# Seconds a request may wait in the queue before it is turned away.
+QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 10))
+
+# Requests the wait and service times are measured over.
+LATENCY_WINDOW = 200
+
+def parse_limits(value: str) -> dict:
+    """
+    Parses limits written as 'pipeline=count,pipeline=count'.
+
+    Args:
+        value (str): The limits.
+
+    Returns:
+        dict: Limit by pipeline.
+    """
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, count = item.split("=", 1)
+            limits[name.strip()] = int(count)
+    return limits
+
+MAX_IN_FLIGHT = {**DEFAULT_MAX_IN_FLIGHT, **parse_limits(os.environ.get("MAX_IN_FLIGHT", ""))}
+MAX_QUEUED = {**DEFAULT_MAX_QUEUED, **parse_limits(os.environ.get("MAX_QUEUED", ""))}
+
+class Overloaded(Exception):
+    """Raised when a request is not admitted."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Bounds the requests of a pipeline processed at once.
+
+    Requests beyond `max_in_flight` wait in a FIFO queue of `max_queued` requests.
+    A request finding the queue full is rejected right away (429), one that waited
+    `queue_timeout` seconds without being admitted is turned away (503). Both come
+    with the number of seconds after which a retry is likely to be admitted.
+
+    Runs on the event loop: the counters are only changed from its thread.
+    """
+
+    def __init__(self, name: str, max_in_flight: int, max_queued: int, queue_timeout: float = QUEUE_TIMEOUT, window: int = LATENCY_WINDOW):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiters = deque()
+        self.wait_times = deque(maxlen=window)
+        self.service_times = deque(maxlen=window)
+        self.counts = {"admitted": 0, "waited": 0, "rejected": 0, "timed_out": 0}
+        self.peak_queued = 0
+
+    def retry_after(self) -> int:
+        """Estimates the seconds until a new request would be admitted, from the recent service times."""
+        service_time = sorted(self.service_times)[len(self.service_times) // 2] if self.service_times else 1.0
+        rounds = (len(self.waiters) + 1) / max(self.max_in_flight, 1)
+        return max(1, math.ceil(service_time * rounds))
+
+    async def acquire(self) -> None:
+        """
+        Waits for a slot of the pipeline.
+
+        Raises:
+            Overloaded: If the queue is full or no slot was freed in time.
+        """
+        start = time.monotonic()
+        if self.in_flight < self.max_in_flight and not self.waiters:
+            self.in_flight += 1
+            self.counts["admitted"] += 1
+            self.wait_times.append(0.0)
+            return
+
+        if len(self.waiters) >= self.max_queued:
+            self.counts["rejected"] += 1
+            logger.warning(f"Rejected a '{self.name}' request, {self.in_flight} in flight and {len(self.waiters)} queued")
+            raise Overloaded(f"Too many '{self.name}' requests, retry later", 429, self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.counts["waited"] += 1
+        self.peak_queued = max(self.peak_queued, len(self.waiters))
+        try:
+            # The slot is handed over by `release`, which resolves the future.
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counts["timed_out"] += 1
+            logger.warning(f"A '{self.name}' request waited {self.queue_timeout}s without being admitted")
+            raise Overloaded(f"The '{self.name}' pipeline is overloaded, retry later", 503, self.retry_after())
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the client went away.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+        self.counts["admitted"] += 1
+        self.wait_times.append(time.monotonic() - start)
+
+    def release(self) -> None:
+        """Frees a slot, handing it over to the oldest waiting request."""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def admit(self):
+        """Holds a slot of the pipeline for the duration of the block."""
+        with span("admission", pipeline=self.name):
+            await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.service_times.append(time.monotonic() - start)
+            self.release()
+
+    def snapshot(self) -> dict:
+        def at(times, percentile):
+            if not times:
+                return None
+            ordered = sorted(times)
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * percentile))], 4)
+
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": len(self.waiters),
+            "max_queued": self.max_queued,
+            "peak_queued": self.peak_queued,
+            **self.counts,
+            "wait_p50": at(self.wait_times, 0.5),
+            "wait_p99": at(self.wait_times, 0.99),
+            "service_p50": at(self.service_times, 0.5),
+            "service_p99": at(self.service_times, 0.99),
+        }
+
+# Admission of the API requests, by pipeline.
+admission = {
+    name: AdmissionController(name, MAX_IN_FLIGHT[name], MAX_QUEUED.get(name, 0))
+    for name in MAX_IN_FLIGHT
+}
+
+def admission_stats() -> dict:
+    return {name: controller.snapshot() for name, controller in admission.items()}
@@ -0,0 +1,332 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable
+import datetime as dt
+import threading
+import atexit
+import json
+import os
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where saves of several processes are not serialized.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Aliases learned from accepted fuzzy matches, kept with the phrase data.
+ALIAS_CACHE_PATH = os.environ.get("ALIAS_CACHE_PATH", "data/phrase_data/learned_aliases.json")
+
+# Most aliases kept, the least recently used ones are evicted first.
+ALIAS_CACHE_SIZE = int(os.environ.get("ALIAS_CACHE_SIZE", 10000))
+
+# Seconds between two saves of the learned aliases and their hits, in the background.
+ALIAS_SAVE_SECONDS = float(os.environ.get("ALIAS_SAVE_SECONDS", 30))
+
+def now() -> str:
+    return dt.datetime.now(dt.timezone.utc).isoformat()
+
+class AliasCache:
+    """
+    LRU store of the OCR variants of phrases (e.g. 'haemoglobn') that fuzzy matching
+    accepted, with the phrase they matched and its classification.
+
+    A learned alias resolves with a dict lookup instead of a fuzzy scan of the whole
+    vocabulary. Aliases are tied to the version of the vocabulary they were learned
+    against and dropped when it changes, so they always give the same classification
+    as fuzzy matching would.
+
+    The cache is shared by the threads of a process and saved by a background thread
+    every ALIAS_SAVE_SECONDS, so lookups never wait for the disk. Several processes may
+    use the same file: on save, the aliases on disk are merged with the ones in memory.
+    Removed aliases are recorded in the file with the time they were removed, so that
+    processes still holding them drop them on merge instead of writing them back.
+    """
+
+    def __init__(self, path: str = ALIAS_CACHE_PATH, max_size: int = ALIAS_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.vocabulary = None
+        self._entries = OrderedDict()
+        # alias -> time it was removed, and time all the aliases were cleared.
+        self.removed = {}
+        self.cleared_at = None
+        self._loaded = False
+        self._changes = 0
+        self._lock = threading.Lock()
+        # Serializes the saves, which read and write the file without holding the lock.
+        self._save_lock = threading.Lock()
+        self._saver = None
+        self._stopped = threading.Event()
+        self.hits = 0
+        self.misses = 0
+
+    def read_file(self) -> dict:
+        """Returns the content of the cache file, empty if there is none."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"Error while reading learned aliases: {e}")
+            return {}
+
+    def load(self, content: dict = None) -> None:
+        """Loads the aliases from the cache file, oldest first. Call with the lock held."""
+        content = self.read_file() if content is None else content
+        self.vocabulary = content.get("vocabulary")
+        self.removed = dict(content.get("removed", {}))
+        self.cleared_at = content.get("cleared_at")
+        self._entries = OrderedDict(
+            (entry["alias"], entry) for entry in sorted(content.get("aliases", []), key=lambda entry: entry["last_used"])
+        )
+        self.drop_removed()
+        self.trim()
+        self._loaded = True
+        logger.info(f"Loaded {len(self._entries)} learned aliases")
+
+    def merge(self, content: dict) -> None:
+        """
+        Merges the content of the cache file into memory: the aliases other processes
+        learned or used more recently, and the ones they removed. Call with the lock held.
+        """
+        if content.get("vocabulary") != self.vocabulary:
+            return
+        for alias, removed_at in content.get("removed", {}).items():
+            self.removed[alias] = max(removed_at, self.removed.get(alias, removed_at))
+        self.cleared_at = max(filter(None, (self.cleared_at, content.get("cleared_at"))), default=None)
+        for entry in content.get("aliases", []):
+            current = self._entries.get(entry["alias"])
+            if current is None or current["last_used"] < entry["last_used"]:
+                self._entries[entry["alias"]] = entry
+        self._entries = OrderedDict(sorted(self._entries.items(), key=lambda item: item[1]["last_used"]))
+        self.drop_removed()
+        self.trim()
+
+    def is_removed(self, entry: dict) -> bool:
+        """Checks if an alias was removed or cleared after it was learned."""
+        removed_at = max(filter(None, (self.removed.get(entry["alias"]), self.cleared_at)), default=None)
+        return removed_at is not None and entry["learned_at"] <= removed_at
+
+    def drop_removed(self) -> None:
+        """Drops the removed aliases, and forgets the removals older than the last clear. Call with the lock held."""
+        for alias in [alias for alias, entry in self._entries.items() if self.is_removed(entry)]:
+            del self._entries[alias]
+        if self.cleared_at:
+            self.removed = {alias: removed_at for alias, removed_at in self.removed.items() if removed_at > self.cleared_at}
+        # Only the most recent removals are kept, like the aliases.
+        if len(self.removed) > self.max_size:
+            self.removed = dict(sorted(self.removed.items(), key=lambda item: item[1])[-self.max_size:])
+
+    def use_vocabulary(self, vocabulary: str) -> None:
+        """
+        Ties the cache to a version of the vocabulary, dropping the aliases learned against another one.
+
+        Args:
+            vocabulary (str): Digest of the classification data.
+        """
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            if vocabulary != self.vocabulary:
+                if self._entries:
+                    logger.warning(f"Vocabulary changed, dropping {len(self._entries)} learned aliases")
+                self._entries.clear()
+                self.removed.clear()
+                self.cleared_at = None
+                self.vocabulary = vocabulary
+                self._changes += 1
+        self.start()
+
+    def get(self, phrase: str) -> dict:
+        """
+        Looks up a normalized phrase.
+
+        Returns:
+            dict: The alias, with its 'match' and 'classification', or None if it was not learned.
+        """
+        with self._lock:
+            entry = self._entries.get(phrase)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(phrase)
+            entry["hits"] += 1
+            entry["last_used"] = now()
+            self.hits += 1
+            self._changes += 1
+            return entry
+
+    def learn(self, phrase: str, match: str, classification: str, score: int) -> None:
+        """Records an accepted fuzzy match of a normalized phrase."""
+        with self._lock:
+            timestamp = now()
+            self._entries[phrase] = {
+                "alias": phrase,
+                "match": match,
+                "classification": classification,
+                "score": score,
+                "hits": 0,
+                "learned_at": timestamp,
+                "last_used": timestamp,
+            }
+            self._entries.move_to_end(phrase)
+            self.trim()
+            self._changes += 1
+
+    def trim(self) -> None:
+        """Evicts the least recently used aliases beyond the size of the cache."""
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def start(self) -> None:
+        """Starts the thread saving the cache every ALIAS_SAVE_SECONDS, if it is not running."""
+        with self._lock:
+            if self._saver is None or not self._saver.is_alive():
+                self._stopped.clear()
+                self._saver = threading.Thread(target=self._run, name="alias-cache-saver", daemon=True)
+                self._saver.start()
+                # Saves what was learned since the last save when the process exits.
+                atexit.register(self.close)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(ALIAS_SAVE_SECONDS):
+            self.save()
+
+    def close(self) -> None:
+        """Stops the saving thread and saves the cache a last time."""
+        self._stopped.set()
+        self.save()
+
+    @contextmanager
+    def file_lock(self):
+        """Holds an exclusive lock on the cache file, so that the saves of several processes do not interleave."""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self) -> None:
+        """
+        Writes the aliases to the cache file, merged with the ones other processes saved
+        and without the ones they removed. The file is read and written without holding
+        the lock of the lookups.
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self._loaded or not self._changes:
+                    return
+            try:
+                with self.file_lock():
+                    on_disk = self.read_file()
+                    with self._lock:
+                        self.merge(on_disk)
+                        content = self.content()
+                        self._changes = 0
+                    self.write_file(content)
+                logger.info(f"Saved {len(content['aliases'])} learned aliases")
+            except Exception as e:
+                with self._lock:
+                    self._changes += 1
+                logger.error(f"Error while saving learned aliases: {e}")
+
+    def update_file(self, update: Callable[[], None]) -> None:
+        """Applies a change to the aliases merged with the file, and writes them right away."""
+        with self._save_lock, self.file_lock():
+            on_disk = self.read_file()
+            with self._lock:
+                if self._loaded:
+                    self.merge(on_disk)
+                else:
+                    self.load(on_disk)
+                update()
+                content = self.content()
+                self._changes = 0
+            self.write_file(content)
+
+    def entries(self) -> list[dict]:
+        """Returns the aliases, most recently used first."""
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            return [dict(entry) for entry in reversed(self._entries.values())]
+
+    def remove(self, phrases: list[str]) -> int:
+        """
+        Forgets aliases, e.g. wrong ones found during review. The removal is recorded in
+        the file, so that other processes drop them too.
+
+        Returns:
+            int: Number of aliases removed.
+        """
+        removed = []
+
+        def update() -> None:
+            timestamp = now()
+            for phrase in phrases:
+                phrase = phrase.lower().strip()
+                removed.append(self._entries.pop(phrase, None))
+                self.removed[phrase] = timestamp
+            self.drop_removed()
+
+        self.update_file(update)
+        return sum(entry is not None for entry in removed)
+
+    def clear(self) -> None:
+        """Forgets all aliases, including the ones other processes hold."""
+
+        def update() -> None:
+            self._entries.clear()
+            self.cleared_at = now()
+            self.drop_removed()
+
+        self.update_file(update)
+
+    def content(self) -> dict:
+        """Returns the content of the cache file. Call with the lock held."""
+        return {
+            "vocabulary": self.vocabulary,
+            "cleared_at": self.cleared_at,
+            "removed": dict(self.removed),
+            "aliases": [dict(entry) for entry in self._entries.values()],
+        }
+
+    def write_file(self, content: dict) -> None:
+        """Atomically overwrites the cache file."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as cache_file:
+            json.dump(content, cache_file, indent=1)
+        os.replace(temporary_path, self.path)
+
+    def export(self, min_hits: int = 0) -> dict:
+        """
+        Exports the aliases in the format of `phrase.json`, for review before adding
+        them to the classification data.
+
+        Args:
+            min_hits (int, optional): Leave out the aliases used fewer times.
+
+        Returns:
+            dict: The aliases of every classification, sorted.
+        """
+        exported = {}
+        for entry in self.entries():
+            if entry["hits"] >= min_hits:
+                exported.setdefault(entry["classification"], []).append(entry["alias"])
+        return {classification: sorted(aliases) for classification, aliases in sorted(exported.items())}
+
+    def stats(self) -> dict:
+        return {"aliases": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+# Cache shared by the phrase detection of a process.
+alias_cache = AliasCache()
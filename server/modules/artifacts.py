@@ -0,0 +1,175 @@
+from pathlib import Path
+import datetime as dt
+import hashlib
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Directory of the persisted stage artifacts, one subdirectory per report.
+ARTIFACTS_DIR = Path(os.environ.get("ARTIFACTS_DIR", Path(__file__).resolve().parent.parent / "data/artifacts"))
+
+class Stage:
+    """
+    A stage of the processing pipeline.
+
+    The output of a stage is reused as long as its key is unchanged. The key covers
+    the code version of the stage, the content of its data files and the outputs of
+    the stages it depends on, so only a change that reaches the stage invalidates it.
+
+    Bump `version` whenever a change to the code of the stage changes its output.
+    """
+
+    def __init__(self, name: str, depends_on: list[str] = None, version: int = 1, data_files: list[str] = None):
+        self.name = name
+        self.depends_on = depends_on or []
+        self.version = version
+        self.data_files = data_files or []
+
+    def data_version(self) -> str:
+        """Returns a hash of the content of the data files of the stage."""
+        digest = hashlib.sha256()
+        for path in self.data_files:
+            digest.update(path.encode())
+            with open(path, "rb") as data_file:
+                digest.update(data_file.read())
+        return digest.hexdigest()
+
+    def key(self, upstream_digests: list[str], inputs: dict = None) -> str:
+        """
+        Returns the key of the output of the stage.
+
+        Args:
+            upstream_digests (list[str]): Digests of the outputs of the stages it depends on, in order.
+            inputs (dict, optional): Other inputs of the stage, e.g. the source of the report.
+
+        Returns:
+            str: The key.
+        """
+        payload = {
+            "stage": self.name,
+            "version": self.version,
+            "data": self.data_version(),
+            "upstream": upstream_digests,
+            "inputs": inputs or {},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+# Stages of the pipeline in topological order.
+STAGES = [
+    Stage("ocr"),
+    Stage("format", depends_on=["ocr"], version=4),
+    Stage("parse", depends_on=["format"], version=2),
+    Stage("classify", depends_on=["parse"], data_files=[
+        "data/phrase_data/phrase.json",
+        "data/phrase_data/common_phrases.txt",
+        "data/phrase_data/valid_short_terms.txt",
+    ]),
+    Stage("convert", depends_on=["classify"], data_files=["data/unit_conversion_data/unit.json"]),
+]
+
+def get_stage(name: str) -> Stage:
+    """Returns a stage by name, raising ValueError if there is none."""
+    for stage in STAGES:
+        if stage.name == name:
+            return stage
+    raise ValueError(f"Unknown stage: {name}. Stages: {[stage.name for stage in STAGES]}")
+
+def value_digest(value) -> str:
+    """Returns the sha256 hash of a JSON serializable value."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+def file_digest(path: str) -> str:
+    """Returns the sha256 hash of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as source_file:
+        for block in iter(lambda: source_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def report_id_for(source: str | bytes) -> str:
+    """
+    Derives the id of a report from its source.
+
+    Local and uploaded files are identified by their content, so a moved file keeps
+    its artifacts, remote files and markdown by the text itself.
+
+    Args:
+        source (str | bytes): Path or URL of the report, its markdown, or its uploaded content.
+
+    Returns:
+        str: The id.
+    """
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()[:16]
+    if os.path.isfile(source):
+        return file_digest(source)[:16]
+    return hashlib.sha256(source.encode()).hexdigest()[:16]
+
+class ArtifactStore:
+    """
+    Persists the output of every stage of a report as a JSON file,
+    `<root>/<report id>/<stage>.json`, along with the key it was computed for.
+    """
+
+    def __init__(self, root: str | Path = None):
+        self.root = Path(root or ARTIFACTS_DIR)
+
+    def path(self, report_id: str, stage: str) -> Path:
+        return self.root / report_id / f"{stage}.json"
+
+    def load(self, report_id: str, stage: str) -> dict:
+        """
+        Loads an artifact.
+
+        Returns:
+            dict: The artifact, or None if there is none or it cannot be read.
+        """
+        path = self.path(report_id, stage)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as artifact_file:
+                return json.load(artifact_file)
+        except Exception as e:
+            logger.error(f"Error while loading artifact {path}: {e}")
+            return None
+
+    def save(self, report_id: str, stage: Stage, key: str, value, inputs: dict = None) -> dict:
+        """
+        Saves an artifact, replacing the previous one atomically.
+
+        Args:
+            report_id (str): Id of the report.
+            stage (Stage): Stage that produced the value.
+            key (str): Key the value was computed for.
+            value: JSON serializable output of the stage.
+            inputs (dict, optional): Other inputs of the stage, kept to recompute it later.
+
+        Returns:
+            dict: The artifact.
+        """
+        artifact = {
+            "stage": stage.name,
+            "key": key,
+            "version": stage.version,
+            "digest": value_digest(value),
+            "inputs": inputs or {},
+            "created_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+            "value": value,
+        }
+        path = self.path(report_id, stage.name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(".tmp")
+        with open(temporary_path, "w", encoding="utf-8") as artifact_file:
+            json.dump(artifact, artifact_file, ensure_ascii=False, default=str)
+        os.replace(temporary_path, path)
+        logger.debug(f"Saved {stage.name} artifact of report {report_id}")
+        return artifact
+
+    def reports(self) -> list[str]:
+        """Returns the ids of the reports with artifacts."""
+        if not self.root.exists():
+            return []
+        return sorted(path.name for path in self.root.iterdir() if path.is_dir())
@@ -1,9 +1,133 @@
 import pandas as pd
 from pprint import pformat
+import datetime as dt
+import re
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Header field labels of the reports, normalized to upper case without dots, and their keys.
+HEADER_FIELDS = {
+    "NAME": "name",
+    "PATIENT NAME": "name",
+    "AGE": "age",
+    "SEX": "sex",
+    "GENDER": "sex",
+    "DATE": "date",
+    "REPORT DATE": "date",
+    "REG NO": "reg_no",
+    "REGISTRATION NO": "reg_no",
+    "REF BY": "ref_by",
+    "REFERRED BY": "ref_by",
+}
+
+# Headings that label the table columns rather than a section.
+COLUMN_HEADINGS = {"TEST", "TESTS", "INVESTIGATION", "INVESTIGATIONS"}
+
+# A header line once list and heading markers and emphasis are stripped, e.g. 'AGE: 45 Years'.
+FIELD_LINE = re.compile(r"^(?P<label>[A-Za-z][A-Za-z .]{0,24}?)\s*:\s*(?P<value>.*)$")
+
+MARKERS = re.compile(r"^[\s>*#-]+")
+
+DATE_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y", "%Y-%m-%d", "%d %b %Y", "%d-%b-%Y", "%d %B %Y"]
+
+def parse_report_date(value: str) -> str:
+    """
+    Parses a report date, written day first as is usual on the reports.
+
+    Args:
+        value (str): The date, e.g. '23/11/2024' or '23-Nov-2024'.
+
+    Returns:
+        str: The date in ISO format, or None if it cannot be parsed.
+    """
+    match = re.search(r"\d{1,4}[/.\- ][\w]{1,9}[/.\- ]\d{2,4}", value or "")
+    if not match:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return dt.datetime.strptime(match.group(0), date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+def parse_header_line(text: str) -> tuple[str, str]:
+    """
+    Parses a header field line such as '- **NAME:** John Doe' or '### **AGE: 45 Years**'.
+
+    Args:
+        text (str): The line, without its list or heading markers.
+
+    Returns:
+        tuple[str, str]: The key of the field and its value (None if it is blank or '-'),
+        or None if the line is not a known header field.
+    """
+    match = FIELD_LINE.match(text.replace("**", "").replace("__", "").strip())
+    if not match:
+        return None
+    label = re.sub(r"\s+", " ", match.group("label").replace(".", "")).strip().upper()
+    if label not in HEADER_FIELDS:
+        return None
+    key = HEADER_FIELDS[label]
+    value = match.group("value").strip()
+    if key == "age" and not re.search(r"\d", value):
+        # Only the unit is left, e.g. 'AGE: Years'.
+        value = ""
+    return key, (value if value and value != "-" else None)
+
+def scan_markdown(markdown_content: str) -> tuple[list[str], dict]:
+    """
+    Extracts the tables and the header of a report in a single pass over its markdown.
+
+    Besides the tables, the lines are read as header fields (name, age, sex, date,
+    registration number and referring doctor) or headings. The heading above a
+    table is recorded as its section.
+
+    Args:
+        markdown_content (str): The markdown content containing tables.
+
+    Returns:
+        tuple[list[str], dict]: The markdown tables, and the header of the report with
+        its 'lab' (first heading), 'fields', ISO 'report_date' and the 'sections' of
+        the tables, in the order of the tables.
+    """
+    table_chunks = []
+    header = {"lab": None, "fields": {}, "report_date": None, "sections": []}
+    current_table = []
+    section = None
+
+    for line in markdown_content.strip().split("\n"):
+        if "|" in line:  # Start recording when a '|' is found
+            if not current_table:
+                header["sections"].append(section)
+            current_table.append(line)
+            continue
+        if current_table:  # Stop when there's no '|'
+            table_chunks.append("\n".join(current_table))
+            current_table = []
+
+        stripped = line.strip()
+        if not stripped:
+            continue
+        text = MARKERS.sub("", stripped)
+        field = parse_header_line(text)
+        if field:
+            key, value = field
+            if value is not None or key not in header["fields"]:
+                header["fields"][key] = value
+        elif stripped.startswith("#"):
+            title = text.replace("**", "").replace("__", "").strip()
+            if not title or title.endswith(":") or title.upper() in COLUMN_HEADINGS:
+                continue
+            header["lab"] = header["lab"] or title
+            section = title
+
+    # Append the last table if still recording
+    if current_table:
+        table_chunks.append("\n".join(current_table))
+    header["report_date"] = parse_report_date(header["fields"].get("date"))
+    return table_chunks, header
+
 def batch_chunks(markdown_content: str) -> list[str]:
     """
     Identify and extract entire markdown tables from content.
@@ -16,24 +140,7 @@ def batch_chunks(markdown_content: str) -> list[str]:
     """
     try:
         logger.info("Batching chunks from markdown content...")
-        table_chunks = []
-        lines = markdown_content.strip().split("\n")
-        
-        current_table = []
-        recording = False
-
-        for line in lines:
-            if "|" in line:  # Start recording when a '|' is found
-                recording = True
-                current_table.append(line)
-            elif recording:  # Stop when there's no '|'
-                table_chunks.append("\n".join(current_table))
-                current_table = []
-                recording = False
-
-        # Append the last table if still recording
-        if current_table:
-            table_chunks.append("\n".join(current_table))
+        table_chunks, _ = scan_markdown(markdown_content)
         logger.info(f"Successfully batched {len(table_chunks)} chunks from markdown content")
         logger.debug(f"Batched chunks: \n{pformat(table_chunks)}")
         return table_chunks
@@ -41,6 +148,18 @@ def batch_chunks(markdown_content: str) -> list[str]:
     except Exception as e:
         logger.error(f"Error while batching chunks from markdown content: {e}")
 
+def contains_tables(markdown_content: str) -> bool:
+    """
+    Checks if markdown content contains at least one table with a header and a data row.
+
+    Args:
+        markdown_content (str): The markdown content.
+
+    Returns:
+        bool: True if a table was found.
+    """
+    return any(len(chunk.split("\n")) >= 3 for chunk in batch_chunks(markdown_content) or [])
+
 def parse_chunks(table_content: str) -> pd.DataFrame:
     """
     Parse a markdown table into a Pandas DataFrame, where each row contains:
@@ -190,7 +309,8 @@ if __name__ == "__main__":
         ### **Medical Lab Technician**
         """
 
-    raw_chunks = batch_chunks(formatted_markdown)
+    raw_chunks, header = scan_markdown(formatted_markdown)
     processed_chunks = [parse_chunks(chunk) for chunk in raw_chunks]
     bundled_chunks = bundle_chunks(processed_chunks)
+    print(header)
     print(bundled_chunks)
\ No newline at end of file
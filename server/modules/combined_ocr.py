@@ -0,0 +1,101 @@
+from PIL import Image
+import cv2 as cv
+import numpy as np
+import hashlib
+import logging
+from .model_executor import executor
+from .providers import gemini
+
+logger = logging.getLogger(__name__)
+
+# Deadline of a combined call, in seconds.
+COMBINED_TIMEOUT = 120
+
+# Model used when none is given.
+DEFAULT_MODEL = "gemini-2.0-flash-exp"
+
+# First line of the response, telling whether the image is readable.
+VALID = "VALID"
+INVALID = "INVALID"
+
+PROMPT = f"""
+You are given an image of a blood report, which may have been preprocessed for OCR.
+
+First judge whether the image is readable. If the image is an unusable mess from which no medical information can be inferred, respond only with '{INVALID}'.
+
+Otherwise respond with '{VALID}' on the first line, followed by the whole report in Markdown:
+1. Every medical test must be in a table with exactly these 4 columns:
+    ```markdown
+    | TEST        | RESULT   | UNIT  | REFERENCE RANGE |
+    |-------------|----------|-------|-----------------|
+    | ExampleTest | 5.6      | mg/dL | 3.5 - 6.0       |
+    ```
+- If a value is missing, use `-`.
+- The UNIT column must only contain measurement units. Multipliers written before '/' in the unit (e.g. `10^3/µL`) go to the RESULT column as {{num}}x{{multiplier}} (e.g. `4.83x10^3`), leaving `/µL` as the unit.
+2. Keep the other sections (lab details, patient details, section headings, notes) as Markdown text.
+3. Do not modify names, numerical values or medical terminology, and do not infer unreadable values.
+4. Do not use code fences and do not add any explanation.
+"""
+
+def to_pil_image(image: np.ndarray) -> Image.Image:
+    """Converts an OpenCV BGR or grayscale image to a PIL image."""
+    if image.ndim == 3:
+        image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+    return Image.fromarray(image)
+
+def parse_response(text: str) -> tuple[bool, str]:
+    """
+    Splits a combined response into the readability verdict and the markdown.
+
+    Args:
+        text (str): Response of the model.
+
+    Returns:
+        tuple[bool, str]: Whether the image is readable, and its markdown (None if it is not).
+    """
+    text = (text or "").strip()
+    first_line, _, markdown = text.partition("\n")
+    verdict = first_line.strip().strip("*#` ").upper()
+    if verdict.startswith(INVALID) or not text:
+        return False, None
+    if verdict.startswith(VALID):
+        return True, markdown.strip()
+    # No verdict line, the model went straight to the report.
+    return True, text
+
+def image_to_table_md(image: np.ndarray, model_name: str = DEFAULT_MODEL) -> tuple[bool, str]:
+    """
+    Judges the readability of an image and converts it to table-structured markdown in one call.
+
+    The markdown follows the `| TEST | RESULT | UNIT | REFERENCE RANGE |` format of
+    `format_markdown`, so it can be chunked without another formatting call.
+
+    Args:
+        image (numpy.ndarray): Image in OpenCV BGR or grayscale format.
+        model_name (str, optional): Gemini model to use.
+
+    Returns:
+        tuple[bool, str]: Whether the image is readable, and its markdown. The markdown
+        is None if the image is unreadable or the call failed.
+    """
+    try:
+        logger.info("Validating and converting image to markdown...")
+        model = gemini().GenerativeModel(model_name)
+        logger.info(f"Model {model_name} loaded")
+
+        response = executor.call(
+            f"gemini/{model_name}",
+            model.generate_content,
+            [PROMPT, to_pil_image(image)],
+            request_options={"timeout": COMBINED_TIMEOUT},
+            timeout=COMBINED_TIMEOUT,
+            coalesce_key=hashlib.sha256(image.tobytes()).hexdigest(),
+        )
+        is_valid, markdown = parse_response(response.text)
+
+        logger.info(f"Image is marked {'valid' if is_valid else 'invalid'}")
+        logger.debug(f"Combined markdown: \n{markdown}")
+        return is_valid, markdown
+    except Exception as e:
+        logger.error(f"Error while validating and converting image to markdown: {e}")
+        return False, None
@@ -1,87 +1,19 @@
-import google.generativeai as genai
-from dotenv import load_dotenv
-import os
+import hashlib
 import logging
+from .model_executor import executor
+from .providers import gemini
+from .tracing import set_attributes
 
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
+# Deadline of a formatting call, in seconds.
+FORMAT_TIMEOUT = 90
 
-# Configure the Generative AI model
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+# Model used when none is given.
+DEFAULT_MODEL = "gemini-2.0-flash-exp"
 
-def format_markdown(input_markdown: str) -> str:
-    """
-    Formats a markdown string to ensure proper rendering of medical tables and data.
-    
-    Args:
-        input_markdown (str): The markdown string to be formatted.
-
-    Returns:
-        str: The formatted markdown string.
-    """
-    logger.info("Formatting markdown...")
-    # Define the AI model to use
-    MODEL_NAME = "gemini-2.0-flash-exp"
-    model = genai.GenerativeModel(MODEL_NAME)
-    logger.info(f"Model {MODEL_NAME} loaded")
-    
-    # Define the AI prompt
-    prompt = f"""
-    You are an expert in formatting medical reports in Markdown. The input report comes from an **OCR conversion of an image**, which may contain **unstructured** medical test data.  
-    Your task is to **extract, structure, and format** the report while ensuring **no data loss** and maintaining medical accuracy.
-
-    ### **Key Formatting Instructions:**
-    1. **Identify and properly format all medical test data** into structured tables.  
-    - Even if the OCR output does not contain tables, **reconstruct** them into this strict format:
-        ```markdown
-        | TEST        | RESULT   | UNIT  | REFERENCE RANGE |
-        |-------------|----------|-------|-----------------|
-        | ExampleTest | 5.6      | mg/dL | 3.5 - 6.0       |
-        ```
-    - **Extract and organize** scattered test values into their correct columns.
-    - If a value is missing, replace it with `-` (e.g., if `REFERENCE RANGE` is not given, use `-`).
-    - There should be always the given 4 columns as (TEST, RESULT, UNIT, REFERENCE RANGE). Even if its out of context or not needed. Fill the values with '-' when they are not present.
-
-    2. **Ensure all medical values are correctly placed**  
-    - The **RESULT** column may contain numerical values or a string in format {{num}}x{{multipliers}} (e.g., `5.6` or `5.6x10^9`).
-    - The **UNIT** column must contain **only measurement units** (e.g., `/L` instead of `10^9/L`).
-        - If the unit is written as `10^9/L`, **move `10^9` to the RESULT column** and keep `/L` in the UNIT column.
-        - This just an example if there is any multipliers (e.g., 10^3, or anything else) before '/' in the UNIT **move it to the RESULT column** as {{num}}x{{multipliers}} (e.g., 4.83x10^3) always.
-
-    3. **Preserve all other report sections** (e.g., patient details, doctor's notes)  
-    - Improve readability while keeping all content intact.
-    - Do not modify any names, numerical values, or medical terminology.
-
-    4. **Handle OCR errors carefully:**  
-    - If values appear fragmented, reformat them into structured tables without altering their meaning.
-    - **Do not infer missing information**—if a value is unreadable due to OCR errors, **keep it as is**.
-
-    5. **Strictly format all extracted test data into tables**  
-    - Even if the OCR output is raw text, all medical values must be **transformed into a structured table**.
-    - No test data should remain unformatted.
-
-    ### **Input Markdown (Unstructured OCR Output):**
-    ```markdown
-    {input_markdown}
-    ```
-
-    ### **Provide the properly formatted markdown output below:**
-    """
-
-    # Generate the response from the AI model
-    try:
-        response = model.generate_content(prompt)
-        formatted_markdown = response.text
-        logger.info("Markdown formatting completed")
-        logger.debug(f"Formatted markdown: {formatted_markdown}")
-        return formatted_markdown
-    except Exception as e:
-        logger.error(f"Error during formatting markdown using AI: {e}")
-
-if __name__ == "__main__":
-    markdown_content = """
+# OCR output of a CBC report, with a multiplier in a unit, title-only headers and text results.
+SAMPLE_MARKDOWN = """
                 # **Clinical Analysis Lab**
 
                 ## **Medical Lab Technical Result Sheet**
@@ -145,5 +77,101 @@ if __name__ == "__main__":
 
                 """
 
+def build_prompt(input_markdown: str) -> str:
+    """
+    Builds the formatting prompt of a markdown string.
+
+    Args:
+        input_markdown (str): The markdown string to be formatted.
+
+    Returns:
+        str: The prompt.
+    """
+    return f"""
+    You are an expert in formatting medical reports in Markdown. The input report comes from an **OCR conversion of an image**, which may contain **unstructured** medical test data.  
+    Your task is to **extract, structure, and format** the report while ensuring **no data loss** and maintaining medical accuracy.
+
+    ### **Key Formatting Instructions:**
+    1. **Identify and properly format all medical test data** into structured tables.  
+    - Even if the OCR output does not contain tables, **reconstruct** them into this strict format:
+        ```markdown
+        | TEST        | RESULT   | UNIT  | REFERENCE RANGE |
+        |-------------|----------|-------|-----------------|
+        | ExampleTest | 5.6      | mg/dL | 3.5 - 6.0       |
+        ```
+    - **Extract and organize** scattered test values into their correct columns.
+    - If a value is missing, replace it with `-` (e.g., if `REFERENCE RANGE` is not given, use `-`).
+    - There should be always the given 4 columns as (TEST, RESULT, UNIT, REFERENCE RANGE). Even if its out of context or not needed. Fill the values with '-' when they are not present.
+
+    2. **Ensure all medical values are correctly placed**  
+    - The **RESULT** column may contain numerical values or a string in format {{num}}x{{multipliers}} (e.g., `5.6` or `5.6x10^9`).
+    - The **UNIT** column must contain **only measurement units** (e.g., `/L` instead of `10^9/L`).
+        - If the unit is written as `10^9/L`, **move `10^9` to the RESULT column** and keep `/L` in the UNIT column.
+        - This just an example if there is any multipliers (e.g., 10^3, or anything else) before '/' in the UNIT **move it to the RESULT column** as {{num}}x{{multipliers}} (e.g., 4.83x10^3) always.
+
+    3. **Preserve all other report sections** (e.g., patient details, doctor's notes)  
+    - Improve readability while keeping all content intact.
+    - Do not modify any names, numerical values, or medical terminology.
+
+    4. **Handle OCR errors carefully:**  
+    - If values appear fragmented, reformat them into structured tables without altering their meaning.
+    - **Do not infer missing information**—if a value is unreadable due to OCR errors, **keep it as is**.
+
+    5. **Strictly format all extracted test data into tables**  
+    - Even if the OCR output is raw text, all medical values must be **transformed into a structured table**.
+    - No test data should remain unformatted.
+
+    ### **Input Markdown (Unstructured OCR Output):**
+    ```markdown
+    {input_markdown}
+    ```
+
+    ### **Provide the properly formatted markdown output below:**
+    """
+
+def format_markdown(input_markdown: str, model_name: str = DEFAULT_MODEL) -> str:
+    """
+    Formats a markdown string to ensure proper rendering of medical tables and data.
+    
+    Args:
+        input_markdown (str): The markdown string to be formatted.
+        model_name (str, optional): Gemini model to use.
+
+    Returns:
+        str: The formatted markdown string.
+    """
+    logger.info("Formatting markdown...")
+    # Define the AI model to use
+    model = gemini().GenerativeModel(model_name)
+    logger.info(f"Model {model_name} loaded")
+    
+    # Define the AI prompt
+    prompt = build_prompt(input_markdown)
+
+    # Generate the response from the AI model
+    try:
+        response = executor.call(
+            f"gemini/{model_name}",
+            model.generate_content,
+            prompt,
+            request_options={"timeout": FORMAT_TIMEOUT},
+            timeout=FORMAT_TIMEOUT,
+            hedge_percentile=95,
+            coalesce_key=hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        )
+        formatted_markdown = response.text
+        usage = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            # Billed token counts, as reported by Gemini.
+            set_attributes(prompt_tokens=usage.prompt_token_count, output_tokens=usage.candidates_token_count)
+        logger.info("Markdown formatting completed")
+        logger.debug(f"Formatted markdown: {formatted_markdown}")
+        return formatted_markdown
+    except Exception as e:
+        logger.error(f"Error during formatting markdown using AI: {e}")
+
+if __name__ == "__main__":
+    markdown_content = SAMPLE_MARKDOWN
+
     formatted_content = format_markdown(markdown_content)
     
\ No newline at end of file
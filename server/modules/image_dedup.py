@@ -0,0 +1,233 @@
+from collections import OrderedDict
+import threading
+import os
+import cv2 as cv
+import numpy as np
+import logging
+from .image_fetcher import fetch_image_bytes, decode_image
+from .image_memory import read_header
+
+logger = logging.getLogger(__name__)
+
+# Set to 1 to reuse the OCR markdown of near-identical images, e.g. copies of the same
+# scan or photo that were recompressed, resized or brightened.
+#
+# Off by default: perceptual hashes see the layout of a page, not its digits. Two
+# reports printed on the same template that only differ by a value hash the same, so
+# a hit is only as safe as the threshold is tight for the images at hand.
+IMAGE_DEDUP = os.environ.get("IMAGE_DEDUP", "0") == "1"
+
+# Largest Hamming distance, out of HASH_SIZE * HASH_SIZE bits, between the dHashes and
+# between the pHashes of two images to be considered the same. Digital copies of a page
+# are within about 4 bits, re-scans and other reports on its template about 10 and more.
+DEDUP_DISTANCE = int(os.environ.get("IMAGE_DEDUP_DISTANCE", 6))
+
+# Most recent images kept in the index.
+DEDUP_SIZE = int(os.environ.get("IMAGE_DEDUP_SIZE", 1000))
+
+# Side of the hashes, in bits.
+HASH_SIZE = 16
+
+# The pHash keeps the lowest HASH_SIZE frequencies of a DCT this many times larger.
+PHASH_FACTOR = 4
+
+# Longest side the image is normalized to before hashing, so that the ink of copies
+# at different resolutions is binarized alike.
+NORMALIZED_SIDE = 1024
+
+# Share of the ink left out at every edge when cropping a page to its content.
+CROP_MARGIN = 0.005
+
+def shrink(image: np.ndarray, width: int, height: int) -> np.ndarray:
+    """
+    Downscales a single channel image to `width` x `height` by averaging the blocks of
+    pixels that fall in every cell.
+
+    Returns:
+        numpy.ndarray: The float32 cells.
+    """
+    if image.shape[0] < height or image.shape[1] < width:
+        # Every cell needs a pixel, e.g. for a page with a single word.
+        image = cv.resize(image, (max(width, image.shape[1]), max(height, image.shape[0])), interpolation=cv.INTER_NEAREST)
+    rows =np.linspace(0, image.shape[0], height + 1).astype(int)[:-1]
+    columns = np.linspace(0, image.shape[1], width + 1).astype(int)[:-1]
+    sums = np.add.reduceat(np.add.reduceat(image.astype(np.float32), rows, axis=0), columns, axis=1)
+    counts = np.outer(np.diff(rows, append=image.shape[0]), np.diff(columns, append=image.shape[1]))
+    return sums / counts
+
+def content_bounds(profile: np.ndarray) -> tuple[int, int]:
+    """Returns the range holding all but CROP_MARGIN of the ink at both ends of a projection."""
+    cumulative = np.cumsum(profile)
+    total = cumulative[-1]
+    if total == 0:
+        return 0, len(profile)
+    return int(np.searchsorted(cumulative, total * CROP_MARGIN)), int(np.searchsorted(cumulative, total * (1 - CROP_MARGIN))) + 1
+
+def normalize(gray: np.ndarray, side: int = NORMALIZED_SIDE) -> np.ndarray:
+    """
+    Normalizes a page for hashing: downscaled to `side`, binarized to its ink, and cropped
+    to the ink, so that margins, offsets, scale and brightness do not change its hashes.
+
+    Returns:
+        numpy.ndarray: The ink of the page, 1 for ink and 0 for paper.
+    """
+    scale = side / max(gray.shape)
+    if scale < 1:
+        gray = cv.resize(gray, (round(gray.shape[1] * scale), round(gray.shape[0] * scale)), interpolation=cv.INTER_AREA)
+    _, ink = cv.threshold(gray, 0, 1, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
+    top, bottom = content_bounds(ink.sum(axis=1))
+    left, right = content_bounds(ink.sum(axis=0))
+    return ink[top:bottom, left:right]
+
+def to_int(bits: np.ndarray) -> int:
+    """Packs an array of booleans into an integer."""
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def dhash(image: np.ndarray, hash_size: int = HASH_SIZE) -> int:
+    """
+    Difference hash: whether every cell of a `hash_size` x `hash_size + 1` downscale is
+    above its right neighbour.
+    """
+    cells = shrink(image, hash_size + 1, hash_size)
+    return to_int(cells[:, 1:] > cells[:, :-1])
+
+_dct_matrices = {}
+
+def dct_matrix(size: int) -> np.ndarray:
+    """Returns the orthonormal DCT-II matrix of a size, cached."""
+    matrix = _dct_matrices.get(size)
+    if matrix is None:
+        k = np.arange(size)[:, None]
+        n = np.arange(size)[None, :]
+        matrix = np.sqrt(2 / size) * np.cos(np.pi * (2 * n + 1) * k / (2 * size))
+        matrix[0] /= np.sqrt(2)
+        matrix = _dct_matrices[size] = matrix.astype(np.float32)
+    return matrix
+
+def phash(image: np.ndarray, hash_size: int = HASH_SIZE, factor: int = PHASH_FACTOR) -> int:
+    """
+    Perceptual hash: whether every one of the `hash_size` x `hash_size` lowest frequencies
+    of the DCT of a downscale is above their median. The DC term is left out of the median.
+    """
+    size = hash_size * factor
+    matrix = dct_matrix(size)
+    frequencies = (matrix @ shrink(image, size, size) @ matrix.T)[:hash_size, :hash_size]
+    return to_int(frequencies > np.median(frequencies.ravel()[1:]))
+
+def image_hash(gray: np.ndarray) -> tuple[int, int]:
+    """
+    Hashes a grayscale image, once normalized.
+
+    Returns:
+        tuple[int, int]: Its dHash and pHash.
+    """
+    ink = normalize(gray)
+    return dhash(ink), phash(ink)
+
+def hash_distance(first: tuple[int, int], second: tuple[int, int]) -> int:
+    """Returns the largest of the Hamming distances between the dHashes and the pHashes of two images."""
+    return max((first[0] ^ second[0]).bit_count(), (first[1] ^ second[1]).bit_count())
+
+def hash_source(source: str | bytes) -> tuple[int, int]:
+    """
+    Hashes an image from its source, decoded in grayscale at the lowest resolution
+    that keeps NORMALIZED_SIDE pixels on its longest side.
+
+    Args:
+        source (str | bytes): Path or URL of the image, or its encoded bytes.
+
+    Returns:
+        tuple[int, int]: Its dHash and pHash, or None if it could not be decoded.
+    """
+    try:
+        if isinstance(source, str) and source.startswith(("http://", "https://")):
+            source = fetch_image_bytes(source)
+        width, height, _, _ = read_header(source)
+        reduction = next((factor for factor in (8, 4, 2) if max(width, height) // factor >= NORMALIZED_SIDE), 1)
+        flags = {
+            1: cv.IMREAD_GRAYSCALE,
+            2: cv.IMREAD_REDUCED_GRAYSCALE_2,
+            4: cv.IMREAD_REDUCED_GRAYSCALE_4,
+            8: cv.IMREAD_REDUCED_GRAYSCALE_8,
+        }[reduction]
+        gray = decode_image(source, flags) if isinstance(source, bytes) else cv.imread(source, flags)
+        if gray is None:
+            raise ValueError("Could not decode image")
+        return image_hash(gray)
+    except Exception as e:
+        logger.error(f"Error while hashing image: {e}")
+    return None
+
+class DedupIndex:
+    """
+    Recent images by perceptual hash and OCR options, with the OCR output they gave.
+
+    Lookups compare the hashes of the image with every indexed one, which takes well
+    under a millisecond for a few thousand images. The least recently matched images
+    are evicted first.
+    """
+
+    def __init__(self, max_size: int = DEDUP_SIZE, max_distance: int = DEDUP_DISTANCE, enabled: bool = IMAGE_DEDUP):
+        self.max_size = max_size
+        self.max_distance = max_distance
+        self.enabled = enabled and max_size > 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {"lookups": 0, "hits": 0, "misses": 0, "added": 0}
+        self.hit_distances = {}
+
+    def lookup(self, image_hash: tuple[int, int], options: tuple = ()) -> tuple[dict, int]:
+        """
+        Finds the closest indexed image within `max_distance` processed with the same
+        options, e.g. the OCR backend and the pipeline.
+
+        Returns:
+            tuple[dict, int]: Its entry and its distance, or None if there is none.
+        """
+        with self._lock:
+            self.counts["lookups"] += 1
+            best, best_distance = None, self.max_distance + 1
+            for key in self._entries:
+                indexed_options, indexed_hash = key
+                if indexed_options != options:
+                    continue
+                distance = hash_distance(image_hash, indexed_hash)
+                if distance < best_distance:
+                    best, best_distance = key, distance
+            if best is None:
+                self.counts["misses"] += 1
+                return None
+            self._entries.move_to_end(best)
+            self.counts["hits"] += 1
+            self.hit_distances[best_distance] = self.hit_distances.get(best_distance, 0) + 1
+            return self._entries[best], best_distance
+
+    def add(self, image_hash: tuple[int, int], entry: dict, options: tuple = ()) -> None:
+        """Indexes the OCR output of an image and its options, evicting the least recently matched images."""
+        key = (options, image_hash)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.counts["added"] += 1
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counts["lookups"]
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "max_distance": self.max_distance,
+                **self.counts,
+                "hit_rate": round(self.counts["hits"] / lookups, 4) if lookups else None,
+                "hit_distances": dict(sorted(self.hit_distances.items())),
+            }
+
+# Index of the images processed by the process.
+dedup_index = DedupIndex()
@@ -0,0 +1,273 @@
+import cv2 as cv
+import numpy as np
+import base64
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Input limits of the vision models, the longest side in pixels and the encoded payload size.
+MODEL_INPUT_LIMITS = {
+    "Llama-3.2-90B-Vision": {"max_side": 1120, "max_bytes": 4 * 1024 * 1024},
+    "Llama-3.2-11B-Vision": {"max_side": 1120, "max_bytes": 4 * 1024 * 1024},
+    "free": {"max_side": 1120, "max_bytes": 2 * 1024 * 1024},
+}
+DEFAULT_INPUT_LIMITS = {"max_side": 1600, "max_bytes": 4 * 1024 * 1024}
+
+# Lossy qualities tried from the best to the smallest payload.
+QUALITIES = (90, 80, 70, 60, 50)
+
+# A page is tiled when it is taller than this many widths, or when fitting it
+# in the model input would shrink it below this scale.
+TILE_ASPECT_RATIO = 1.6
+TILE_MIN_SCALE = 0.5
+TILE_OVERLAP = 0.1
+
+# Pages too wide for the model input at the minimum scale are cut into strips on the
+# lightest pixel column within this fraction of the limit around every cut, which is
+# the gap between two columns of text when there is one.
+COLUMN_CUT_WINDOW = 0.3
+
+MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+}
+
+def get_input_limits(model: str) -> dict:
+    """Returns the input limits of a vision model."""
+    return MODEL_INPUT_LIMITS.get(model, DEFAULT_INPUT_LIMITS)
+
+def detect_mime_type(data: bytes) -> str:
+    """
+    Detects the mime type of encoded image bytes from their signature.
+
+    Args:
+        data (bytes): Encoded image.
+
+    Returns:
+        str: The mime type, or None if the format is not recognised.
+    """
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+def is_bilevel(image: np.ndarray) -> bool:
+    """Checks if an image only contains black and white pixels, as produced by the full preprocessing."""
+    sample = image[::8, ::8]
+    return bool(np.isin(sample, (0, 255)).all())
+
+def resize_to_fit(image: np.ndarray, max_side: int) -> np.ndarray:
+    """Downscales an image so that its longest side is at most `max_side`."""
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    return cv.resize(image, (max(int(width * scale), 1), max(int(height * scale), 1)), interpolation=cv.INTER_AREA)
+
+def encode_array(image: np.ndarray, extension: str, quality: int = None) -> bytes:
+    """Encodes an image array to the given format."""
+    params = []
+    if extension == ".jpg":
+        params = [cv.IMWRITE_JPEG_QUALITY, quality]
+    elif extension == ".webp":
+        params = [cv.IMWRITE_WEBP_QUALITY, quality]
+    elif extension == ".png":
+        params = [cv.IMWRITE_PNG_COMPRESSION, 9]
+    success, buffer = cv.imencode(extension, image, params)
+    if not success:
+        raise ValueError(f"Could not encode image as {extension}")
+    return buffer.tobytes()
+
+def optimize_payload(image: np.ndarray, model: str) -> tuple[bytes, str]:
+    """
+    Picks the resolution, format and quality that fit an image in the input limits of a model.
+
+    Bilevel images are tried as lossless PNG first. Otherwise the smaller of JPEG and
+    WebP is used at the highest quality that fits, and the image is downscaled further
+    when even the lowest quality is too large.
+
+    Args:
+        image (numpy.ndarray): Image in OpenCV BGR or grayscale format.
+        model (str): Name of the target vision model.
+
+    Returns:
+        tuple[bytes, str]: The encoded image and its mime type.
+    """
+    limits = get_input_limits(model)
+    resized = resize_to_fit(image, limits["max_side"])
+
+    while True:
+        if is_bilevel(resized):
+            data = encode_array(resized, ".png")
+            if len(data) <= limits["max_bytes"]:
+                logger.debug(f"Optimized payload: png, {resized.shape[1]}x{resized.shape[0]}, {len(data)} bytes")
+                return data, MIME_TYPES[".png"]
+
+        for quality in QUALITIES:
+            candidates = [(encode_array(resized, extension, quality), extension) for extension in (".jpg", ".webp")]
+            data, extension = min(candidates, key=lambda candidate: len(candidate[0]))
+            if len(data) <= limits["max_bytes"]:
+                logger.debug(
+                    f"Optimized payload: {extension[1:]} q{quality}, "
+                    f"{resized.shape[1]}x{resized.shape[0]}, {len(data)} bytes"
+                )
+                return data, MIME_TYPES[extension]
+
+        height, width = resized.shape[:2]
+        if max(height, width) <= 64:
+            raise ValueError("Image does not fit in the model input limits")
+        resized = resize_to_fit(resized, int(max(height, width) * 0.75))
+
+def to_data_url(data: bytes, mime_type: str) -> str:
+    """Packs encoded image bytes into a base64 data URL."""
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+def needs_tiling(image: np.ndarray, model: str) -> bool:
+    """
+    Checks if a page is too tall or too dense to be sent to a model in one piece.
+
+    Args:
+        image (numpy.ndarray): Page image.
+        model (str): Name of the target vision model.
+
+    Returns:
+        bool: True if the page should be split into tiles.
+    """
+    height, width = image.shape[:2]
+    scale = get_input_limits(model)["max_side"] / max(height, width)
+    return height > TILE_ASPECT_RATIO * width or scale < TILE_MIN_SCALE
+
+def split_into_columns(image: np.ndarray, model: str) -> list[np.ndarray]:
+    """
+    Splits a page too wide to fit the model input without being shrunk below the
+    minimum scale into side-by-side strips, e.g. the two reports of a landscape page.
+
+    The strips are about the same width, and every cut is made on the lightest pixel
+    column near its even position, so that it goes through as little text as possible.
+
+    Args:
+        image (numpy.ndarray): Page image.
+        model (str): Name of the target vision model.
+
+    Returns:
+        list[numpy.ndarray]: The strips, from left to right. Only the page itself when it is narrow enough.
+    """
+    width = image.shape[1]
+    max_width = int(get_input_limits(model)["max_side"] / TILE_MIN_SCALE)
+    if width <= max_width:
+        return [image]
+
+    gray = image if image.ndim == 2 else cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+    darkness = 255 - gray.mean(axis=0)
+    window = int(max_width * COLUMN_CUT_WINDOW / 2)
+
+    strips = []
+    left = 0
+    while width - left > max_width:
+        count = -(-(width - left) // max_width)
+        target = left + (width - left) // count
+        low, high = max(target - window, left + 1), min(target + window, left + max_width)
+        # Of the lightest columns, the closest to the even position.
+        lightest = low + np.flatnonzero(darkness[low:high + 1] <= darkness[low:high + 1].min() + 1)
+        cut = int(lightest[np.argmin(np.abs(lightest - target))])
+        strips.append(image[:, left:cut])
+        left = cut
+    strips.append(image[:, left:])
+
+    logger.info(f"Split wide image into {len(strips)} strips")
+    return strips
+
+def split_into_tiles(image: np.ndarray, model: str, overlap: float = TILE_OVERLAP) -> list[np.ndarray]:
+    """
+    Splits a page, or a strip of a wide page, into full-width horizontal tiles that
+    overlap vertically.
+
+    The tile height is chosen so that every tile fits the model input without
+    being shrunk below the minimum scale, which holds as long as the image is no
+    wider than that too, see `split_into_columns`.
+
+    Args:
+        image (numpy.ndarray): Page image.
+        model (str): Name of the target vision model.
+        overlap (float, optional): Fraction of the tile height shared with the next tile.
+
+    Returns:
+        list[numpy.ndarray]: The tiles, from top to bottom.
+    """
+    height, width = image.shape[:2]
+    max_side = get_input_limits(model)["max_side"] / TILE_MIN_SCALE
+    tile_height = int(min(width, max_side))
+    step = max(int(tile_height * (1 - overlap)), 1)
+
+    tiles = []
+    for top in range(0, height, step):
+        bottom = min(top + tile_height, height)
+        tiles.append(image[max(bottom - tile_height, 0):bottom])
+        if bottom == height:
+            break
+
+    logger.info(f"Split image into {len(tiles)} tiles")
+    return tiles
+
+def find_overlap(previous: list[str], current: list[str], max_offset: int = 2) -> int:
+    """
+    Finds how many leading lines of a tile repeat the end of the previous tile.
+
+    The repeated block may start after a few partial lines cut by the tile boundary.
+
+    Args:
+        previous (list[str]): Lines stitched so far.
+        current (list[str]): Lines of the current tile.
+        max_offset (int, optional): Maximum number of partial lines before the repeated block.
+
+    Returns:
+        int: Number of leading lines of the current tile to drop.
+    """
+    previous = [line.strip() for line in previous[-len(current):]]
+    current = [line.strip() for line in current]
+    for size in range(min(len(previous), len(current)), 0, -1):
+        for offset in range(min(max_offset, len(current) - size) + 1):
+            block = current[offset:offset + size]
+            if any(block) and previous[-size:] == block:
+                return offset + size
+    return 0
+
+def stitch_markdown(parts: list[str]) -> str:
+    """
+    Stitches the markdown of overlapping tiles back into one document.
+
+    Lines repeated at the boundary of two tiles because of the overlap are dropped,
+    as well as a table header that a tile repeats when it continues a table.
+
+    Args:
+        parts (list[str]): Markdown of every tile, from top to bottom.
+
+    Returns:
+        str: The stitched markdown.
+    """
+    stitched = []
+    for part in parts:
+        lines = (part or "").strip().split("\n")
+        if not stitched:
+            stitched.extend(lines)
+            continue
+
+        # Drop a repeated table header when the previous tile ended inside a table.
+        if (
+            len(lines) >= 2
+            and "|" in stitched[-1]
+            and "|" in lines[0]
+            and set(lines[1].replace("|", "").strip()) <= set("-: ")
+        ):
+            lines = lines[2:]
+
+        lines = lines[find_overlap(stitched, lines):]
+        stitched.extend(lines)
+
+    return "\n".join(stitched)
@@ -0,0 +1,258 @@
+import numpy as np
+import httpx
+import threading
+import ipaddress
+import socket
+import os
+from collections import OrderedDict
+from urllib.parse import urlparse
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Largest image accepted from a remote URL.
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", 25 * 1024 * 1024))
+
+# Total size of the images kept in the ETag cache.
+CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Comma separated hosts images may be fetched from. Any public host is allowed when unset.
+ALLOWED_IMAGE_HOSTS = {
+    host.strip().lower()
+    for host in os.environ.get("ALLOWED_IMAGE_HOSTS", "").split(",")
+    if host.strip()
+}
+
+# Set to 1 to allow fetching images from loopback, private and link-local addresses,
+# e.g. from a local object store in development.
+ALLOW_PRIVATE_IMAGE_HOSTS = os.environ.get("ALLOW_PRIVATE_IMAGE_HOSTS", "0") == "1"
+
+TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60)
+
+# Most redirects followed per fetch. Every hop is checked against the allowed hosts
+# and addresses before it is requested.
+MAX_REDIRECTS = 3
+
+_client = None
+_client_lock = threading.Lock()
+
+# url -> (etag, content), in least recently used order.
+_cache = OrderedDict()
+_cache_size = 0
+_cache_lock = threading.Lock()
+
+def is_public_address(address: str) -> bool:
+    """Checks if an IP address is public, i.e. neither loopback, private, link-local nor reserved."""
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+def is_allowed_host(url: str) -> bool:
+    """
+    Checks if images may be fetched from the host of a URL, without resolving it:
+    the host must be in ALLOWED_IMAGE_HOSTS when set, and must not be a loopback,
+    private or link-local address. Names are checked by `resolve_host` when fetching.
+
+    Args:
+        url (str): Remote URL.
+
+    Returns:
+        bool: True if the host is allowed.
+    """
+    host = (urlparse(str(url)).hostname or "").lower()
+    if not host or (ALLOWED_IMAGE_HOSTS and host not in ALLOWED_IMAGE_HOSTS):
+        return False
+    if ALLOW_PRIVATE_IMAGE_HOSTS:
+        return True
+    if host == "localhost" or host.endswith(".localhost"):
+        return False
+    try:
+        return is_public_address(host)
+    except ValueError:
+        # A name rather than an address.
+        return True
+
+def resolve_host(url: httpx.URL) -> str:
+    """
+    Resolves the host of a URL, checking every address it resolves to.
+
+    Args:
+        url (httpx.URL): Remote URL.
+
+    Returns:
+        str: The address to connect to.
+
+    Raises:
+        ValueError: If the host resolves to an address that is not public.
+        httpx.ConnectError: If the host cannot be resolved.
+    """
+    try:
+        infos = socket.getaddrinfo(url.raw_host.decode("ascii"), url.port or (443 if url.scheme == "https" else 80), type=socket.SOCK_STREAM)
+    except OSError as e:
+        raise httpx.ConnectError(f"Could not resolve {url.host}: {e}")
+    addresses = [info[4][0] for info in infos]
+    if not ALLOW_PRIVATE_IMAGE_HOSTS and not all(is_public_address(address) for address in addresses):
+        raise ValueError(f"Host resolves to an address that is not allowed: {url.host}")
+    return addresses[0]
+
+def get_client() -> httpx.Client:
+    """Returns the pooled HTTP client shared by all the fetches, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = httpx.Client(timeout=TIMEOUT, limits=LIMITS, follow_redirects=False)
+            logger.info("HTTP client created")
+        return _client
+
+def close_client() -> None:
+    """Closes the pooled HTTP client."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+            logger.info("HTTP client closed")
+
+def get_cached(url: str) -> tuple[str, bytes]:
+    """Returns the cached (etag, content) of a URL, or None."""
+    with _cache_lock:
+        entry = _cache.get(url)
+        if entry is not None:
+            _cache.move_to_end(url)
+        return entry
+
+def set_cached(url: str, etag: str, content: bytes) -> None:
+    """Caches the content of a URL by ETag, evicting the least recently used entries."""
+    global _cache_size
+    if len(content) > CACHE_MAX_BYTES:
+        return
+    with _cache_lock:
+        previous = _cache.pop(url, None)
+        if previous is not None:
+            _cache_size -= len(previous[1])
+        _cache[url] = (etag, content)
+        _cache_size += len(content)
+        while _cache_size > CACHE_MAX_BYTES:
+            _, (_, evicted) = _cache.popitem(last=False)
+            _cache_size -= len(evicted)
+
+def open_stream(url: str, headers: dict) -> httpx.Response:
+    """
+    Sends a GET request and streams its response, following redirects by hand so that
+    no request is ever sent to a host that is not allowed. Every hop connects to the
+    address its host was checked against, so that the name cannot be resolved again to
+    another address in between.
+
+    Args:
+        url (str): Remote URL.
+        headers (dict): Request headers, sent on every hop.
+
+    Returns:
+        httpx.Response: The streamed response, to be closed by the caller.
+
+    Raises:
+        ValueError: If the host of the URL, or of a redirect, is not allowed or does not
+            resolve to a public address.
+        httpx.TooManyRedirects: If there are more than MAX_REDIRECTS redirects.
+    """
+    client = get_client()
+    url = httpx.URL(url)
+    for hop in range(MAX_REDIRECTS + 1):
+        if not is_allowed_host(url):
+            if hop == 0:
+                raise ValueError(f"Host is not allowed: {url.host}")
+            raise ValueError(f"Redirected to a host that is not allowed: {url.host}")
+        address = resolve_host(url)
+        request = client.build_request(
+            "GET", url.copy_with(host=address), headers={**headers, "Host": url.netloc.decode("ascii")},
+            extensions={"sni_hostname": url.raw_host.decode("ascii")},
+        )
+        response = client.send(request, stream=True)
+        if not response.has_redirect_location:
+            return response
+        response.close()
+        url = url.join(response.headers["Location"])
+    raise httpx.TooManyRedirects(f"More than {MAX_REDIRECTS} redirects", request=response.request)
+
+def fetch_image_bytes(url: str, max_bytes: int = MAX_IMAGE_BYTES) -> bytes:
+    """
+    Streams an image from a URL, reusing the cached copy when the server confirms its ETag.
+
+    Args:
+        url (str): Remote URL of the image.
+        max_bytes (int, optional): Largest accepted image.
+
+    Returns:
+        bytes: The encoded image.
+
+    Raises:
+        ValueError: If the host is not allowed or the image is larger than `max_bytes`.
+        httpx.HTTPError: If the request fails.
+    """
+    url = str(url)
+    cached = get_cached(url)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+
+    response = open_stream(url, headers)
+    try:
+        if response.status_code == 304 and cached:
+            logger.info("Image not modified, using cached copy")
+            return cached[1]
+        response.raise_for_status()
+
+        content_length = int(response.headers.get("Content-Length") or 0)
+        if content_length > max_bytes:
+            raise ValueError(f"Image is too large: {content_length} bytes (max {max_bytes})")
+
+        buffer = bytearray()
+        for chunk in response.iter_bytes():
+            buffer.extend(chunk)
+            if len(buffer) > max_bytes:
+                raise ValueError(f"Image is too large: more than {max_bytes} bytes")
+
+        content = bytes(buffer)
+        etag = response.headers.get("ETag")
+        if etag:
+            set_cached(url, etag, content)
+    finally:
+        response.close()
+
+    logger.info(f"Fetched {len(content)} bytes from URL")
+    return content
+
+def decode_image(data: bytes, flags: int = None) -> np.ndarray:
+    """
+    Decodes an encoded image straight into an OpenCV array.
+
+    Args:
+        data (bytes): Encoded image.
+        flags (int, optional): OpenCV imread flags. Defaults to IMREAD_COLOR.
+
+    Returns:
+        numpy.ndarray: The image in OpenCV BGR format.
+
+    Raises:
+        ValueError: If the bytes are not a supported image.
+    """
+    # Imported here, the URL checks of the request models do not need OpenCV
+    import cv2 as cv
+
+    image = cv.imdecode(np.frombuffer(data, np.uint8), cv.IMREAD_COLOR if flags is None else flags)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
+def fetch_image(url: str, max_bytes: int = MAX_IMAGE_BYTES) -> np.ndarray:
+    """
+    Fetches an image from a URL and decodes it into an OpenCV array.
+
+    Args:
+        url (str): Remote URL of the image.
+        max_bytes (int, optional): Largest accepted image.
+
+    Returns:
+        numpy.ndarray: The image in OpenCV BGR format.
+    """
+    return decode_image(fetch_image_bytes(url, max_bytes=max_bytes))
@@ -0,0 +1,188 @@
+from contextlib import contextmanager
+import threading
+import time
+import io
+import os
+import logging
+from .image_fetcher import fetch_image_bytes
+
+logger = logging.getLogger(__name__)
+
+# Scans above this resolution are decoded at a half, a quarter or an eighth of it,
+# as long as they stay at or above it. 0 always decodes at full resolution.
+TARGET_DPI = int(os.environ.get("IMAGE_TARGET_DPI", 300))
+
+# Bytes of decoded and preprocessed images a worker process may hold at once.
+IMAGE_MEMORY_BUDGET = int(os.environ.get("IMAGE_MEMORY_BUDGET", 1 << 30))
+
+# Seconds an image may wait for memory before giving up.
+BUDGET_TIMEOUT = float(os.environ.get("IMAGE_MEMORY_TIMEOUT", 60))
+
+# Long side of an A4 page in inches, to estimate the resolution of scans without DPI metadata.
+PAGE_LONG_SIDE = 11.69
+
+# Bytes per pixel alive at once while an image is preprocessed: the decoded color
+# image, its grayscale copy, and two working buffers.
+BYTES_PER_PIXEL = 3 + 3
+
+# Formats decoded straight at the reduced size. Others are decoded at full size first.
+SCALED_DECODE_FORMATS = {"JPEG", "MPO"}
+
+# Reduction factors of `cv.imread` and `cv.imdecode`.
+REDUCTIONS = (8, 4, 2)
+
+class MemoryBudgetTimeout(Exception):
+    """Raised when an image waited too long for memory."""
+
+class MemoryBudget:
+    """
+    Bounds the memory held by the images being decoded and preprocessed in a process.
+
+    An image larger than the whole budget is let through alone.
+    """
+
+    def __init__(self, total_bytes: int = IMAGE_MEMORY_BUDGET):
+        self.total_bytes = total_bytes
+        self.used_bytes = 0
+        self.peak_bytes = 0
+        self.waits = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes: int, timeout: float = BUDGET_TIMEOUT) -> int:
+        """
+        Waits until `nbytes` fit in the budget and reserves them.
+
+        Returns:
+            int: Bytes reserved, to release afterwards.
+
+        Raises:
+            MemoryBudgetTimeout: If the bytes did not fit before the timeout.
+        """
+        nbytes = min(nbytes, self.total_bytes)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            if self.used_bytes + nbytes > self.total_bytes:
+                self.waits += 1
+                logger.info(f"Waiting for {nbytes} bytes of image memory, {self.used_bytes} in use")
+            while self.used_bytes + nbytes > self.total_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise MemoryBudgetTimeout(f"No image memory freed within {timeout}s")
+                self._condition.wait(remaining)
+            self.used_bytes += nbytes
+            self.peak_bytes = max(self.peak_bytes, self.used_bytes)
+        return nbytes
+
+    def release(self, nbytes: int) -> None:
+        with self._condition:
+            self.used_bytes -= nbytes
+            self._condition.notify_all()
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            return {
+                "budget_bytes": self.total_bytes,
+                "used_bytes": self.used_bytes,
+                "peak_bytes": self.peak_bytes,
+                "waits": self.waits,
+            }
+
+# Budget of the images of the process.
+image_budget = MemoryBudget()
+
+def read_header(source: str | bytes) -> tuple[int, int, int, str]:
+    """
+    Reads the size, resolution and format of an image from its header, without decoding it.
+
+    Args:
+        source (str | bytes): Local path of the image, or its encoded bytes.
+
+    Returns:
+        tuple[int, int, int, str]: Width and height in pixels, DPI (None if unknown) and PIL format name.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+        width, height = image.size
+        dpi = image.info.get("dpi")
+        image_format = image.format
+    # Rounded, PNG stores the resolution in pixels per meter.
+    dpi = round(max(dpi)) if dpi and max(dpi) >= 72 else None
+    return width, height, dpi, image_format
+
+def estimate_bytes(width: int, height: int, reduction: int = 1, scaled_decode: bool = True) -> int:
+    """
+    Estimates the peak memory of decoding and preprocessing an image at a reduction.
+
+    Args:
+        width (int): Width of the image in pixels.
+        height (int): Height of the image in pixels.
+        reduction (int, optional): Reduction factor it is decoded at.
+        scaled_decode (bool, optional): Whether the format is decoded straight at the reduced size.
+    """
+    pixels = (width // reduction) * (height // reduction)
+    working = pixels * BYTES_PER_PIXEL
+    if reduction > 1 and not scaled_decode:
+        # The full color image and its reduced copy are briefly alive together.
+        return max(working, (width * height + pixels) * 3)
+    return working
+
+def choose_reduction(width: int, height: int, dpi: int = None, target_dpi: int = TARGET_DPI, budget_bytes: int = IMAGE_MEMORY_BUDGET) -> int:
+    """
+    Chooses the factor an image is decoded at: the largest that keeps it at or above
+    `target_dpi`, then larger as long as it does not fit in the budget.
+
+    Args:
+        width (int): Width of the image in pixels.
+        height (int): Height of the image in pixels.
+        dpi (int, optional): Resolution of the image. Estimated from an A4 page when unknown.
+        target_dpi (int, optional): Lowest resolution worth decoding at, 0 to disable reductions.
+        budget_bytes (int, optional): Memory budget of the process.
+
+    Returns:
+        int: 1, 2, 4 or 8.
+    """
+    if not target_dpi:
+        return 1
+    dpi = dpi or max(width, height) / PAGE_LONG_SIDE
+    reduction = next((factor for factor in REDUCTIONS if dpi / factor >= target_dpi), 1)
+    while reduction < REDUCTIONS[0] and estimate_bytes(width, height, reduction) > budget_bytes:
+        reduction *= 2
+    return reduction
+
+@contextmanager
+def bounded_image(source: str | bytes, budget: MemoryBudget = None, target_dpi: int = TARGET_DPI):
+    """
+    Reserves the memory an image needs to be decoded and preprocessed, for the duration
+    of the block, and chooses the reduction it is decoded at.
+
+    Remote images are fetched first, to read their header.
+
+    Args:
+        source (str | bytes): Path or URL of the image, or its encoded bytes.
+        budget (MemoryBudget, optional): Budget to reserve the memory from. Defaults to the process budget.
+        target_dpi (int, optional): Lowest resolution worth decoding at.
+
+    Yields:
+        tuple[str | bytes, int]: The source to decode (the bytes of remote images), and the reduction factor.
+    """
+    budget = budget or image_budget
+    if isinstance(source, str) and source.startswith(("http://", "https://")):
+        source = fetch_image_bytes(source)
+
+    try:
+        width, height, dpi, image_format = read_header(source)
+    except Exception as e:
+        # Decoded at full resolution, OpenCV reads formats PIL does not.
+        logger.warning(f"Could not read the image header: {e}")
+        yield source, 1
+        return
+
+    reduction = choose_reduction(width, height, dpi, target_dpi, budget.total_bytes)
+    if reduction > 1:
+        logger.info(f"Decoding {width}x{height} image at 1/{reduction} resolution")
+    reserved = budget.acquire(estimate_bytes(width, height, reduction, image_format in SCALED_DECODE_FORMATS))
+    try:
+        yield source, reduction
+    finally:
+        budget.release(reserved)
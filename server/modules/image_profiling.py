@@ -0,0 +1,160 @@
+import cv2 as cv
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Preprocessing profiles, from the cheapest to the most aggressive.
+PASSTHROUGH = "passthrough"
+LIGHT = "light"
+FULL = "full"
+PROFILES = (PASSTHROUGH, LIGHT, FULL)
+
+# Longest side of the thumbnail used for the estimation.
+THUMBNAIL_SIZE = 512
+
+# Routing thresholds.
+PASSTHROUGH_MAX_NOISE = 2.0
+PASSTHROUGH_MIN_CONTRAST = 150
+PASSTHROUGH_MAX_SKEW = 0.5
+PASSTHROUGH_MIN_BACKGROUND = 0.5
+LIGHT_MAX_NOISE = 6.0
+LIGHT_MAX_SKEW = 2.0
+
+def make_thumbnail(image: np.ndarray, size: int = THUMBNAIL_SIZE) -> np.ndarray:
+    """
+    Downscales an image to a grayscale thumbnail whose longest side is at most `size`.
+
+    Args:
+        image (numpy.ndarray): Input image (BGR or grayscale).
+        size (int, optional): Longest side of the thumbnail.
+
+    Returns:
+        numpy.ndarray: Grayscale thumbnail.
+    """
+    gray = image if image.ndim == 2 else cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    scale = size / max(height, width)
+    if scale >= 1:
+        return gray
+    return cv.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv.INTER_AREA)
+
+def center_crop(image: np.ndarray, size: int = THUMBNAIL_SIZE) -> np.ndarray:
+    """
+    Crops a grayscale `size` x `size` window from the center of an image, at full resolution.
+
+    Args:
+        image (numpy.ndarray): Input image (BGR or grayscale).
+        size (int, optional): Side of the crop.
+
+    Returns:
+        numpy.ndarray: Grayscale crop.
+    """
+    height, width = image.shape[:2]
+    top, left = max((height - size) // 2, 0), max((width - size) // 2, 0)
+    crop = image[top:top + size, left:left + size]
+    return crop if crop.ndim == 2 else cv.cvtColor(crop, cv.COLOR_BGR2GRAY)
+
+def estimate_noise(gray: np.ndarray) -> float:
+    """
+    Estimates the standard deviation of the noise in a grayscale image.
+
+    Uses the median absolute response of Immerkaer's Laplacian difference kernel,
+    which keeps text edges from being counted as noise.
+
+    Args:
+        gray (numpy.ndarray): Grayscale image.
+
+    Returns:
+        float: Estimated noise sigma.
+    """
+    height, width = gray.shape
+    if height < 3 or width < 3:
+        return 0.0
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    response = cv.filter2D(gray.astype(np.float32), -1, kernel)[1:-1, 1:-1]
+    # The kernel response has a standard deviation of 6 sigma for Gaussian noise.
+    return float(1.4826 * np.median(np.abs(response)) / 6)
+
+def estimate_skew(gray: np.ndarray) -> float:
+    """
+    Estimates the skew angle of the text in a grayscale image, in degrees.
+
+    Args:
+        gray (numpy.ndarray): Grayscale image.
+
+    Returns:
+        float: Skew angle in the range [-45, 45].
+    """
+    _, binary = cv.threshold(gray, 0, 255, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
+    coords = cv.findNonZero(binary)
+    if coords is None or len(coords) < 50:
+        return 0.0
+    angle = cv.minAreaRect(coords)[-1]
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    return float(angle)
+
+def estimate_image_quality(image: np.ndarray) -> dict:
+    """
+    Estimates histogram and skew statistics on a thumbnail of the image, and noise on a center crop.
+
+    Args:
+        image (numpy.ndarray): Input image (BGR or grayscale).
+
+    Returns:
+        dict: The 'contrast', 'background', 'noise' and 'skew' estimates.
+    """
+    thumbnail = make_thumbnail(image)
+    histogram = cv.calcHist([thumbnail], [0], None, [256], [0, 256]).ravel()
+    cumulative = np.cumsum(histogram) / histogram.sum()
+    low = int(np.searchsorted(cumulative, 0.05))
+    high = int(np.searchsorted(cumulative, 0.95))
+
+    quality = {
+        "contrast": high - low,
+        "background": float(histogram[200:].sum() / histogram.sum()),
+        "noise": round(estimate_noise(center_crop(image)), 3),
+        "skew": round(estimate_skew(thumbnail), 3),
+    }
+    logger.debug(f"Estimated image quality: {quality}")
+    return quality
+
+def select_preprocessing_profile(image: np.ndarray) -> str:
+    """
+    Routes an image to the 'passthrough', 'light' or 'full' preprocessing profile.
+
+    Clean, born-digital or well scanned reports are passed through as they are,
+    slightly noisy ones get a light cleanup and everything else goes through the
+    full enhancement chain.
+
+    Args:
+        image (numpy.ndarray): Input image (BGR or grayscale).
+
+    Returns:
+        str: The selected preprocessing profile.
+    """
+    try:
+        logger.info("Selecting preprocessing profile...")
+        quality = estimate_image_quality(image)
+        skew = abs(quality["skew"])
+
+        if (
+            quality["noise"] <= PASSTHROUGH_MAX_NOISE
+            and quality["contrast"] >= PASSTHROUGH_MIN_CONTRAST
+            and quality["background"] >= PASSTHROUGH_MIN_BACKGROUND
+            and skew <= PASSTHROUGH_MAX_SKEW
+        ):
+            profile = PASSTHROUGH
+        elif quality["noise"] <= LIGHT_MAX_NOISE and skew <= LIGHT_MAX_SKEW:
+            profile = LIGHT
+        else:
+            profile = FULL
+
+        logger.info(f"Selected preprocessing profile: {profile}")
+        return profile
+    except Exception as e:
+        logger.error(f"Error while selecting preprocessing profile: {e}")
+    return FULL
@@ -1,29 +1,35 @@
-import google.generativeai as genai
-from dotenv import load_dotenv
 from PIL import Image
-import os
+import hashlib
 import logging
+from .model_executor import executor
+from .providers import gemini
 
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-
-# Configure the Generative AI model
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+# Deadline of a validation call, in seconds.
+VALIDATION_TIMEOUT = 30
 
 def validate_image(image: Image) -> bool:
     try:
         logger.info("Validating image...")
         # Define the AI model to use
         MODEL_NAME = "gemini-2.0-flash-exp"
-        model = genai.GenerativeModel(MODEL_NAME)
+        model = gemini().GenerativeModel(MODEL_NAME)
         logger.info(f"Model {MODEL_NAME} loaded")
 
         # Define the AI prompt
         prompt = "You are given a preprocessed image of a blood report. Analyze whether the preprocessing has maintained its medical readability. If the preprocessing has made the image an unusable mess from which no medical information can be inferred, respond only with 'invalid'. If the image remains perfectly readable and useful for medical purposes, respond only with 'valid'. Do not provide any explanation or additional text."
 
-        response = model.generate_content([prompt, image])
+        response = executor.call(
+            f"gemini/{MODEL_NAME}",
+            model.generate_content,
+            [prompt, image],
+            request_options={"timeout": VALIDATION_TIMEOUT},
+            timeout=VALIDATION_TIMEOUT,
+            retries=1,
+            hedge_percentile=95,
+            coalesce_key=hashlib.sha256(image.tobytes()).hexdigest(),
+        )
         is_valid = response.text
         logger.info("Image validation complete")
 
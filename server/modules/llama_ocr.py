@@ -1,18 +1,49 @@
-from together import Together
-import base64
+from concurrent.futures import ThreadPoolExecutor
+import cv2 as cv
+import numpy as np
+import contextvars
+import hashlib
 import os
 import logging
+from .model_executor import executor
+from .providers import together_client
+from .image_encoding import (
+    optimize_payload,
+    to_data_url,
+    detect_mime_type,
+    get_input_limits,
+    needs_tiling,
+    split_into_columns,
+    split_into_tiles,
+    stitch_markdown,
+)
 
 logger = logging.getLogger(__name__)
 
-def image_to_md(image_path: str, api_key: str = None, model: str = "Llama-3.2-90B-Vision") -> str:
+# Maximum number of tiles of a page converted concurrently.
+MAX_TILE_WORKERS = 4
+
+# Deadline of a vision model call, in seconds.
+OCR_TIMEOUT = 120
+
+SYSTEM_PROMPT = """Convert the provided image into Markdown format. 
+        Ensure that all content from the page is included, such as headers, footers, subtexts, images (with alt text if possible), tables, and any other elements.
+
+        Requirements:
+        - Output Only Markdown: Return solely the Markdown content without any additional explanations or comments.
+        - No Delimiters: Do not use code fences or delimiters like ```markdown.
+        - Complete Content: Do not omit any part of the page, including headers, footers, and subtext.
+        """
+
+def image_to_md(image_path: str | np.ndarray, api_key: str = None, model: str = "Llama-3.2-90B-Vision", tile: bool = False) -> str:
     """
     Convert an image into Markdown format using Together AI's vision model.
 
     Args:
-        image_path (str): Path to the image file (local or remote URL).
+        image_path (str | numpy.ndarray): Path to the image file (local or remote URL), or the loaded image.
         api_key (str, optional): Together AI API key. Defaults to environment variable TOGETHER_API_KEY.
         model (str, optional): Model to use ("Llama-3.2-90B-Vision", "Llama-3.2-11B-Vision", or "free").
+        tile (bool, optional): Split very tall, wide or dense pages into tiles converted concurrently.
 
     Returns:
         str: Extracted content in Markdown format.
@@ -32,37 +63,32 @@ def image_to_md(image_path: str, api_key: str = None, model: str = "Llama-3.2-90
 
     try:
 
-        client = Together(api_key=api_key)
-
-        # Prepare image for API request
-        final_image_url = image_path if is_remote_file(image_path) else encode_image(image_path)
-        logger.info("Image URL loaded")
-        logger.debug(f"Packed image in a final URL: {final_image_url[:50]}...")
-
-        system_prompt = """Convert the provided image into Markdown format. 
-        Ensure that all content from the page is included, such as headers, footers, subtexts, images (with alt text if possible), tables, and any other elements.
-
-        Requirements:
-        - Output Only Markdown: Return solely the Markdown content without any additional explanations or comments.
-        - No Delimiters: Do not use code fences or delimiters like ```markdown.
-        - Complete Content: Do not omit any part of the page, including headers, footers, and subtext.
-        """
+        # Retries are handled by the model executor.
+        client = together_client(api_key=api_key, timeout=OCR_TIMEOUT, max_retries=0)
+
+        if tile and not isinstance(image_path, np.ndarray) and not is_remote_file(image_path):
+            image_path = cv.imread(image_path)
+
+        if tile and isinstance(image_path, np.ndarray) and needs_tiling(image_path, model):
+            columns = [split_into_tiles(strip, model) for strip in split_into_columns(image_path, model)]
+            tiles = [tile_image for column in columns for tile_image in column]
+            with ThreadPoolExecutor(max_workers=MAX_TILE_WORKERS) as pool:
+                # Run every tile in a copy of the caller's context, to keep its request priority.
+                futures = [
+                    pool.submit(contextvars.copy_context().run, request_markdown, client, vision_llm, encode_image(tile_image, model))
+                    for tile_image in tiles
+                ]
+                parts = iter([future.result() for future in futures])
+            # The tiles of every strip are stitched together, then the strips are joined from left to right.
+            markdown = "\n\n".join(stitch_markdown([next(parts) for _ in column]) for column in columns)
+            logger.info(f"Stitched markdown of {len(tiles)} tiles")
+        else:
+            # Prepare image for API request
+            final_image_url = image_path if is_remote_file(image_path) else encode_image(image_path, model)
+            logger.info("Image URL loaded")
+            logger.debug(f"Packed image in a final URL: {final_image_url[:50]}...")
+            markdown = request_markdown(client, vision_llm, final_image_url)
 
-        response = client.chat.completions.create(
-            model=vision_llm,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": system_prompt},
-                        {"type": "image_url", "image_url": {"url": final_image_url}},
-                    ],
-                }
-            ],
-        )
-
-        markdown = response.choices[0].message.content
-        
         logger.info("Response successfully recieved from TogetherAI vision model")
         logger.debug(f"Response content: \n{markdown}")
 
@@ -70,21 +96,72 @@ def image_to_md(image_path: str, api_key: str = None, model: str = "Llama-3.2-90
     except Exception as e:
         logger.error(f"Error while converting image to markdown: {e}")
 
+def request_markdown(client: "Together", vision_llm: str, image_url: str) -> str:
+    """
+    Sends one image to the vision model and returns its markdown.
+
+    Args:
+        client (Together): Together AI client.
+        vision_llm (str): Full name of the vision model.
+        image_url (str): Remote URL or base64 data URL of the image.
 
-def encode_image(image_path: str) -> str:
-    """Encodes an image to base64 format."""
+    Returns:
+        str: Extracted content in Markdown format.
+    """
+    response = executor.call(
+        f"together/{vision_llm}",
+        client.chat.completions.create,
+        timeout=OCR_TIMEOUT,
+        coalesce_key=hashlib.sha256(image_url.encode("utf-8")).hexdigest(),
+        model=vision_llm,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": SYSTEM_PROMPT},
+                    {"type": "image_url", "image_url": {"url": image_url}},
+                ],
+            }
+        ],
+    )
+    return response.choices[0].message.content
+
+def encode_image(image_path: str | np.ndarray, model: str = "Llama-3.2-90B-Vision") -> str:
+    """
+    Encodes an image to a base64 data URL that fits the input limits of the model.
+
+    Local files already within the limits are sent as they are, with their actual
+    mime type. Anything else is resized and re-encoded by the payload optimizer.
+    """
     try:
-        logger.info("Encoding local file")
-        with open(image_path, "rb") as image_file:
-            encoded_image = f"data:image/jpeg;base64,{base64.b64encode(image_file.read()).decode('utf-8')}"
-            logger.info("Successfully encoded the image")
-            return encoded_image
+        logger.info("Encoding image")
+        if not isinstance(image_path, np.ndarray):
+            with open(image_path, "rb") as image_file:
+                data = image_file.read()
+            mime_type = detect_mime_type(data)
+            image = cv.imdecode(np.frombuffer(data, np.uint8), cv.IMREAD_COLOR)
+            limits = get_input_limits(model)
+            if (
+                mime_type
+                and len(data) <= limits["max_bytes"]
+                and image is not None
+                and max(image.shape[:2]) <= limits["max_side"]
+            ):
+                logger.info("Successfully encoded the image")
+                return to_data_url(data, mime_type)
+            image_path = image
+
+        data, mime_type = optimize_payload(image_path, model)
+        logger.info("Successfully encoded the image")
+        return to_data_url(data, mime_type)
     except Exception as e:
         logger.error(f"Error while encoding the image: {e}")
 
-def is_remote_file(image_path: str) -> bool:
+def is_remote_file(image_path: str | np.ndarray) -> bool:
     """Checks if a file path is a remote URL."""
     try:
+        if isinstance(image_path, np.ndarray):
+            return False
         is_remote = image_path.startswith("http://") or image_path.startswith("https://")
         logger.info("File is remote" if is_remote else "File is local")
         return is_remote
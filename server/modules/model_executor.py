@@ -0,0 +1,369 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+import threading
+import random
+import time
+import os
+import logging
+from .rate_limiter import Coalescer, RateLimitTimeout, get_limiter, request_priority
+from .tracing import span, increment, CLIENT
+
+logger = logging.getLogger(__name__)
+
+# Defaults of the remote model calls.
+DEFAULT_TIMEOUT = float(os.environ.get("MODEL_TIMEOUT", 60))
+DEFAULT_RETRIES = int(os.environ.get("MODEL_RETRIES", 2))
+BACKOFF = 0.5
+MAX_WORKERS = int(os.environ.get("MODEL_MAX_WORKERS", 32))
+
+# Most calls of a provider running in the pool at once, including the ones abandoned
+# after their deadline, so that a slow provider cannot take every worker.
+MAX_IN_FLIGHT = int(os.environ.get("MODEL_MAX_IN_FLIGHT", MAX_WORKERS // 2))
+
+# Circuit breaker settings.
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+# Latency samples kept per provider, and needed before hedging kicks in.
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+
+class ModelCallError(Exception):
+    """Raised when a remote model call fails after all its attempts."""
+
+class CircuitOpenError(ModelCallError):
+    """Raised without calling the provider while its circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Fails fast after repeated failures of a provider.
+
+    The circuit opens after `failure_threshold` consecutive failures. Once
+    `reset_timeout` seconds have passed a single trial call is let through, which
+    closes the circuit again when it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        """Checks if a call may go through."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def release_trial(self) -> None:
+        """Lets another call be the trial, when the trial call never reached the provider."""
+        with self._lock:
+            self.trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class CallSlots:
+    """
+    Counts the calls of a provider running in the shared pool. A slot is taken before
+    a call is submitted and given back when the call returns, even if it was abandoned
+    long before.
+    """
+
+    def __init__(self, limit: int = MAX_IN_FLIGHT):
+        self.limit = limit
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float = None) -> bool:
+        """Takes a slot, waiting up to `timeout` seconds for one. Returns False if none was free."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < self.limit, timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, future=None) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+class ProviderStats:
+    """Rolling latency and error statistics of a provider."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.counts = {"calls": 0, "successes": 0, "failures": 0, "timeouts": 0, "retries": 0, "hedges": 0, "rejected": 0, "saturated": 0}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def record(self, success: bool, latency: float = None) -> None:
+        with self._lock:
+            self.outcomes.append(success)
+            if success:
+                self.latencies.append(latency)
+
+    def percentile(self, percentile: float) -> float:
+        """Returns a latency percentile in seconds, or None without enough samples."""
+        with self._lock:
+            if len(self.latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)]
+
+    def success_rate(self) -> float:
+        """Returns the success rate over the rolling window, or None without samples."""
+        with self._lock:
+            return sum(self.outcomes) / len(self.outcomes) if self.outcomes else None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            counts = dict(self.counts)
+
+        def at(percentile):
+            return round(latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)], 3) if latencies else None
+
+        return {
+            **counts,
+            "success_rate": self.success_rate(),
+            "latency_p50": at(50),
+            "latency_p95": at(95),
+            "latency_p99": at(99),
+        }
+
+class ModelExecutor:
+    """
+    Runs remote model calls with deadlines, jittered retries, optional hedging and circuit breaking.
+
+    Every call runs in a shared thread pool so that it can be abandoned once its
+    deadline passes. Abandoned calls keep their worker until they return, so each
+    provider only gets MAX_IN_FLIGHT workers at once. Statistics, circuit breakers and
+    call slots are kept per provider, every request waits for a token of the
+    provider's rate limiter and identical calls in flight at the same time can be
+    coalesced into one.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-call")
+        self.coalescer = Coalescer()
+        self._stats = {}
+        self._breakers = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def get_stats(self, provider: str) -> ProviderStats:
+        with self._lock:
+            return self._stats.setdefault(provider, ProviderStats())
+
+    def get_breaker(self, provider: str) -> CircuitBreaker:
+        with self._lock:
+            return self._breakers.setdefault(provider, CircuitBreaker())
+
+    def get_slots(self, provider: str) -> CallSlots:
+        with self._lock:
+            return self._slots.setdefault(provider, CallSlots())
+
+    def call(
+        self,
+        provider: str,
+        fn,
+        *args,
+        timeout: float = DEFAULT_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        hedge_percentile: float = None,
+        coalesce_key: str = None,
+        **kwargs,
+    ):
+        """
+        Calls a remote model function.
+
+        Args:
+            provider (str): Name of the provider and model, e.g. 'gemini/gemini-2.0-flash-exp'.
+            fn (callable): The function making the remote call.
+            *args: Positional arguments of `fn`.
+            timeout (float, optional): Deadline of every attempt, in seconds.
+            retries (int, optional): Number of retries after the first attempt.
+            hedge_percentile (float, optional): Send a duplicate request when an attempt
+                is slower than this latency percentile of the provider.
+            coalesce_key (str, optional): Identifies the request, concurrent calls with the
+                same provider and key share a single call.
+            **kwargs: Keyword arguments of `fn`.
+
+        Returns:
+            The result of `fn`.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker of the provider is open.
+            ModelCallError: If every attempt failed or timed out.
+        """
+        if coalesce_key is not None:
+            return self.coalescer.run(
+                (provider, coalesce_key),
+                self.call,
+                provider,
+                fn,
+                *args,
+                timeout=timeout,
+                retries=retries,
+                hedge_percentile=hedge_percentile,
+                **kwargs,
+            )
+
+        stats = self.get_stats(provider)
+        limiter = get_limiter(provider)
+        level = request_priority.get()
+        breaker = self.get_breaker(provider)
+        last_error = None
+
+        with span("model_call", kind=CLIENT, provider=provider, timeout=timeout):
+            for attempt in range(retries + 1):
+                if not breaker.allow():
+                    stats.increment("rejected")
+                    raise CircuitOpenError(f"Circuit breaker is open for {provider}")
+
+                if limiter:
+                    try:
+                        waited = time.monotonic()
+                        limiter.acquire(level)
+                        increment("rate_limit_wait_ms", round((time.monotonic() - waited) * 1000))
+                    except RateLimitTimeout as e:
+                        stats.increment("rejected")
+                        # Nothing was learnt about the provider, a half-open circuit stays half-open.
+                        breaker.release_trial()
+                        raise ModelCallError(f"{provider} call was rate limited: {e}") from e
+
+                if attempt:
+                    stats.increment("retries")
+                stats.increment("calls")
+                increment("attempts")
+
+                try:
+                    with span("model_attempt", kind=CLIENT, provider=provider, attempt=attempt + 1):
+                        result, latency = self._attempt(
+                            stats, self.get_slots(provider), limiter, fn, args, kwargs, timeout, hedge_percentile
+                        )
+                    stats.increment("successes")
+                    stats.record(True, latency)
+                    breaker.record_success()
+                    return result
+                except TimeoutError as e:
+                    stats.increment("timeouts")
+                    last_error = e
+                except Exception as e:
+                    last_error = e
+
+                stats.increment("failures")
+                stats.record(False)
+                breaker.record_failure()
+                logger.warning(f"Attempt {attempt + 1} of {provider} call failed: {last_error}")
+
+                if attempt < retries:
+                    time.sleep(BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+            raise ModelCallError(f"{provider} call failed after {retries + 1} attempts: {last_error}") from last_error
+
+    def _submit(self, slots: CallSlots, fn, args: tuple, kwargs: dict):
+        """Submits a call to the pool, holding a slot that is given back when the call returns."""
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(slots.release)
+        return future
+
+    def _attempt(self, stats: ProviderStats, slots: CallSlots, limiter, fn, args: tuple, kwargs: dict, timeout: float, hedge_percentile: float):
+        """Runs one attempt, hedged if needed, and returns its result and latency."""
+        start = time.monotonic()
+        deadline = start + timeout
+        if not slots.acquire(timeout):
+            stats.increment("saturated")
+            raise TimeoutError(f"{slots.limit} calls still running, no free worker after {timeout}s")
+        futures = {self._submit(slots, fn, args, kwargs)}
+
+        hedge_delay = stats.percentile(hedge_percentile) if hedge_percentile else None
+        hedged = hedge_delay is None or hedge_delay >= timeout
+        error = None
+
+        while futures:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_time = remaining if hedged else min(remaining, max(hedge_delay - (time.monotonic() - start), 0))
+            done, futures = wait(futures, timeout=wait_time, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    for pending in futures:
+                        pending.cancel()
+                    return future.result(), time.monotonic() - start
+                error = future.exception()
+
+            if not hedged and not done:
+                hedged = True
+                if not slots.acquire(timeout=0):
+                    # Never take the last workers for a duplicate request.
+                    stats.increment("saturated")
+                    continue
+                if limiter and not limiter.try_acquire():
+                    # Never exceed the rate limit for a duplicate request.
+                    slots.release()
+                    continue
+                stats.increment("hedges")
+                increment("hedges")
+                logger.info("Sending a hedged duplicate request")
+                futures.add(self._submit(slots, fn, args, kwargs))
+
+        for pending in futures:
+            pending.cancel()
+        if error is not None and not futures:
+            raise error
+        raise TimeoutError(f"Call timed out after {timeout}s")
+
+    def stats(self) -> dict:
+        """Returns the statistics and circuit state of every provider."""
+        with self._lock:
+            providers = list(self._stats)
+        return {
+            provider: {
+                **self.get_stats(provider).snapshot(),
+                "circuit": self.get_breaker(provider).state,
+                "in_flight": self.get_slots(provider).in_flight,
+            }
+            for provider in providers
+        }
+
+    def shutdown(self) -> None:
+        """Stops the thread pool without waiting for abandoned calls."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# Executor shared by all the remote model calls.
+executor = ModelExecutor()
@@ -0,0 +1,123 @@
+from collections import Counter
+import threading
+import logging
+from .model_executor import executor
+
+logger = logging.getLogger(__name__)
+
+# Models of every task, grouped in quality tiers from the cheapest to the most accurate.
+MODEL_TIERS = {
+    "vision": [
+        ["Llama-3.2-11B-Vision"],
+        ["Llama-3.2-90B-Vision"],
+    ],
+    "format": [
+        ["gemini-2.0-flash-exp", "gemini-1.5-flash"],
+    ],
+}
+
+# A model is unhealthy below this success rate over its rolling window.
+MIN_SUCCESS_RATE = 0.8
+
+def provider_key(task: str, model: str) -> str:
+    """Returns the model executor key of a model, e.g. 'gemini/gemini-2.0-flash-exp'."""
+    if task == "vision":
+        vision_llm = "meta-llama/Llama-Vision-Free" if model == "free" else f"meta-llama/{model}-Instruct-Turbo"
+        return f"together/{vision_llm}"
+    return f"gemini/{model}"
+
+class ModelRouter:
+    """
+    Routes every request to the fastest healthy model of a quality tier.
+
+    Health and latency come from the rolling statistics of the model executor:
+    models whose circuit is open or whose success rate dropped below
+    MIN_SUCCESS_RATE are skipped, the others are ranked by median latency.
+    Models without samples yet rank first so that they get measured.
+    When no model of a tier is healthy the next tier is used.
+    """
+
+    def __init__(self, tiers: dict = None):
+        self.tiers = tiers or MODEL_TIERS
+        self.decisions = Counter()
+        self._lock = threading.Lock()
+
+    def is_healthy(self, task: str, model: str) -> bool:
+        stats = executor.stats().get(provider_key(task, model))
+        if stats is None:
+            return True
+        success_rate = stats["success_rate"]
+        return stats["circuit"] != "open" and (success_rate is None or success_rate >= MIN_SUCCESS_RATE)
+
+    def latency(self, task: str, model: str) -> float:
+        stats = executor.stats().get(provider_key(task, model))
+        return (stats or {}).get("latency_p50") or 0.0
+
+    def candidates(self, task: str, tier: int = 0) -> list[str]:
+        """
+        Returns the models to try for a task, best first, starting at a quality tier.
+
+        Healthy models of the tier come first, fastest first, followed by the
+        healthy models of the higher tiers. Unhealthy models come last, as a last resort.
+
+        Args:
+            task (str): 'vision' or 'format'.
+            tier (int, optional): Lowest quality tier to use.
+
+        Returns:
+            list[str]: The models, in order of preference.
+        """
+        healthy, unhealthy = [], []
+        for models in self.tiers[task][tier:]:
+            ranked = sorted(models, key=lambda model: self.latency(task, model))
+            healthy.extend(model for model in ranked if self.is_healthy(task, model))
+            unhealthy.extend(model for model in ranked if not self.is_healthy(task, model))
+        return healthy + unhealthy
+
+    def choose(self, task: str, tier: int = 0, reason: str = "fastest") -> str:
+        """
+        Chooses the model for a request and records the decision.
+
+        Args:
+            task (str): 'vision' or 'format'.
+            tier (int, optional): Lowest quality tier to use.
+            reason (str, optional): Why the tier was chosen, recorded with the decision.
+
+        Returns:
+            str: The model.
+        """
+        tier = min(tier, len(self.tiers[task]) - 1)
+        model = self.candidates(task, tier)[0]
+        self.record(task, model, reason)
+        logger.info(f"Routed {task} request to {model} ({reason})")
+        return model
+
+    def record(self, task: str, model: str, reason: str) -> None:
+        with self._lock:
+            self.decisions[(task, model, reason)] += 1
+
+    def tier_count(self, task: str) -> int:
+        return len(self.tiers[task])
+
+    def tier_of(self, task: str, model: str) -> int:
+        """Returns the quality tier of a model."""
+        return next(tier for tier, models in enumerate(self.tiers[task]) if model in models)
+
+    def snapshot(self) -> dict:
+        """Returns the routing decisions and the health of every model."""
+        with self._lock:
+            decisions = [
+                {"task": task, "model": model, "reason": reason, "count": count}
+                for (task, model, reason), count in sorted(self.decisions.items())
+            ]
+        models = {
+            task: {
+                model: {"healthy": self.is_healthy(task, model), "latency_p50": self.latency(task, model) or None}
+                for models in tiers for model in models
+            }
+            for task, tiers in self.tiers.items()
+        }
+        return {"decisions": decisions, "models": models}
+
+# Router shared by all the requests.
+router = ModelRouter()
@@ -0,0 +1,223 @@
+from concurrent.futures import ProcessPoolExecutor
+from abc import ABC, abstractmethod
+import numpy as np
+import threading
+import statistics
+import os
+import logging
+
+try:
+    import pytesseract
+except ImportError:  # Optional dependency, only needed by the tesseract backend
+    pytesseract = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "llama"
+
+# Registered OCR backends by name.
+OCR_BACKENDS = {}
+
+class OCRBackend(ABC):
+    """
+    Base class of the engines that convert an image of a report to markdown.
+
+    Subclasses set a unique `name` and implement `image_to_md`, and are made
+    available for per-request selection with the `register_backend` decorator,
+    which fails for a backend that does not implement it.
+    """
+    name = None
+    # Whether the model of the backend is picked by the model router.
+    routed = False
+
+    @abstractmethod
+    def image_to_md(self, image_path: str | np.ndarray, tile: bool = False, model: str = None) -> str:
+        """
+        Converts an image into Markdown format.
+
+        Args:
+            image_path (str | numpy.ndarray): Path to the image file, or the loaded image.
+            tile (bool, optional): Split very tall or dense pages into tiles, when supported.
+            model (str, optional): Model to use, for backends that have several.
+
+        Returns:
+            str: Extracted content in Markdown format.
+        """
+
+def register_backend(backend_class: type) -> type:
+    """Registers an OCR backend class under its name."""
+    OCR_BACKENDS[backend_class.name] = backend_class()
+    return backend_class
+
+def get_backend(name: str = None) -> OCRBackend:
+    """
+    Returns a registered OCR backend.
+
+    Args:
+        name (str, optional): Name of the backend. Defaults to DEFAULT_BACKEND.
+
+    Returns:
+        OCRBackend: The backend.
+
+    Raises:
+        ValueError: If no backend is registered under that name.
+    """
+    name = name or DEFAULT_BACKEND
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {name}. Available backends: {available_backends()}")
+    return OCR_BACKENDS[name]
+
+def available_backends() -> list[str]:
+    """Returns the names of the registered OCR backends."""
+    return sorted(OCR_BACKENDS)
+
+@register_backend
+class LlamaVisionBackend(OCRBackend):
+    """Remote OCR with Together AI's Llama Vision models."""
+    name = "llama"
+    routed = True
+
+    def __init__(self, model: str = "Llama-3.2-90B-Vision"):
+        self.model = model
+
+    def image_to_md(self, image_path: str | np.ndarray, tile: bool = False, model: str = None) -> str:
+        # Imported here, the request models only need the names of the backends
+        from .llama_ocr import image_to_md
+
+        return image_to_md(image_path=image_path, model=model or self.model, tile=tile)
+
+@register_backend
+class TesseractBackend(OCRBackend):
+    """
+    Local CPU OCR with Tesseract, run in a pool of worker processes.
+
+    Words are grouped into lines and split into cells on wide horizontal gaps, so the
+    tabular part of a report comes out as markdown tables.
+    """
+    name = "tesseract"
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or int(os.environ.get("OCR_WORKERS", os.cpu_count() or 1))
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        """Returns the worker pool, creating it on first use."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+                logger.info(f"Started {self.max_workers} OCR workers")
+            return self._pool
+
+    def shutdown(self) -> None:
+        """Stops the worker pool."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    def image_to_md(self, image_path: str | np.ndarray, tile: bool = False, model: str = None) -> str:
+        try:
+            if pytesseract is None:
+                raise RuntimeError("pytesseract is not installed")
+            logger.info("Converting image to markdown with Tesseract...")
+            markdown = self.get_pool().submit(tesseract_to_md, image_path).result()
+            logger.info("Successfully converted image to markdown with Tesseract")
+            logger.debug(f"Tesseract markdown: \n{markdown}")
+            return markdown
+        except Exception as e:
+            logger.error(f"Error while converting image to markdown with Tesseract: {e}")
+
+def tesseract_to_md(image_path: str | np.ndarray) -> str:
+    """
+    Runs Tesseract on an image and lays the recognised words out as markdown.
+
+    Runs inside the worker processes, so it only takes picklable arguments.
+
+    Args:
+        image_path (str | numpy.ndarray): Path to the image file, or the loaded image.
+
+    Returns:
+        str: Extracted content in Markdown format.
+    """
+    import cv2 as cv
+
+    image = image_path if isinstance(image_path, np.ndarray) else cv.imread(image_path)
+    if image is None:
+        raise ValueError(f"Could not read image: {image_path}")
+    if image.ndim == 3:
+        image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+
+    words = pytesseract.image_to_data(image, config="--psm 6", output_type=pytesseract.Output.DICT)
+    return words_to_markdown(words)
+
+def words_to_markdown(words: dict) -> str:
+    """
+    Lays out the words recognised by Tesseract as markdown text and tables.
+
+    Args:
+        words (dict): Output of `pytesseract.image_to_data` as a dictionary.
+
+    Returns:
+        str: The markdown.
+    """
+    lines = {}
+    for i, text in enumerate(words["text"]):
+        text = text.strip()
+        if not text or float(words["conf"][i]) < 0:
+            continue
+        key = (words["block_num"][i], words["par_num"][i], words["line_num"][i])
+        lines.setdefault(key, []).append((words["left"][i], words["width"][i], words["height"][i], text))
+
+    rows = [split_into_cells(sorted(line_words)) for _, line_words in sorted(lines.items())]
+
+    markdown_lines = []
+    table = []
+    for cells in rows + [[]]:
+        if len(cells) >= 2:
+            table.append(cells)
+            continue
+        if len(table) >= 2:
+            markdown_lines.extend(table_to_markdown(table))
+        else:
+            markdown_lines.extend(" ".join(row) for row in table)
+        table = []
+        if cells:
+            markdown_lines.append(cells[0])
+
+    return "\n".join(markdown_lines)
+
+def split_into_cells(line_words: list[tuple]) -> list[str]:
+    """
+    Splits the words of a line into cells on gaps wider than two word heights.
+
+    Args:
+        line_words (list[tuple]): (left, width, height, text) of the words, from left to right.
+
+    Returns:
+        list[str]: The text of every cell.
+    """
+    gap = 2 * statistics.median(height for _, _, height, _ in line_words)
+    cells = [[line_words[0][3]]]
+    for (left, width, _, _), (next_left, _, _, text) in zip(line_words, line_words[1:]):
+        if next_left - (left + width) > gap:
+            cells.append([text])
+        else:
+            cells[-1].append(text)
+    return [" ".join(cell) for cell in cells]
+
+def table_to_markdown(table: list[list[str]]) -> list[str]:
+    """
+    Formats rows of cells as a markdown table, the first row being the header.
+
+    Args:
+        table (list[list[str]]): Rows of cells.
+
+    Returns:
+        list[str]: The lines of the markdown table.
+    """
+    columns = max(len(row) for row in table)
+    rows = [row + ["-"] * (columns - len(row)) for row in table]
+    lines = ["| " + " | ".join(row) + " |" for row in rows]
+    lines.insert(1, "|" + "---|" * columns)
+    return [""] + lines + [""]
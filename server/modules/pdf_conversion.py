@@ -1,5 +1,22 @@
 import os
-import pymupdf
+import statistics
+import logging
+from .table_normalizer import map_header
+
+logger = logging.getLogger(__name__)
+
+# A page needs at least this many characters of text to skip OCR.
+MIN_TEXT_CHARS = 50
+
+# Pages whose text has more of these replacement characters (fonts without a
+# unicode mapping) are treated as having no usable text.
+MAX_UNMAPPED_RATIO = 0.1
+
+# Resolution pages without usable text are rendered at for OCR.
+OCR_DPI = 200
+
+# Gap between two words of a line, in word heights, that separates two cells.
+CELL_GAP = 2
 
 def extract_images_from_pdf(pdf_path: str) -> list[str]:
     """
@@ -11,6 +28,9 @@ def extract_images_from_pdf(pdf_path: str) -> list[str]:
     Returns:
         list[str]: List of file paths to the extracted images.
     """
+    # Imported here, pymupdf is slow to import and only needed for PDFs
+    import pymupdf
+
     # Ensure the PDF exists
     if not os.path.isfile(pdf_path):
         raise FileNotFoundError(f"File not found: {pdf_path}")
@@ -50,7 +70,184 @@ def extract_images_from_pdf(pdf_path: str) -> list[str]:
 
         return image_paths
 
+def has_usable_text(text: str, min_chars: int = MIN_TEXT_CHARS) -> bool:
+    """
+    Checks if the text layer of a page is worth using instead of OCR.
+
+    Args:
+        text (str): Text of the page.
+        min_chars (int, optional): Least number of non blank characters.
+
+    Returns:
+        bool: True if the text is long enough and mostly mapped to unicode.
+    """
+    characters = "".join(text.split())
+    if len(characters) < min_chars:
+        return False
+    return characters.count("\ufffd") / len(characters) <= MAX_UNMAPPED_RATIO
+
+def group_lines(words: list[tuple]) -> list[list[tuple]]:
+    """
+    Groups the words of a page into lines by their vertical position, since the cells
+    of a table row are often separate text blocks.
+
+    Returns:
+        list[list[tuple]]: The words of every line, top to bottom, each left to right.
+    """
+    lines = []
+    line_center = None
+    for word in sorted(words, key=lambda word: ((word[1] + word[3]) / 2, word[0])):
+        center, height = (word[1] + word[3]) / 2, word[3] - word[1]
+        if line_center is None or abs(center - line_center) > height / 2:
+            lines.append([])
+            line_center = center
+        lines[-1].append(word)
+    return [sorted(line, key=lambda word: word[0]) for line in lines]
+
+def line_cells(line: list[tuple]) -> list[tuple[float, float, str]]:
+    """Splits the words of a line into cells, (x0, x1, text), on gaps wider than CELL_GAP word heights."""
+    gap = CELL_GAP * statistics.median(word[3] - word[1] for word in line)
+    cells = []
+    for x0, _, x1, _, text, *_ in line:
+        if cells and x0 - cells[-1][1] <= gap:
+            cells[-1] = (cells[-1][0], x1, f"{cells[-1][2]} {text}")
+        else:
+            cells.append((x0, x1, text))
+    return cells
+
+def place_cells(cells: list[tuple[float, float, str]], lefts: list[float]) -> list[str]:
+    """Puts every cell of a row in the column of the header cell it sits under, by its center."""
+    values = [""] * len(lefts)
+    for x0, x1, text in cells:
+        center = (x0 + x1) / 2
+        index = max((index for index, left in enumerate(lefts) if left <= center), default=0)
+        values[index] = f"{values[index]} {text}".strip()
+    return values
+
+def text_lines(cells: list[tuple[float, float, str]]) -> list[str]:
+    """
+    Lays out a line outside of tables. Fields such as 'Patient Name : John Doe' and
+    'Age : 45 Years' printed side by side go on lines of their own, so that they are
+    read as header fields. Other lines are kept whole.
+    """
+    fields = []
+    for _, _, text in cells:
+        if fields and (text.startswith(":") or fields[-1].endswith(":")):
+            fields[-1] = f"{fields[-1]} {text}"
+        else:
+            fields.append(text)
+    if any(":" in field for field in fields):
+        return fields
+    return [" ".join(fields)]
+
+def page_words_to_markdown(words: list[tuple]) -> str:
+    """
+    Lays out the words of a PDF page as markdown text and tables.
+
+    Tables start at a header row whose cells map to the report columns, e.g.
+    'Investigation  Result  Unit  Reference Range', and every row below it is split
+    into the columns of the header it sits under. A line of a single cell, e.g.
+    'DIFFERENTIAL COUNT', is a section title and the table resumes under it. The
+    table ends at a row without a result or with a 'label: value' field, which is
+    kept as text like the rest of the page.
+
+    Args:
+        words (list[tuple]): Words of the page as returned by `page.get_text("words")`,
+            (x0, y0, x1, y1, text, block, line, word).
+
+    Returns:
+        str: The markdown.
+    """
+    output = []
+    header = None
+    rows = []
+
+    def flush() -> None:
+        if rows:
+            table = [header[0]] + [[value or "-" for value in row] for row in rows]
+            lines = ["| " + " | ".join(row) + " |" for row in table]
+            lines.insert(1, "|" + "---|" * len(header[0]))
+            output.extend([""] + lines + [""])
+            rows.clear()
+
+    for line in group_lines(words):
+        cells = line_cells(line)
+        texts = [text for _, _, text in cells]
+        columns = map_header(texts) if len(cells) >= 2 else None
+        if columns:
+            flush()
+            header = (texts, [x0 for x0, _, _ in cells], columns.index("result"))
+            continue
+        if header and not any(":" in text for text in texts):
+            if len(cells) == 1:
+                flush()
+                output.append(texts[0])
+                continue
+            row = place_cells(cells, header[1])
+            if row[header[2]]:
+                rows.append(row)
+                continue
+        flush()
+        header = None
+        output.extend(text_lines(cells))
+    flush()
+    return "\n".join(output).strip()
+
+def open_pdf(pdf: str | bytes):
+    """
+    Opens a PDF from its path or, without touching the disk, from its bytes.
+
+    Returns:
+        pymupdf.Document: The document.
+    """
+    # Imported here, pymupdf is slow to import and only needed for PDFs
+    import pymupdf
+
+    if isinstance(pdf, bytes):
+        return pymupdf.open(stream=pdf, filetype="pdf")
+    if not os.path.isfile(pdf):
+        raise FileNotFoundError(f"File not found: {pdf}")
+    return pymupdf.open(pdf)
+
+def extract_text_markdown(pdf: str | bytes, min_chars: int = MIN_TEXT_CHARS) -> list[str]:
+    """
+    Converts the text layer of every page of a PDF to markdown, without OCR.
+
+    Args:
+        pdf (str | bytes): Path to the input PDF file, or its content.
+        min_chars (int, optional): Least number of characters of a usable text layer.
+
+    Returns:
+        list[str]: The markdown of every page, None for the pages without usable text.
+    """
+    pages = []
+    with open_pdf(pdf) as doc:
+        for page_index, page in enumerate(doc):
+            if not has_usable_text(page.get_text(), min_chars=min_chars):
+                logger.info(f"Page {page_index + 1} has no usable text layer")
+                pages.append(None)
+                continue
+            pages.append(page_words_to_markdown(page.get_text("words")))
+    logger.info(f"Extracted the text layer of {sum(page is not None for page in pages)} of {len(pages)} pages")
+    return pages
+
+def render_pages(pdf: str | bytes, page_indexes: list[int], dpi: int = OCR_DPI) -> list[bytes]:
+    """
+    Renders pages of a PDF to PNG images in memory, for OCR.
+
+    Args:
+        pdf (str | bytes): Path to the input PDF file, or its content.
+        page_indexes (list[int]): Zero based indexes of the pages to render.
+        dpi (int, optional): Resolution of the images.
+
+    Returns:
+        list[bytes]: The encoded images, in the order of the indexes.
+    """
+    with open_pdf(pdf) as doc:
+        return [doc[page_index].get_pixmap(dpi=dpi).tobytes("png") for page_index in page_indexes]
+
 if __name__ == "__main__":
     pdf_path = "./data/CBC_Images_tobe delivered/01Jan2025022615_11F2023007525.pdf"
     image_paths = extract_images_from_pdf(pdf_path)
-    print(image_paths)
\ No newline at end of file
+    print(image_paths)
+    print(extract_text_markdown(pdf_path))
\ No newline at end of file
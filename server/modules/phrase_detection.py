@@ -1,6 +1,9 @@
 from fuzzywuzzy import process
+import hashlib
 import json
 import logging
+from .alias_cache import alias_cache
+from .tracing import set_attributes
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +24,8 @@ def detect_phrases(input_phrases: list[str]) -> dict:
              open("data/phrase_data/common_phrases.txt", "r") as common_phrases_file, \
              open("data/phrase_data/valid_short_terms.txt", "r") as valid_short_terms_file:
 
-            classification_dict = json.load(phrase_file)
+            phrase_data = phrase_file.read()
+            classification_dict = json.loads(phrase_data)
             logger.debug(f"Classification Dictionary: \n{classification_dict}")
             common_terms = set(common_phrases_file.read().lower().split(","))
             logger.debug(f"Common terms: \n{common_terms}")
@@ -42,7 +46,11 @@ def detect_phrases(input_phrases: list[str]) -> dict:
         for phrase in phrases
     }
 
+    # Aliases learned from earlier fuzzy matches are only valid for this vocabulary.
+    alias_cache.use_vocabulary(hashlib.sha256(phrase_data.encode()).hexdigest())
+
     classification_results = {}
+    matches = {"exact_matches": 0, "alias_matches": 0, "fuzzy_matches": 0, "unmatched": 0}
 
     logger.info(f"Processing {len(input_phrases)} input phrases...")
 
@@ -70,6 +78,14 @@ def detect_phrases(input_phrases: list[str]) -> dict:
         if normalized_phrase in phrase_to_key:  # Exact match in dataset.
             classification_results[phrase] = phrase_to_key[normalized_phrase]
             logger.debug(f"Exact match found for '{phrase}'. Classified as '{classification_results[phrase]}'.")
+            matches["exact_matches"] += 1
+            continue
+
+        alias = alias_cache.get(normalized_phrase)
+        if alias:  # Variant accepted by an earlier fuzzy match.
+            classification_results[phrase] = alias["classification"]
+            logger.debug(f"Learned alias: '{phrase}' -> '{alias['match']}'. Classified as '{classification_results[phrase]}'.")
+            matches["alias_matches"] += 1
             continue
 
         # Use fuzzy matching for approximate matches.
@@ -77,11 +93,15 @@ def detect_phrases(input_phrases: list[str]) -> dict:
 
         if score > 90:  # Threshold for fuzzy matching.
             classification_results[phrase] = phrase_to_key[closest_match]
+            alias_cache.learn(normalized_phrase, closest_match, classification_results[phrase], score)
+            matches["fuzzy_matches"] += 1
             logger.debug(f"Fuzzy match: '{phrase}' -> '{closest_match}' (score: {score}). Classified as '{classification_results[phrase]}'.")
         else:
             classification_results[phrase] = "Unknown"
+            matches["unmatched"] += 1
             logger.debug(f"No good match found for '{phrase}' (best fuzzy score: {score}). Classified as 'Unknown'.")
 
+    set_attributes(phrase_count=len(input_phrases), **matches)
     logger.info("Phrase classification completed.")
     logger.debug(f"Detected phrases: \n{classification_results}")
     return classification_results
@@ -1,26 +1,41 @@
 import cv2 as cv
 import numpy as np
-import requests
-from io import BytesIO
-from PIL import Image
+import httpx
 import logging
+from .image_fetcher import fetch_image_bytes, decode_image
 
 logger = logging.getLogger(__name__)
 
-def load_image(image_path: str) -> np.ndarray:
+# OpenCV flags decoding a color image at a reduced resolution, by reduction factor.
+REDUCED_COLOR_FLAGS = {
+    1: cv.IMREAD_COLOR,
+    2: cv.IMREAD_REDUCED_COLOR_2,
+    4: cv.IMREAD_REDUCED_COLOR_4,
+    8: cv.IMREAD_REDUCED_COLOR_8,
+}
+
+def load_image(image_path: str | bytes, reduction: int = 1) -> np.ndarray:
     """
     Fetches an image from a URL and loads it into a numpy array.
     
     Args:
-        image_path (str): URL of the image to preprocess.
+        image_path (str | bytes): URL or local path of the image to preprocess, or its encoded bytes.
+        reduction (int, optional): Decode at a half, a quarter or an eighth of the resolution (2, 4 or 8).
+            The full resolution is never allocated, JPEGs are even decoded at the reduced size.
     
     Returns:
         np.ndarray: The loaded image in OpenCV BGR format.
     """
 
     try:
+        flags = REDUCED_COLOR_FLAGS[reduction]
+        if isinstance(image_path, bytes):
+            image_cv = decode_image(image_path, flags)
+            logger.info(f"Decoded image of {len(image_path)} bytes")
+            return image_cv
+
         if "http" not in image_path:
-            image_cv = cv.imread(image_path)
+            image_cv = cv.imread(image_path, flags)
             if image_cv is None:
                 logger.info(f"Failed to load image from local path")
                 logger.error(f"Failed to load image from local path: {image_path}")
@@ -29,16 +44,11 @@ def load_image(image_path: str) -> np.ndarray:
                 logger.debug(f"Loaded image from local file path: {image_path}")
             return image_cv
         
-        response = requests.get(image_path)
-        response.raise_for_status()
+        image_cv = decode_image(fetch_image_bytes(image_path), flags)
         logger.info(f"Fetched image from URL")
         logger.debug(f"Fetched image from URL: {image_path}")
-
-        image_pil = Image.open(BytesIO(response.content))
-        image_array = np.array(image_pil)
-        image_cv = cv.cvtColor(image_array, cv.COLOR_RGB2BGR)
         return image_cv
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Error fetching image from URL: {e}")
     except Exception as e:
         logger.error(f"Unexpected error in load_image: {e}")
@@ -138,12 +148,14 @@ def deskew_image(image: np.ndarray, height: float, width: float) -> np.ndarray:
         A4_MAX_AREA = 8_700_000  # Upper limit 
         A4_MIN_AREA = 4_000_000  # Lower limit 
 
-        image_blur = cv.GaussianBlur(image, (5, 5), 1)
-        image_canny = cv.Canny(image_blur, 100, 100)
-        image_dial = cv.dilate(image_canny, np.ones((5, 5)), iterations=2)
-        image_erode = cv.erode(image_dial, np.ones((5, 5)), iterations=1)
+        # The blurred image is freed as soon as its edges are found, the edges are
+        # dilated and eroded in place.
+        image_edges = cv.Canny(cv.GaussianBlur(image, (5, 5), 1), 100, 100)
+        cv.dilate(image_edges, np.ones((5, 5)), dst=image_edges, iterations=2)
+        cv.erode(image_edges, np.ones((5, 5)), dst=image_edges, iterations=1)
 
-        contours, _ = cv.findContours(image_erode, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv.findContours(image_edges, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+        del image_edges
         biggest_contour, max_area = find_biggest_contour(contours)
 
         logger.info(f"Contour Detected, Area of biggest contour: {max_area}")
@@ -176,11 +188,11 @@ def increase_contrast(image: np.ndarray) -> np.ndarray:
         numpy.ndarray: Image with increased contrast.
     """
     try:
-        # Apply adaptive threshold
+        # Apply adaptive threshold, then clean it up in place
         image_adaptive_threshold = cv.adaptiveThreshold(image, 255, cv.ADAPTIVE_THRESH_GAUSSIAN_C, cv.THRESH_BINARY, 15, 5)
-        image_adaptive_threshold = cv.bitwise_not(image_adaptive_threshold)
-        image_adaptive_threshold = cv.medianBlur(image_adaptive_threshold, 3)
-        image_adaptive_threshold = cv.bitwise_not(image_adaptive_threshold)
+        cv.bitwise_not(image_adaptive_threshold, dst=image_adaptive_threshold)
+        cv.medianBlur(image_adaptive_threshold, 3, dst=image_adaptive_threshold)
+        cv.bitwise_not(image_adaptive_threshold, dst=image_adaptive_threshold)
 
         # Add filter
         image_filtered = cv.bilateralFilter(image_adaptive_threshold, d=9, sigmaColor=75, sigmaSpace=75)
@@ -200,12 +212,8 @@ def denoise_image(image: np.ndarray) -> np.ndarray:
         numpy.ndarray: Denoised image.
     """
     try:
-        kernel = np.ones((1, 1), np.uint8)
-
-        image_denoised = cv.dilate(image, kernel, iterations=2)  
-        image_denoised = cv.erode(image_denoised, kernel, iterations=2)   
-        image_denoised = cv.morphologyEx(image_denoised, cv.MORPH_CLOSE, kernel)
-        image_denoised = cv.medianBlur(image_denoised, 3)
+        # The threshold is taken on the input: morphology with a 1x1 kernel and a
+        # median blur of it were computed here only to be thrown away.
 
         # Apply Otsu Threshold
         _, image_otsu_threshold = cv.threshold(image, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
@@ -253,50 +261,82 @@ def emphasize_text(image: np.ndarray) -> np.ndarray:
         kernel = np.ones((2, 2), np.uint8)
 
         _, image_emphasized_text = cv.threshold(image, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
-        image_emphasized_text = cv.bitwise_not(image_emphasized_text)
-        image_emphasized_text = cv.dilate(image_emphasized_text, kernel, iterations=1)
-        image_emphasized_text = cv.bitwise_not(image_emphasized_text)
+        cv.bitwise_not(image_emphasized_text, dst=image_emphasized_text)
+        cv.dilate(image_emphasized_text, kernel, dst=image_emphasized_text, iterations=1)
+        cv.bitwise_not(image_emphasized_text, dst=image_emphasized_text)
         return image_emphasized_text
     except Exception as e:
         logger.error(f"Error while Emphasizing Text: {e}")
     return image
 
 
-def preprocess_image(image_path: str) -> np.ndarray:
+def light_preprocess(image: np.ndarray) -> np.ndarray:
+    """
+    Applies a light cleanup to an image that is already mostly clean.
+    
+    Args:
+        image (numpy.ndarray): Input grayscale image.
+    
+    Returns:
+        numpy.ndarray: Cleaned up image.
+    """
+    try:
+        image_denoised = cv.medianBlur(image, 3)
+        image_normalized = cv.normalize(image_denoised, None, 0, 255, cv.NORM_MINMAX)
+        return image_normalized
+    except Exception as e:
+        logger.error(f"Error while applying light preprocessing: {e}")
+    return image
+
+def preprocess_image(image_path: str | np.ndarray, profile: str = "full") -> np.ndarray:
     """
     Preprocesses an image for OCR.
     
     Args:
-        image (str): Path of input Image
+        image_path (str | numpy.ndarray): Path of input Image, or the already loaded image.
+        profile (str, optional): Preprocessing profile, one of 'passthrough', 'light' or 'full'.
     
     Returns:
         numpy.ndarray: Preprocessed image.
     """
     BORDER_SIZE = 20
+    image = None
     try:
-        logger.info("Preprocessing image...")
+        logger.info(f"Preprocessing image with the '{profile}' profile...")
         # Load Image
-        image = load_image(image_path)
+        image = image_path if isinstance(image_path, np.ndarray) else load_image(image_path)
+
+        if profile == "passthrough":
+            logger.info("Skipping preprocessing for a clean image")
+            return image
+
         # Get image dimensions
         height, width, channels = image.shape
-        # Resize image
-        image_resized = cv.resize(image, (width, height))
         # Convert to grayscale
-        image_grayed = cv.cvtColor(image_resized, cv.COLOR_BGR2GRAY)
+        image_grayed = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
+
+        if profile == "light":
+            image_light = light_preprocess(image_grayed)
+            logger.info("Sucessfully preprocessed the image")
+            return image_light
+
+        # Each step replaces the working image, so that at most two page-sized
+        # intermediates are alive at once. Resizing to the same size was only a copy.
         # Deskew Image
-        image_deskewed = deskew_image(image_grayed, height, width)
+        image_working = deskew_image(image_grayed, height, width)
+        del image_grayed
         # Increase contrast
-        image_contrasted = increase_contrast(image_deskewed)
+        image_working = increase_contrast(image_working)
         # Denoise Image
-        image_denoise = denoise_image(image_contrasted)
+        image_working = denoise_image(image_working)
         # Adjust borders
-        image_bordered = adjust_borders(image_denoise, height, width, BORDER_SIZE)
+        image_working = adjust_borders(image_working, height, width, BORDER_SIZE)
         # Emphasize text
-        image_emphasized = emphasize_text(image_bordered)
+        image_working = emphasize_text(image_working)
 
         logger.info("Sucessfully preprocessed the image")
 
-        return image_emphasized
+        return image_working
     except Exception as e:
         logger.error(f"Error in preprocess_image: {e}")
     return image
@@ -0,0 +1,201 @@
+from collections import Counter
+from pathlib import Path
+import datetime as dt
+import threading
+import signal
+import time
+import sys
+import os
+import logging
+from . import tracing
+from .tracing import STAGE_CODES
+
+logger = logging.getLogger(__name__)
+
+# Profiles are written here, as collapsed stacks.
+PROFILES_DIR = Path(os.environ.get("PROFILES_DIR", Path(__file__).resolve().parent.parent / "data/profiles"))
+
+# Seconds between two samples.
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.01))
+
+# Seconds profiled when started by a signal, and the longest any profile may run.
+SIGNAL_SECONDS = float(os.environ.get("PROFILE_SECONDS", 30))
+MAX_SECONDS = 600
+
+# Only the stacks going through the code of the project are kept, idle threads
+# of the server and of the pools are left out.
+PROJECT_DIR = str(Path(__file__).resolve().parent.parent)
+
+# The wrappers of the traced functions are left out of the stacks.
+TRACING_FILE = tracing.__file__
+
+_labels = {}
+
+def frame_label(code) -> str:
+    """Returns 'module:qualified name' of a code object, cached for the next samples."""
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{Path(code.co_filename).stem}:{code.co_qualname}"
+    return label
+
+def collapse_stack(frame) -> str:
+    """
+    Collapses the stack of a frame into 'root;...;leaf', with a '[stage]' frame above
+    every function that runs a traced stage.
+
+    Returns:
+        str: The stack, or None if it does not go through the code of the project.
+    """
+    labels = []
+    in_project = False
+    while frame is not None:
+        code = frame.f_code
+        frame = frame.f_back
+        if code.co_filename == TRACING_FILE:
+            continue
+        labels.append(frame_label(code))
+        stage = STAGE_CODES.get(code)
+        if stage:
+            labels.append(f"[{stage}]")
+        in_project = in_project or code.co_filename.startswith(PROJECT_DIR)
+    return ";".join(reversed(labels)) if in_project else None
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread of the process from a background thread, for
+    a number of seconds or of requests.
+
+    Writes the profile as collapsed stacks ('frame;frame;frame count' lines), the input
+    of flamegraph.pl, speedscope or inferno. Traced functions appear under a '[stage]'
+    frame, e.g. '[detect_phrases]'.
+
+    Sampling walks the frames of the threads, nothing is hooked into the profiled
+    code, so its overhead only depends on the interval.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, output_dir: Path = PROFILES_DIR):
+        self.interval = interval
+        self.output_dir = Path(output_dir)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stacks = Counter()
+        self.requests_left = None
+        self.last_profile = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float = None, requests: int = None) -> Path:
+        """
+        Starts profiling.
+
+        Args:
+            seconds (float, optional): Profile for this many seconds.
+            requests (int, optional): Profile until this many requests finished.
+                At most MAX_SECONDS seconds are profiled either way.
+
+        Returns:
+            Path: File the profile will be written to.
+
+        Raises:
+            RuntimeError: If a profile is already running.
+        """
+        with self._lock:
+            if self.running:
+                raise RuntimeError("A profile is already running")
+            timestamp = dt.datetime.now(dt.timezone.utc).strftime("%Y_%m_%d_%H_%M_%S")
+            output = self.output_dir / f"profile_{timestamp}_{os.getpid()}.collapsed"
+            self.stacks = Counter()
+            self.requests_left = requests
+            self._stop.clear()
+            duration = min(seconds or MAX_SECONDS, MAX_SECONDS)
+            self._thread = threading.Thread(target=self.run, args=(duration, output), name="profiler", daemon=True)
+            self._thread.start()
+        logger.warning(f"Profiling for {f'{requests} requests' if requests else f'{duration}s'}")
+        return output
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def request_finished(self) -> None:
+        """Counts a finished request, stopping a profile limited to a number of requests."""
+        if self.requests_left is not None and self.running:
+            with self._lock:
+                self.requests_left -= 1
+                if self.requests_left <= 0:
+                    self._stop.set()
+
+    def sample(self) -> None:
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = collapse_stack(frame)
+            if stack:
+                self.stacks[stack] += 1
+
+    def run(self, duration: float, output: Path) -> None:
+        start = time.monotonic()
+        samples = 0
+        sampling_time = 0.0
+        while not self._stop.is_set() and time.monotonic() - start < duration:
+            sample_start = time.perf_counter()
+            self.sample()
+            sampling_time += time.perf_counter() - sample_start
+            samples += 1
+            self._stop.wait(self.interval)
+        elapsed = time.monotonic() - start
+
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            with open(output, "w", encoding="utf-8") as profile_file:
+                for stack, count in self.stacks.most_common():
+                    profile_file.write(f"{stack} {count}\n")
+        except Exception as e:
+            logger.error(f"Error while writing profile: {e}")
+            return
+
+        self.last_profile = {
+            "output": str(output),
+            "seconds": round(elapsed, 3),
+            "samples": samples,
+            "stacks": len(self.stacks),
+            # Share of a core spent sampling.
+            "overhead": round(sampling_time / elapsed, 4) if elapsed else None,
+        }
+        logger.warning(f"Profile written: {self.last_profile}")
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "requests_left": self.requests_left if self.running else None,
+            "last_profile": self.last_profile,
+        }
+
+# Profiler of the process.
+profiler = SamplingProfiler()
+
+def install_signal_handler(signum: int = getattr(signal, "SIGUSR2", None), seconds: float = SIGNAL_SECONDS) -> None:
+    """
+    Starts a profile of `seconds` seconds when the process receives `signum` (SIGUSR2
+    by default), e.g. `kill -USR2 <pid>`. Must be called from the main thread.
+    """
+    if signum is None:
+        return
+
+    def start() -> None:
+        try:
+            profiler.start(seconds=seconds)
+        except RuntimeError as e:
+            logger.warning(f"Ignored profiling signal: {e}")
+
+    def handle(received, frame):
+        # Started from another thread, the interrupted code may hold the lock of the profiler.
+        threading.Thread(target=start, name="profiler-signal", daemon=True).start()
+
+    try:
+        signal.signal(signum, handle)
+    except ValueError as e:
+        logger.warning(f"Could not install the profiling signal handler: {e}")
@@ -0,0 +1,125 @@
+import re
+import os
+import logging
+from .table_normalizer import split_cells, is_separator
+
+logger = logging.getLogger(__name__)
+
+# Set to 0 to send the OCR markdown to the formatting model as is.
+PROMPT_MINIMIZATION = os.environ.get("PROMPT_MINIMIZATION", "1") != "0"
+
+# Disclaimers and sign-off lines printed on every report, matched against the plain
+# text of a line outside of tables. Lines with digits are kept unless the pattern
+# allows them, so that no result is ever dropped.
+BOILERPLATE = (
+    (re.compile(r"\bsubject to (\w+ )?variations? due to technical\b"), False),
+    (re.compile(r"^conditions? of reporting\b"), False),
+    (re.compile(r"\bresults? of (the )?tests? may vary\b"), False),
+    (re.compile(r"\bnot (valid )?for (medico ?legal|judicial|iudicial|iudical|court)\b"), False),
+    (re.compile(r"\b(computer|system) generated report\b"), False),
+    (re.compile(r"\bdoes not require (a |any )?signature\b"), False),
+    (re.compile(r"^(\W*)end of (the )?report\b"), False),
+    (re.compile(r"^scan (the )?qr\b"), False),
+    (re.compile(r"^(medical )?lab(oratory)? technician$"), False),
+    (re.compile(r"^(consultant )?pathologist$"), False),
+    (re.compile(r"^authori[sz]ed signatory$"), False),
+    (re.compile(r"^page \d+( of \d+)?$"), True),
+    (re.compile(r"^printed on\b"), True),
+)
+
+# Anything a line of text carries besides markdown decoration.
+ALPHANUMERIC = re.compile(r"\w")
+DIGIT = re.compile(r"\d")
+
+# Roughly what a BPE tokenizer splits text into: words, punctuation and runs of spaces.
+TOKEN = re.compile(r"\w+|[^\w\s]|\s{2,}")
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the number of tokens of a text, without calling the model."""
+    return len(TOKEN.findall(text or ""))
+
+def plain_text(line: str) -> str:
+    """Returns the text of a line without markdown decoration, in lower case."""
+    return " ".join(re.sub(r"[#*_`>]+", " ", line).split()).strip(" -:").lower()
+
+def is_boilerplate(text: str) -> bool:
+    """Checks if the plain text of a line is a known disclaimer or sign-off line."""
+    for pattern, allows_digits in BOILERPLATE:
+        if pattern.search(text) and (allows_digits or not DIGIT.search(text)):
+            return True
+    return False
+
+def compact_table_line(line: str) -> str:
+    """Rewrites a table line without cell padding and bold markers."""
+    cells = split_cells(line)
+    if is_separator(cells):
+        return "|" + "---|" * len(cells)
+    return "|" + "|".join(f" {cell} " if cell else " " for cell in cells) + "|"
+
+def minimize_markdown(markdown: str) -> tuple[str, list[dict]]:
+    """
+    Shrinks OCR markdown before it is embedded in the formatting prompt.
+
+    Indentation, cell padding and bold markers are dropped, which loses nothing.
+    Disclaimers, repeated headings, repeated table headers and lines without any
+    text are removed, and listed so that what the model did not see can be checked.
+    Table rows and lines with digits are never removed, except for page numbers and
+    print dates.
+
+    Args:
+        markdown (str): Raw OCR markdown output.
+
+    Returns:
+        tuple[str, list[dict]]: The minimized markdown, and the removed lines with
+        their 'line' number, 'text' and 'reason'.
+    """
+    output = []
+    removed = []
+    seen_headings = set()
+    table_header = None
+    repeated_header = False
+
+    for number, raw_line in enumerate(markdown.split("\n"), start=1):
+        line = raw_line.strip()
+
+        if "|" in line:
+            compacted = compact_table_line(line)
+            if table_header is None:
+                table_header = compacted
+            elif (compacted == table_header and not DIGIT.search(compacted)) or (repeated_header and is_separator(split_cells(line))):
+                # Header repeated on every page of a long table, with its separator.
+                removed.append({"line": number, "text": line, "reason": "repeated_header"})
+                repeated_header = compacted == table_header
+                continue
+            repeated_header = False
+            output.append(compacted)
+            continue
+        table_header = None
+        repeated_header = False
+
+        if not line:
+            if output and output[-1]:
+                output.append("")
+            continue
+
+        text = plain_text(line)
+        reason = None
+        if not ALPHANUMERIC.search(text):
+            reason = "noise"
+        elif is_boilerplate(text):
+            reason = "boilerplate"
+        elif line.startswith("#") or (line.startswith("**") and line.endswith("**")):
+            if text in seen_headings and not DIGIT.search(text):
+                reason = "repeated_heading"
+            seen_headings.add(text)
+
+        if reason:
+            removed.append({"line": number, "text": line, "reason": reason})
+            continue
+        output.append(line.replace("**", ""))
+
+    minimized = "\n".join(output).strip()
+    logger.info(f"Minimized markdown from {len(markdown)} to {len(minimized)} characters, removed {len(removed)} lines")
+    for line in removed:
+        logger.debug(f"Removed line {line['line']} ({line['reason']}): {line['text']}")
+    return minimized, removed
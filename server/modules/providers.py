@@ -0,0 +1,52 @@
+from dotenv import load_dotenv
+import threading
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The provider SDKs take most of the import time of the server, so they are only
+# imported, and Gemini configured, when a model is first called.
+_gemini = None
+_lock = threading.Lock()
+
+def gemini():
+    """
+    Returns the `google.generativeai` module, importing and configuring it on first use.
+
+    Returns:
+        module: The configured module.
+    """
+    global _gemini
+    if _gemini is None:
+        with _lock:
+            if _gemini is None:
+                load_dotenv()
+                import google.generativeai as genai
+                genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+                _gemini = genai
+                logger.info("Gemini configured")
+    return _gemini
+
+def together_client(**kwargs):
+    """
+    Creates a Together AI client, importing the SDK on first use.
+
+    Args:
+        **kwargs: Arguments of `together.Together`.
+
+    Returns:
+        together.Together: The client.
+    """
+    from together import Together
+    return Together(**kwargs)
+
+def warm_up() -> None:
+    """Imports the provider SDKs ahead of the first request, e.g. from a background thread."""
+    try:
+        gemini()
+        import together  # noqa: F401
+        import pymupdf  # noqa: F401
+        logger.info("Providers warmed up")
+    except Exception as e:
+        logger.error(f"Error while warming up providers: {e}")
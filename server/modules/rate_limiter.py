@@ -0,0 +1,225 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Request priorities, lower is served first.
+INTERACTIVE = 0
+BATCH = 1
+
+# Priority of the remote calls made by the current request or job.
+request_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+# Requests per minute allowed per provider, shared by all of its models. A model
+# only gets a limit of its own when one is configured for it, e.g.
+# 'gemini/gemini-2.0-flash-exp=10' in RATE_LIMITS.
+DEFAULT_RATE_LIMITS = {
+    "gemini": 15,
+    "together": 60,
+}
+
+# Seconds a call may wait for a token before giving up.
+ACQUIRE_TIMEOUT = float(os.environ.get("RATE_LIMIT_TIMEOUT", 120))
+
+def parse_rate_limits(value: str) -> dict:
+    """
+    Parses rate limits written as 'provider/model=rpm,provider=rpm'.
+
+    Args:
+        value (str): The rate limits.
+
+    Returns:
+        dict: Requests per minute by provider and model, or by provider.
+    """
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, rpm = item.split("=", 1)
+            limits[name.strip()] = float(rpm)
+    return limits
+
+RATE_LIMITS = {**DEFAULT_RATE_LIMITS, **parse_rate_limits(os.environ.get("RATE_LIMITS", ""))}
+
+class RateLimitTimeout(Exception):
+    """Raised when no token became available before the deadline."""
+
+@contextmanager
+def priority(level: int):
+    """Runs the remote calls made inside the block at the given priority."""
+    token = request_priority.set(level)
+    try:
+        yield
+    finally:
+        request_priority.reset(token)
+
+class TokenBucket:
+    """
+    Token bucket rate limiter with a priority wait queue.
+
+    Tokens are refilled continuously at `rate` per second up to `capacity`.
+    Waiting callers are served by priority, then in arrival order, so
+    interactive requests go ahead of queued batch requests.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.waiters = []
+        self.counter = itertools.count()
+        self.counts = {"acquired": 0, "waited": 0, "timeouts": 0}
+        self.wait_time = 0.0
+        self._condition = threading.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> bool:
+        """Takes a token without waiting, if one is free and nobody is queued."""
+        with self._condition:
+            self._refill()
+            if self.waiters or self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.counts["acquired"] += 1
+            return True
+
+    def acquire(self, level: int = INTERACTIVE, timeout: float = ACQUIRE_TIMEOUT) -> None:
+        """
+        Waits for a token.
+
+        Args:
+            level (int, optional): Priority of the caller.
+            timeout (float, optional): Seconds to wait before giving up.
+
+        Raises:
+            RateLimitTimeout: If no token became available in time.
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        with self._condition:
+            entry = (level, next(self.counter))
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    self._refill()
+                    if self.waiters[0] == entry and self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counts["timeouts"] += 1
+                        raise RateLimitTimeout(f"No rate limit token within {timeout}s")
+                    next_token = max((1 - self.tokens) / self.rate, 0.001)
+                    self._condition.wait(min(remaining, next_token))
+            finally:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+                self._condition.notify_all()
+
+            waited = time.monotonic() - start
+            self.counts["acquired"] += 1
+            if waited > 0.001:
+                self.counts["waited"] += 1
+                self.wait_time += waited
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            self._refill()
+            return {
+                **self.counts,
+                "requests_per_minute": self.rate * 60,
+                "tokens": round(self.tokens, 2),
+                "queued": len(self.waiters),
+                "queued_batch": sum(1 for level, _ in self.waiters if level >= BATCH),
+                "wait_time_total": round(self.wait_time, 3),
+            }
+
+class Coalescer:
+    """
+    Shares one call between concurrent identical requests.
+
+    The first caller with a key runs the call; callers arriving with the same key
+    while it is in flight wait for and share its result or exception.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.counts = {"calls": 0, "coalesced": 0}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+                self.counts["calls"] += 1
+            else:
+                self.counts["coalesced"] += 1
+
+        if not owner:
+            logger.info("Coalesced a duplicate in-flight request")
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self.in_flight.pop(key, None)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.counts, "in_flight": len(self.in_flight)}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def limit_name(provider: str) -> str:
+    """
+    Returns the rate limit a provider and model counts against: its own if one is
+    configured, otherwise the one of its provider, shared by all of its models.
+    """
+    return provider if provider in RATE_LIMITS else provider.split("/")[0]
+
+def get_limiter(provider: str) -> TokenBucket:
+    """
+    Returns the token bucket of a provider and model, e.g. 'gemini/gemini-2.0-flash-exp'.
+
+    Models without a limit of their own share the bucket of their provider, so that
+    falling back across the models of a provider stays within its quota. Providers
+    without a configured limit are not limited.
+
+    Args:
+        provider (str): Name of the provider and model.
+
+    Returns:
+        TokenBucket: The limiter, or None if the provider is not limited.
+    """
+    name = limit_name(provider)
+    with _limiters_lock:
+        if name not in _limiters:
+            rpm = RATE_LIMITS.get(name)
+            _limiters[name] = TokenBucket(rpm / 60) if rpm else None
+        return _limiters[name]
+
+def limiter_stats() -> dict:
+    """Returns the statistics of every rate limiter in use."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {provider: limiter.snapshot() for provider, limiter in limiters.items() if limiter}
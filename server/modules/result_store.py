@@ -0,0 +1,245 @@
+from pathlib import Path
+import datetime as dt
+import threading
+import sqlite3
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# SQLite database of the processed results.
+RESULTS_DB = os.environ.get("RESULTS_DB", str(Path(__file__).resolve().parent.parent / "data/results.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    lab_id TEXT,
+    report_date TEXT,
+    source TEXT,
+    metadata TEXT,
+    processed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reports_patient ON reports (patient_id, report_date);
+CREATE INDEX IF NOT EXISTS reports_lab ON reports (lab_id, report_date);
+CREATE INDEX IF NOT EXISTS reports_date ON reports (report_date);
+
+-- Patient and date are copied from the report, so that the history of an analyte
+-- is read from a single index range.
+CREATE TABLE IF NOT EXISTS results (
+    report_id TEXT NOT NULL REFERENCES reports (report_id) ON DELETE CASCADE,
+    analyte TEXT NOT NULL COLLATE NOCASE,
+    patient_id TEXT,
+    report_date TEXT,
+    result REAL,
+    unit TEXT,
+    reference_low REAL,
+    reference_high REAL,
+    PRIMARY KEY (report_id, analyte)
+);
+CREATE INDEX IF NOT EXISTS results_patient_analyte ON results (patient_id, analyte, report_date);
+CREATE INDEX IF NOT EXISTS results_analyte ON results (analyte, report_date);
+"""
+
+def to_iso_date(value) -> str:
+    """Returns a date as an ISO string, or None."""
+    if value is None:
+        return None
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value.isoformat()
+    return str(value)
+
+def to_result_rows(report_id: str, data: list[dict], patient_id: str = None, report_date: str = None) -> list[tuple]:
+    """
+    Flattens the output of `unit_conversion` into rows of the results table.
+
+    Args:
+        report_id (str): Id of the report.
+        data (list[dict]): Converted results, one {test: {result, unit, reference-range}} per entry.
+        patient_id (str, optional): Id of the patient.
+        report_date (str, optional): Date of the report, as an ISO string.
+
+    Returns:
+        list[tuple]: The rows. A test appearing twice keeps its last value.
+    """
+    rows = {}
+    for entry in data or []:
+        for analyte, values in entry.items():
+            reference_low, reference_high = values.get("reference-range") or (None, None)
+            rows[analyte.lower()] = (
+                report_id, analyte, patient_id, report_date,
+                values.get("result"), values.get("unit"), reference_low, reference_high,
+            )
+    return list(rows.values())
+
+class ResultStore:
+    """
+    Local SQLite store of the processed reports and their results, indexed for
+    lookups by report, patient, lab, analyte and date.
+
+    One connection is shared by all threads and serialized with a lock; the
+    database runs in WAL mode so that readers in other processes are not blocked.
+    """
+
+    def __init__(self, path: str = RESULTS_DB):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the connection, creating the database on first use. Call with the lock held."""
+        if self._connection is None:
+            if self.path != ":memory:":
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+            logger.info("Opened result store")
+            logger.debug(f"Opened result store: {self.path}")
+        return self._connection
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def save_report(self, report_id: str, data: list[dict], patient_id: str = None, lab_id: str = None,
+                    report_date: dt.date | str = None, source: str = None, metadata: dict = None) -> int:
+        """
+        Inserts or replaces a processed report and its results.
+
+        Returns:
+            int: Number of results stored.
+        """
+        return self.save_reports([{
+            "report_id": report_id,
+            "data": data,
+            "patient_id": patient_id,
+            "lab_id": lab_id,
+            "report_date": report_date,
+            "source": source,
+            "metadata": metadata,
+        }])
+
+    def save_reports(self, reports: list[dict]) -> int:
+        """
+        Inserts or replaces processed reports and their results in a single transaction.
+
+        A report processed again replaces its previous results, including the
+        analytes that are no longer found in it.
+
+        Args:
+            reports (list[dict]): Reports with a 'report_id' and 'data' (the output of
+                `unit_conversion`), and optionally 'patient_id', 'lab_id', 'report_date',
+                'source' and 'metadata'. Without a 'report_date', the date found in the
+                header of the report is used.
+
+        Returns:
+            int: Number of results stored.
+        """
+        processed_at = dt.datetime.now(dt.timezone.utc).isoformat()
+        report_rows, result_rows = [], []
+        for report in reports:
+            # Fall back to the date read from the header of the report.
+            header = (report.get("metadata") or {}).get("report_header") or {}
+            report_date = to_iso_date(report.get("report_date") or header.get("report_date"))
+            report_rows.append((
+                report["report_id"], report.get("patient_id"), report.get("lab_id"), report_date,
+                report.get("source"), json.dumps(report.get("metadata") or {}, default=str), processed_at,
+            ))
+            result_rows.extend(to_result_rows(report["report_id"], report.get("data"), report.get("patient_id"), report_date))
+
+        with self._lock:
+            connection = self.connection()
+            with connection:
+                connection.executemany(
+                    """
+                    INSERT INTO reports (report_id, patient_id, lab_id, report_date, source, metadata, processed_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (report_id) DO UPDATE SET
+                        patient_id = excluded.patient_id, lab_id = excluded.lab_id,
+                        report_date = excluded.report_date, source = excluded.source,
+                        metadata = excluded.metadata, processed_at = excluded.processed_at
+                    """,
+                    report_rows,
+                )
+                connection.executemany("DELETE FROM results WHERE report_id = ?", [(row[0],) for row in report_rows])
+                connection.executemany(
+                    """
+                    INSERT INTO results (report_id, analyte, patient_id, report_date, result, unit, reference_low, reference_high)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    result_rows,
+                )
+        logger.info(f"Stored {len(result_rows)} results of {len(report_rows)} reports")
+        return len(result_rows)
+
+    def query(self, sql: str, parameters: tuple = ()) -> list[dict]:
+        with self._lock:
+            return [dict(row) for row in self.connection().execute(sql, parameters)]
+
+    def analyte_history(self, patient_id: str, analyte: str, start: dt.date | str = None, end: dt.date | str = None) -> list[dict]:
+        """
+        Returns the results of an analyte for a patient, oldest first.
+
+        Args:
+            patient_id (str): Id of the patient.
+            analyte (str): Name of the analyte, case insensitive.
+            start (date | str, optional): First report date included.
+            end (date | str, optional): Last report date included.
+
+        Returns:
+            list[dict]: The report id, date, result, unit and reference range of every result.
+        """
+        sql = """
+            SELECT report_id, report_date, analyte, result, unit, reference_low, reference_high
+            FROM results WHERE patient_id = ? AND analyte = ?
+        """
+        parameters = [patient_id, analyte]
+        if start is not None:
+            sql += " AND report_date >= ?"
+            parameters.append(to_iso_date(start))
+        if end is not None:
+            sql += " AND report_date <= ?"
+            parameters.append(to_iso_date(end))
+        return self.query(sql + " ORDER BY report_date, report_id", tuple(parameters))
+
+    def patient_analytes(self, patient_id: str) -> list[dict]:
+        """Returns the analytes measured for a patient, with their number of results and last date."""
+        return self.query(
+            """
+            SELECT analyte, COUNT(*) AS results, MAX(report_date) AS last_report_date
+            FROM results WHERE patient_id = ? GROUP BY analyte ORDER BY analyte
+            """,
+            (patient_id,),
+        )
+
+    def get_report(self, report_id: str) -> dict:
+        """
+        Returns a stored report with its results.
+
+        Returns:
+            dict: The report, or None if it is not stored.
+        """
+        reports = self.query("SELECT * FROM reports WHERE report_id = ?", (report_id,))
+        if not reports:
+            return None
+        report = reports[0]
+        report["metadata"] = json.loads(report["metadata"] or "{}")
+        report["results"] = self.query(
+            """
+            SELECT analyte, result, unit, reference_low, reference_high
+            FROM results WHERE report_id = ? ORDER BY analyte
+            """,
+            (report_id,),
+        )
+        return report
+
+# Store shared by the API and the command line.
+result_store = ResultStore()
@@ -0,0 +1,118 @@
+import re
+import os
+import logging
+from .table_normalizer import LOOSE_TEST_DATA
+from .prompt_minimizer import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Most sections of a report formatted at once.
+FORMAT_PARALLELISM = int(os.environ.get("FORMAT_PARALLELISM", 4))
+
+# Reports shorter than this, in estimated tokens of the minimized markdown, are
+# formatted in a single call. Splitting pays off as soon as a report has two panels,
+# e.g. about 105 tokens for the thyroid and vitamin profiles (benchmarks/section_format.py),
+# so this only spares the repeated prompt instructions to reports of a few rows.
+PARALLEL_FORMAT_MIN_TOKENS = int(os.environ.get("PARALLEL_FORMAT_MIN_TOKENS", 100))
+
+# A markdown heading, e.g. '### **LIVER FUNCTION TEST**'.
+HEADING = re.compile(r"^\s*#{1,6}\s")
+
+def has_test_data(section: str) -> bool:
+    """Checks if a section holds a table or test data written as plain text."""
+    return any(
+        "|" in line or LOOSE_TEST_DATA.match(line.strip().lstrip("#*- ").replace("*", ""))
+        for line in section.split("\n")
+    )
+
+def split_sections(markdown: str) -> list[str]:
+    """
+    Splits markdown on its headings into sections that each hold test data.
+
+    Headings and text without test data, e.g. the patient details or the name of a
+    panel above its table, stay with the section that follows them. Text after the
+    last test data stays with the last section.
+
+    Args:
+        markdown (str): The markdown.
+
+    Returns:
+        list[str]: The sections, in order. Joined with newlines, they give back the markdown.
+    """
+    pieces = []
+    for line in markdown.split("\n"):
+        if not pieces or (HEADING.match(line) and "|" not in line):
+            pieces.append([line])
+        else:
+            pieces[-1].append(line)
+
+    sections = []
+    pending = []
+    for piece in pieces:
+        pending.extend(piece)
+        if has_test_data("\n".join(piece)):
+            sections.append("\n".join(pending))
+            pending = []
+    if pending:
+        if sections:
+            sections[-1] += "\n" + "\n".join(pending)
+        else:
+            sections.append("\n".join(pending))
+    return sections
+
+def group_sections(sections: list[str], max_groups: int) -> list[str]:
+    """
+    Groups consecutive sections into at most `max_groups` parts, keeping the largest
+    part, in estimated tokens, as small as possible.
+
+    Args:
+        sections (list[str]): The sections, in order.
+        max_groups (int): Most parts.
+
+    Returns:
+        list[str]: The parts, in order.
+    """
+    sizes = [estimate_tokens(section) for section in sections]
+
+    def split(capacity: int) -> list[list[int]]:
+        groups = [[]]
+        total = 0
+        for index, size in enumerate(sizes):
+            if groups[-1] and total + size > capacity:
+                groups.append([])
+                total = 0
+            groups[-1].append(index)
+            total += size
+        return groups
+
+    # Smallest capacity that fits in max_groups parts.
+    low, high = max(sizes, default=0), sum(sizes)
+    while low < high:
+        middle = (low + high) // 2
+        if len(split(middle)) <= max_groups:
+            high = middle
+        else:
+            low = middle + 1
+    return ["\n".join(sections[index] for index in group) for group in split(low) if group]
+
+def plan_sections(markdown: str, max_parallel: int = FORMAT_PARALLELISM, min_tokens: int = PARALLEL_FORMAT_MIN_TOKENS) -> list[str]:
+    """
+    Splits a long report into the parts formatted concurrently.
+
+    Args:
+        markdown (str): The markdown to format.
+        max_parallel (int, optional): Most parts.
+        min_tokens (int, optional): Shorter reports are not split.
+
+    Returns:
+        list[str]: The parts, in order. A single part when the report is short or has
+        a single section.
+    """
+    if max_parallel <= 1 or estimate_tokens(markdown) < min_tokens:
+        return [markdown]
+    sections = split_sections(markdown)
+    if len(sections) <= 1:
+        return [markdown]
+    parts = group_sections(sections, max_parallel)
+    logger.info(f"Split the report into {len(parts)} parts of {len(sections)} sections")
+    return parts
@@ -0,0 +1,265 @@
+import re
+import logging
+from typing import Callable
+from .chunking import parse_chunks
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("test", "result", "unit", "reference_range")
+HEADER = "| TEST | RESULT | UNIT | REFERENCE RANGE |"
+SEPARATOR = "|---|---|---|---|"
+
+# Keywords identifying a header cell, checked in order.
+HEADER_KEYWORDS = (
+    ("reference_range", ("REFERENCE", "RANGE", "NORMAL", "INTERVAL")),
+    ("unit", ("UNIT",)),
+    ("result", ("RESULT", "VALUE", "OBSERVED")),
+    ("test", ("TEST", "INVESTIGATION", "PARAMETER", "EXAMINATION", "DESCRIPTION")),
+)
+
+# Columns of headerless tables, by number of cells.
+POSITIONAL_COLUMNS = {
+    2: ("test", "result"),
+    3: ("test", "result", "unit"),
+    4: COLUMNS,
+}
+
+SEPARATOR_CELL = re.compile(r"^:?-+:?$")
+NUMBER = re.compile(r"^[<>]?\s*\d+(\.\d+)?$")
+# A reference range, e.g. '14 - 18', '0.27 to 4.2' or '< 200'.
+RANGE = re.compile(r"\d\s*(-|–|to)\s*[<>]?\s*\d|^[<>≤≥]=?\s*\d")
+# A unit, e.g. 'gm/dl', '/cmm', 'mil./cu.mm', '10^3/µL' or '%'.
+UNIT = re.compile(r"^(%|(10\s*\^\s*\d+\s*)?[^\d\s/]*/\s*[^\d\s]+)$")
+# A multiplier written in front of the unit, e.g. '10^3/µL' or 'x10^9/L'.
+UNIT_MULTIPLIER = re.compile(r"^[x×*]?\s*(10\s*\^\s*\d+)\s*(/.+)$")
+# Test data written as plain text, e.g. 'Haemoglobin 11.3 gm/dl'.
+LOOSE_TEST_DATA = re.compile(r"^[A-Za-z][A-Za-z .()]{2,}\s+\d+(\.\d+)?\s+\S+")
+
+def split_cells(line: str) -> list[str]:
+    """Splits a markdown table line into its stripped cells, without bold markers."""
+    cells = line.strip().strip("|").split("|")
+    return [cell.replace("**", "").strip() for cell in cells]
+
+def is_separator(cells: list[str]) -> bool:
+    """Checks if the cells are a markdown table separator row."""
+    return all(SEPARATOR_CELL.match(cell) for cell in cells if cell) and any(cells)
+
+def map_header(cells: list[str]) -> tuple:
+    """
+    Maps the header cells of a table to the report columns.
+
+    Args:
+        cells (list[str]): Header cells.
+
+    Returns:
+        tuple: The column of every cell, or None if a cell cannot be mapped.
+    """
+    columns = []
+    for cell in cells:
+        name = cell.upper()
+        column = next(
+            (column for column, keywords in HEADER_KEYWORDS if any(keyword in name for keyword in keywords)),
+            None,
+        )
+        if column is None or column in columns:
+            return None
+        columns.append(column)
+    return tuple(columns) if "test" in columns and "result" in columns else None
+
+def fits_column(column: str, cell: str) -> bool:
+    """
+    Checks if a cell of a headerless table can belong to the column it has by position:
+    results are neither ranges nor units, and units are neither numbers nor ranges.
+    Text results, e.g. 'Normal' or 'Reactive', are accepted.
+
+    Args:
+        column (str): Column the cell is mapped to.
+        cell (str): The cell.
+
+    Returns:
+        bool: False if the cell is in the wrong column.
+    """
+    if column == "result":
+        return bool(NUMBER.match(cell)) or not (RANGE.search(cell) or UNIT.match(cell))
+    if column == "unit":
+        return not RANGE.search(cell) and not NUMBER.match(cell)
+    return True
+
+def move_unit_multiplier(result: str, unit: str) -> tuple[str, str]:
+    """
+    Moves a multiplier written in the unit into the result, e.g. ('3.83', '10^3/µL') to ('3.83x10^3', '/µL').
+
+    Args:
+        result (str): Result cell.
+        unit (str): Unit cell.
+
+    Returns:
+        tuple[str, str]: The result and unit cells.
+    """
+    match = UNIT_MULTIPLIER.match(unit)
+    if match and NUMBER.match(result):
+        return f"{result}x{match.group(1).replace(' ', '')}", match.group(2).strip()
+    return result, unit
+
+def normalize_table(lines: list[str]) -> tuple[str, list[str]]:
+    """
+    Normalizes a markdown table to the `| TEST | RESULT | UNIT | REFERENCE RANGE |` shape.
+
+    Args:
+        lines (list[str]): Lines of the table.
+
+    Returns:
+        tuple[str, list[str]]: The section title found in the header, if any, and the
+        lines of the normalized table. The lines are None if the table cannot be normalized,
+        e.g. when the cells of a headerless table do not fit their columns.
+    """
+    rows = [split_cells(line) for line in lines]
+    title = None
+
+    if len(rows) >= 2 and is_separator(rows[1]):
+        header, data = rows[0], rows[2:]
+        columns = map_header(header)
+        if columns is None:
+            if header[0] and not any(header[1:]):
+                # The header only carries the name of the section.
+                title = header[0]
+            elif any(NUMBER.match(cell) for cell in header):
+                # The header is actually the first row of data.
+                data = [header] + data
+            else:
+                return title, None
+    else:
+        columns, data = None, [row for row in rows if not is_separator(row)]
+
+    width = len(columns) if columns else max(len(row) for row in data) if data else 0
+    positional = columns is None
+    columns = columns or POSITIONAL_COLUMNS.get(width)
+    if columns is None:
+        return title, None
+
+    normalized = [HEADER, SEPARATOR]
+    for cells in data:
+        if not any(cells):
+            continue
+        if len(cells) > len(columns) and any(cells[len(columns):]):
+            return title, None
+        row = dict(zip(columns, cells))
+        if positional and not all(fits_column(column, cell) for column, cell in row.items()):
+            # Without a header, a misplaced value would be stored under the wrong column.
+            return title, None
+        values = {column: row.get(column) or "-" for column in COLUMNS}
+        if values["test"] == "-":
+            return title, None
+        values["result"], values["unit"] = move_unit_multiplier(values["result"], values["unit"])
+        normalized.append("| " + " | ".join(values[column] for column in COLUMNS) + " |")
+
+    return title, normalized
+
+def is_valid_table(table: list[str]) -> bool:
+    """
+    Checks a normalized table against the schema `parse_chunks` expects.
+
+    Args:
+        table (list[str]): Lines of the normalized table.
+
+    Returns:
+        bool: True if every row parses into the four report columns.
+    """
+    if any(len(line.split("|")[1:-1]) != len(COLUMNS) for line in table):
+        return False
+    if len(table) == 2:
+        return True
+    parsed = parse_chunks("\n".join(table))
+    return parsed is not None and tuple(parsed.columns) == COLUMNS and len(parsed) == len(table) - 2
+
+def normalize_markdown(markdown: str, format_table: Callable[[str], str] = None) -> str:
+    """
+    Normalizes OCR markdown to the table format expected by `parse_chunks`, without calling an LLM.
+
+    Fixes bold headers, section titles used as headers, missing columns and
+    multipliers written in the unit column. Tables that cannot be mapped to the
+    report columns are handed to `format_table` on their own, once the other tables
+    normalized locally. Gives up when no `format_table` is given for them, when no
+    local table holds test data, or when test data is found outside of tables.
+
+    Args:
+        markdown (str): Raw OCR markdown output.
+        format_table (Callable[[str], str], optional): Formats the markdown of a single
+            table, e.g. with the LLM.
+
+    Returns:
+        str: The normalized markdown, or None if it has to be formatted by the LLM.
+    """
+    try:
+        logger.info("Normalizing markdown locally...")
+        lines = [line.strip() for line in markdown.strip().split("\n")]
+        output = []
+        table = []
+        tables = 0
+        numeric_results = 0
+        # Position in the output and lines of the tables left to format_table.
+        unmapped = []
+
+        for line in lines + [""]:
+            if "|" in line:
+                table.append(line)
+                continue
+
+            if table:
+                title, normalized = normalize_table(table)
+                if normalized is None or not is_valid_table(normalized):
+                    logger.info("Could not normalize a table locally")
+                    logger.debug(f"Table: \n{chr(10).join(table)}")
+                    if format_table is None:
+                        return None
+                    unmapped.append((len(output), table))
+                    output.append(None)
+                else:
+                    previous = next((text for text in reversed(output) if text), "")
+                    if title and title.upper() not in previous.replace("*", "").upper():
+                        output.extend([f"### **{title}**", ""])
+                    output.extend(normalized)
+                    tables += 1
+                    numeric_results += sum(
+                        1 for row in normalized[2:] if NUMBER.match(row.split("|")[2].strip().split("x")[0])
+                    )
+                table = []
+
+            if LOOSE_TEST_DATA.match(line.lstrip("#*- ").replace("*", "")):
+                logger.info("Found test data outside of tables")
+                logger.debug(f"Line: {line}")
+                return None
+            output.append(line)
+
+        if not tables or not numeric_results:
+            logger.info("No test data found in tables")
+            return None
+
+        for index, table in unmapped:
+            formatted = format_table("\n".join(table))
+            if not formatted:
+                return None
+            output[index] = formatted.strip()
+
+        logger.info(f"Successfully normalized {tables} tables locally, {len(unmapped)} formatted on their own")
+        normalized_markdown = "\n".join(output).strip()
+        logger.debug(f"Normalized markdown: \n{normalized_markdown}")
+        return normalized_markdown
+    except Exception as e:
+        logger.error(f"Error while normalizing markdown: {e}")
+
+if __name__ == "__main__":
+    # Regression check: the sample reports normalize locally, without the LLM.
+    from pathlib import Path
+    from .format_data import SAMPLE_MARKDOWN
+
+    samples = {
+        "format_data.SAMPLE_MARKDOWN": SAMPLE_MARKDOWN,
+        "data/test_ocr.md": (Path(__file__).resolve().parents[2] / "data/test_ocr.md").read_text(encoding="utf-8"),
+    }
+    for name, sample in samples.items():
+        normalized_markdown = normalize_markdown(sample)
+        assert normalized_markdown is not None, f"{name} was not normalized locally"
+        rows = [line for line in normalized_markdown.split("\n") if "|" in line and line not in (HEADER, SEPARATOR)]
+        assert any("Normocytic Normochromic" in row for row in rows), f"{name} lost its text results"
+        print(f"{name}: {len(rows)} rows normalized locally")
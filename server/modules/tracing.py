@@ -0,0 +1,296 @@
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+import contextvars
+import threading
+import atexit
+import queue
+import secrets
+import json
+import time
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Traces are written here, one OTLP/JSON export request per line, as read by the
+# OpenTelemetry collector's otlpjsonfile receiver.
+TRACES_FILE = os.environ.get("TRACES_FILE", str(Path(__file__).resolve().parent.parent / "data/traces.jsonl"))
+
+# Size the traces file may reach, in bytes, before it is rotated to TRACES_FILE.1,
+# replacing the previous one.
+TRACES_MAX_BYTES = int(os.environ.get("TRACES_MAX_BYTES", 64 * 1024 * 1024))
+
+# Finished traces waiting to be written. Traces are dropped when the writer falls behind.
+EXPORT_QUEUE_SIZE = 1000
+
+# Set to 0 to disable tracing.
+TRACING = os.environ.get("TRACING", "1") != "0"
+
+SERVICE_NAME = "tata-brp"
+
+# OTLP span kinds and status codes.
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# Span of the current request or job, carried into the threads started with a copy of the context.
+current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    """A timed operation of a trace, with attributes."""
+
+    def __init__(self, trace: "Trace", name: str, parent_id: str = None, kind: int = INTERNAL, attributes: dict = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start = time.time_ns()
+        self.end = None
+        self.status = STATUS_OK
+        self.error = None
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def increment(self, name: str, value: int = 1) -> None:
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def finish(self, error: BaseException = None) -> None:
+        self.end = time.time_ns()
+        if error is not None:
+            self.status = STATUS_ERROR
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.add(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [to_otlp_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+            "status": {"code": self.status, **({"message": self.error} if self.error else {})},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+class Trace:
+    """The spans of a request, exported together once its root span finishes."""
+
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+def to_otlp_attribute(key: str, value) -> dict:
+    """Converts an attribute to an OTLP key-value."""
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+class FileExporter:
+    """
+    Appends finished traces to a JSON lines file in the OTLP/JSON format.
+
+    Traces are serialized and written by a background thread, so that finishing a
+    request never waits for the disk. The file is rotated once it reaches `max_bytes`,
+    keeping a single previous file.
+    """
+
+    def __init__(self, path: str = TRACES_FILE, max_bytes: int = TRACES_MAX_BYTES, queue_size: int = EXPORT_QUEUE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.counts = {"exported": 0, "dropped": 0, "rotated": 0, "errors": 0}
+
+    def export(self, trace: Trace) -> None:
+        """Queues a finished trace to be written, without waiting. Dropped if the queue is full."""
+        self.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            with self._lock:
+                self.counts["dropped"] += 1
+            logger.warning(f"Trace export queue is full, dropped trace {trace.trace_id}")
+
+    def start(self) -> None:
+        """Starts the writer thread, if it is not running."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+                # Writes the queued traces of short-lived processes too.
+                atexit.register(self.close)
+
+    def _run(self) -> None:
+        while True:
+            trace = self._queue.get()
+            try:
+                if trace is None:
+                    return
+                self.write(trace)
+            finally:
+                self._queue.task_done()
+
+    def write(self, trace: Trace) -> None:
+        """Appends a trace to the file, rotating it first if it would grow past `max_bytes`."""
+        with trace._lock:
+            spans = sorted(trace.spans, key=lambda span: span.start)
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [to_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp() for span in spans]}],
+            }]
+        }
+        line = (json.dumps(payload, default=str) + "\n").encode("utf-8")
+        try:
+            path = Path(self.path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if self.max_bytes and path.exists() and path.stat().st_size + len(line) > self.max_bytes:
+                os.replace(path, f"{path}.1")
+                self.counts["rotated"] += 1
+            with open(path, "ab") as traces_file:
+                traces_file.write(line)
+            self.counts["exported"] += 1
+        except Exception as e:
+            self.counts["errors"] += 1
+            logger.error(f"Error while exporting trace {trace.trace_id}: {e}")
+
+    def flush(self) -> None:
+        """Waits until the queued traces are written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self, timeout: float = 5) -> None:
+        """Writes the queued traces and stops the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.counts, "queued": self._queue.qsize(), "max_bytes": self.max_bytes}
+
+# Exporter of the finished traces.
+exporter = FileExporter()
+
+def parse_traceparent(header: str) -> tuple[str, str]:
+    """
+    Reads the trace and parent span ids of a W3C traceparent header.
+
+    Returns:
+        tuple[str, str]: The ids, or (None, None) if the header is missing or invalid.
+    """
+    match = TRACEPARENT.match((header or "").strip().lower())
+    return (match.group(1), match.group(2)) if match else (None, None)
+
+@contextmanager
+def start_trace(name: str, traceparent: str = None, kind: int = SERVER, **attributes):
+    """
+    Traces a request: runs the block in the root span of a new trace, exported when the block exits.
+
+    Args:
+        name (str): Name of the root span.
+        traceparent (str, optional): W3C traceparent header of the caller, to continue its trace.
+        kind (int, optional): OTLP span kind of the root span.
+        **attributes: Attributes of the root span.
+
+    Yields:
+        Span: The root span, or None when tracing is disabled.
+    """
+    if not TRACING:
+        yield None
+        return
+    trace_id, parent_id = parse_traceparent(traceparent)
+    root = Span(Trace(trace_id), name, parent_id=parent_id, kind=kind, attributes=attributes)
+    token = current_span.set(root)
+    error = None
+    try:
+        yield root
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span.reset(token)
+        root.finish(error)
+        exporter.export(root.trace)
+
+@contextmanager
+def span(name: str, kind: int = INTERNAL, **attributes):
+    """
+    Runs the block in a child span of the current span. Does nothing outside of a trace.
+
+    Yields:
+        Span: The span, or None outside of a trace.
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent_id=parent.span_id, kind=kind, attributes=attributes)
+    token = current_span.set(child)
+    error = None
+    try:
+        yield child
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span.reset(token)
+        child.finish(error)
+
+# Code objects of the traced functions, by span name, to annotate profiles with stages.
+STAGE_CODES = {}
+
+def traced(name: str, kind: int = INTERNAL):
+    """Decorates a function to run in a span."""
+    def decorator(fn):
+        STAGE_CODES[fn.__code__] = name
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, kind=kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def set_attributes(**attributes) -> None:
+    """Sets attributes of the current span, if any."""
+    current = current_span.get()
+    if current is not None:
+        current.set_attributes(**attributes)
+
+def increment(name: str, value: int = 1) -> None:
+    """Increments a counter attribute of the current span, if any."""
+    current = current_span.get()
+    if current is not None:
+        current.increment(name, value)
+
+def current_trace_id() -> str:
+    """Returns the id of the current trace, or None outside of a trace."""
+    current = current_span.get()
+    return current.trace.trace_id if current is not None else None
+
+def traceparent() -> str:
+    """Returns the W3C traceparent header of the current span, or None outside of a trace."""
+    current = current_span.get()
+    return f"00-{current.trace.trace_id}-{current.span_id}-01" if current is not None else None
@@ -0,0 +1,89 @@
+from typing import AsyncIterator
+import re
+import os
+import logging
+from .image_fetcher import MAX_IMAGE_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Largest accepted upload, in bytes.
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", MAX_IMAGE_BYTES))
+
+BOUNDARY = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds the size cap."""
+
+async def read_body(stream: AsyncIterator[bytes], max_bytes: int = MAX_UPLOAD_BYTES, content_length: int = None) -> bytes:
+    """
+    Reads a request body into memory, giving up as soon as it exceeds the size cap.
+
+    Args:
+        stream (AsyncIterator[bytes]): Chunks of the body.
+        max_bytes (int, optional): Largest accepted body.
+        content_length (int, optional): Declared length of the body, checked before reading.
+
+    Returns:
+        bytes: The body.
+
+    Raises:
+        UploadTooLarge: If the body is larger than `max_bytes`.
+    """
+    if content_length is not None and content_length > max_bytes:
+        raise UploadTooLarge(f"Upload of {content_length} bytes exceeds the limit of {max_bytes} bytes")
+
+    body = bytearray()
+    async for chunk in stream:
+        body += chunk
+        if len(body) > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds the limit of {max_bytes} bytes")
+    logger.info(f"Received upload of {len(body)} bytes")
+    return bytes(body)
+
+def extract_multipart_file(body: bytes, content_type: str, field: str = "file") -> tuple[bytes, str]:
+    """
+    Extracts an uploaded file from a multipart/form-data body held in memory.
+
+    Args:
+        body (bytes): The body.
+        content_type (str): Content-Type header of the request, with the boundary.
+        field (str, optional): Name of the form field of the file. When no part has
+            that name, the first part with a filename is used.
+
+    Returns:
+        tuple[bytes, str]: Content and filename of the file.
+
+    Raises:
+        ValueError: If the body is not valid multipart data or has no file.
+    """
+    match = BOUNDARY.search(content_type or "")
+    if not match:
+        raise ValueError("Multipart upload without boundary")
+    delimiter = b"--" + match.group(1).encode()
+
+    files = []
+    for part in body.split(delimiter)[1:]:
+        if part.startswith(b"--"):
+            break
+        headers, separator, content = part.partition(b"\r\n\r\n")
+        if not separator:
+            continue
+        disposition = next(
+            (line for line in headers.decode("latin-1").split("\r\n") if line.lower().startswith("content-disposition")), ""
+        )
+        name = re.search(r'\bname="([^"]*)"', disposition)
+        filename = re.search(r'\bfilename="([^"]*)"', disposition)
+        # The part ends with the line break before the next delimiter.
+        content = content[:-2] if content.endswith(b"\r\n") else content
+        if name and name.group(1) == field:
+            return content, filename.group(1) if filename else None
+        if filename:
+            files.append((content, filename.group(1)))
+
+    if not files:
+        raise ValueError(f"Multipart upload without a '{field}' file")
+    return files[0]
+
+def is_pdf(data: bytes) -> bool:
+    """Checks the magic number of a PDF document."""
+    return data[:1024].lstrip().startswith(b"%PDF")
@@ -1,13 +1,29 @@
 from .modules.unit_conversion import unit_conversion
 from .modules.phrase_detection import detect_phrases
 from .modules.data_extractor import extract_phrases, extract_data
-from .modules.chunking import batch_chunks, parse_chunks, bundle_chunks
-from .modules.format_data import format_markdown
-from .modules.llama_ocr import image_to_md
+from .modules.chunking import scan_markdown, parse_chunks, bundle_chunks, contains_tables
+from .modules.format_data import format_markdown, build_prompt
+from .modules.prompt_minimizer import minimize_markdown, estimate_tokens, PROMPT_MINIMIZATION
+from .modules.sections import plan_sections
+from .modules.table_normalizer import normalize_markdown
+from .modules.ocr_backends import get_backend, DEFAULT_BACKEND
+from .modules.model_router import router
 from .modules.preprocess_image import preprocess_image, save_image, load_image
 from .modules.image_validation import validate_image
+from .modules.combined_ocr import image_to_table_md
+from .modules.pdf_conversion import extract_text_markdown, render_pages
+from .modules.uploads import is_pdf
+from .modules.image_profiling import select_preprocessing_profile, FULL
+from .modules.image_memory import bounded_image
+from .modules.image_dedup import dedup_index, hash_source
+from .modules.image_fetcher import fetch_image_bytes
+from .modules.artifacts import ArtifactStore, STAGES, file_digest, value_digest
+from .modules.tracing import traced, span, set_attributes
 
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import numpy as np
+import contextvars
 from pathlib import Path
 import datetime as dt
 import logging
@@ -28,65 +44,375 @@ class Processor:
         self.markdown = markdown
         self.image = None
         self.data = None
+        self.metadata = {}
+        self.formatted = False
 
-    def preprocess_image(self, image_path: str) -> str:
+    @traced("preprocess")
+    def preprocess_image(self, image_path: str | bytes) -> str | np.ndarray:
         """
         Preprocesses the image for better OCR performance.
 
         Args:
-            image_path (str): Path of the image to be processed.
+            image_path (str | bytes): Path of the image to be processed, or its encoded bytes.
         
         Returns:
-            str: File path of the preprocessed image.
+            str | numpy.ndarray: File path of the preprocessed image. Uploaded images are
+            kept in memory and returned as is.
         """
         logger.info(f"Preprocessing image...")
-        logger.debug(f"Preprocessing image: {image_path}")
-        preprocessed_image = preprocess_image(image_path=image_path)
+        logger.debug(f"Preprocessing image: {describe_source(image_path)}")
+        original_image, preprocessed_image, profile = self.load_and_preprocess(image_path)
 
-        if validate_image(Image.fromarray(preprocessed_image)):
+        if profile != FULL:
+            # Passthrough and light profiles do not degrade the image, no need to validate it.
+            self.image = preprocessed_image
+            logger.info(f"Skipped validation for the '{profile}' profile. Using preprocessed image")
+        elif validate_image(Image.fromarray(preprocessed_image)):
             self.image = preprocessed_image
             logger.info("Preprocessed image is valid. Using preprocessed image")
         else:
-            self.image = load_image(image_path=image_path)
+            self.image = original_image
             logger.warning("Preprocessed image is invalid. Using original image")
 
+        return self.ocr_input(self.image, image_path)
+
+    def load_and_preprocess(self, image_path: str | bytes) -> tuple[np.ndarray, np.ndarray, str]:
+        """
+        Loads an image and preprocesses it with the profile it needs, within the image
+        memory budget of the process. Scans above the target resolution are decoded
+        at a reduced one.
+
+        Args:
+            image_path (str | bytes): Path or URL of the image, or its encoded bytes.
+
+        Returns:
+            tuple[numpy.ndarray, numpy.ndarray, str]: The original image, the preprocessed
+            image, and the preprocessing profile.
+        """
+        with bounded_image(image_path) as (source, reduction):
+            original_image = load_image(image_path=source, reduction=reduction)
+            profile = select_preprocessing_profile(original_image)
+            self.metadata["preprocessing_profile"] = profile
+            if reduction > 1:
+                self.metadata["decode_reduction"] = reduction
+            set_attributes(**image_size(original_image), profile=profile, decode_reduction=reduction)
+            preprocessed_image = preprocess_image(original_image, profile=profile)
+        return original_image, preprocessed_image, profile
+
+    def ocr_input(self, image: np.ndarray, source: str | bytes, suffix: str = "") -> str | np.ndarray:
+        """
+        Returns what the OCR backends are given for an image: the image itself for
+        uploads, which never touch the disk, or the path it is saved to otherwise.
+        """
+        if isinstance(source, bytes):
+            return image
+        return self.save_preprocessed_image(image, suffix=suffix)
+
+    def save_preprocessed_image(self, image: np.ndarray, suffix: str = "") -> str:
+        """
+        Saves an image to the preprocessed image directory.
+
+        Args:
+            image (numpy.ndarray): Image to save.
+            suffix (str, optional): Appended to the timestamped file name, to tell apart
+                images saved for the same request.
+
+        Returns:
+            str: File path of the saved image.
+        """
         BASE_DIR = Path(__file__).resolve().parent
         SAVE_DIR = BASE_DIR / "data/preprocessed"
         SAVE_DIR.mkdir(parents=True, exist_ok=True)
 
-        timestamp = dt.datetime.now(dt.timezone.utc).strftime("%Y_%m_%d_%H_%M_%S")
-        file_path = SAVE_DIR / f"{timestamp}.jpg"
-        save_image(self.image, str(file_path))
+        timestamp = dt.datetime.now(dt.timezone.utc).strftime("%Y_%m_%d_%H_%M_%S_%f")
+        file_path = SAVE_DIR / f"{timestamp}{suffix}.jpg"
+        save_image(image, str(file_path))
 
         logger.info(f"Saved preprocessed image")
         logger.debug(f"Saved preprocessed image to: {file_path}")
         return str(file_path)
 
-    def convert_image_to_markdown(self, image_path: str) -> None:
+    @traced("speculative_ocr")
+    def perform_speculative_ocr(self, image_path: str | bytes, tile: bool = False, ocr_backend: str = None, speculate_original: bool = False) -> None:
         """
-        Converts an image to markdown using a vision model.
+        Runs the OCR of the preprocessed image while it is still being validated.
+
+        The validation of fully preprocessed images no longer delays the OCR: the
+        preprocessed image (and with `speculate_original`, the original one too) is
+        converted concurrently with `validate_image`. The branch matching the verdict is
+        kept, the other one is cancelled if it has not started yet, or its result is
+        discarded. Without `speculate_original`, the original image is only converted
+        after validation rejected the preprocessed one.
 
         Args:
-            image_path (str): Path to the image file.
+            image_path (str | bytes): Path of the image to be processed, or its encoded bytes.
+            tile (bool, optional): Split very tall or dense pages into tiles converted concurrently.
+            ocr_backend (str, optional): Name of the OCR backend. Defaults to the Llama Vision model.
+            speculate_original (bool, optional): Also convert the original image speculatively.
         """
-        logger.info(f"Converting image to markdown...")
-        logger.debug(f"Converting image to markdown: {image_path}")
-        self.markdown = image_to_md(image_path=image_path)
+        logger.info(f"Preprocessing image...")
+        logger.debug(f"Preprocessing image: {describe_source(image_path)}")
+        original_image, preprocessed_image, profile = self.load_and_preprocess(image_path)
+
+        if profile != FULL:
+            # Nothing to validate, hence nothing to speculate on.
+            self.image = preprocessed_image
+            logger.info(f"Skipped validation for the '{profile}' profile. Using preprocessed image")
+            self.convert_image_to_markdown_routed(self.ocr_input(self.image, image_path), tile=tile, ocr_backend=ocr_backend)
+            return
+
+        images = {"preprocessed": preprocessed_image}
+        if speculate_original:
+            images["original"] = original_image
+
+        pool = ThreadPoolExecutor(max_workers=len(images) + 1)
+        try:
+            # Threads do not inherit the context, e.g. the priority of the request.
+            validation = pool.submit(contextvars.copy_context().run, validate_image, Image.fromarray(preprocessed_image))
+            branches = {
+                name: pool.submit(
+                    contextvars.copy_context().run, self.ocr_branch,
+                    self.ocr_input(image, image_path, suffix=f"_{name}"), tile, ocr_backend,
+                )
+                for name, image in images.items()
+            }
+            logger.info(f"Started speculative OCR of the {' and '.join(branches)} image")
+
+            winner = "preprocessed" if validation.result() else "original"
+            self.image = images.get(winner, original_image)
+            wasted = [name for name in branches if name != winner]
+            for name in wasted:
+                # A branch already running cannot be interrupted, its result is discarded.
+                branches[name].cancel()
+            logger.info(f"Validation chose the {winner} image. Discarding the {' and '.join(wasted) or 'no'} branch")
+
+            if winner in branches:
+                markdown, metadata = branches[winner].result()
+            else:
+                markdown, metadata = self.ocr_branch(self.ocr_input(original_image, image_path, suffix="_original"), tile, ocr_backend)
+        finally:
+            # Do not wait for a discarded branch that is still running.
+            pool.shutdown(wait=False, cancel_futures=True)
 
-    def perform_ocr(self, file_path: str = None) -> None:
+        self.markdown = markdown
+        self.metadata.update(metadata)
+        self.metadata["speculation"] = {"branches": list(branches), "winner": winner, "discarded": wasted}
+        set_attributes(winner=winner, discarded=",".join(wasted))
+
+    def ocr_branch(self, image_path: str | np.ndarray, tile: bool, ocr_backend: str) -> tuple[str, dict]:
+        """
+        Converts an image in a separate processor, so that concurrent branches do not share state.
+
+        Returns:
+            tuple[str, dict]: The markdown and the OCR metadata of the branch.
+        """
+        branch = Processor()
+        branch.metadata = {"preprocessing_profile": self.metadata.get("preprocessing_profile", FULL)}
+        branch.convert_image_to_markdown_routed(image_path, tile=tile, ocr_backend=ocr_backend)
+        return branch.markdown, branch.metadata
+
+    @traced("image_to_markdown")
+    def convert_image_to_markdown(self, image_path: str | np.ndarray, tile: bool = False, ocr_backend: str = None, model: str = None) -> None:
+        """
+        Converts an image to markdown using an OCR backend.
+
+        Args:
+            image_path (str | numpy.ndarray): Path to the image file, or the loaded image.
+            tile (bool, optional): Split very tall or dense pages into tiles converted concurrently.
+            ocr_backend (str, optional): Name of the OCR backend. Defaults to the Llama Vision model.
+            model (str, optional): Model of the OCR backend, for backends that have several.
+        """
+        backend = get_backend(ocr_backend)
+        self.metadata["ocr_backend"] = backend.name
+        if model:
+            self.metadata["ocr_model"] = model
+        logger.info(f"Converting image to markdown with the '{backend.name}' backend...")
+        logger.debug(f"Converting image to markdown: {describe_source(image_path)}")
+        set_attributes(backend=backend.name, model=model, tile=tile)
+        self.markdown = backend.image_to_md(image_path, tile=tile, model=model)
+        set_attributes(markdown_chars=len(self.markdown or ""))
+        if not self.markdown:
+            raise ValueError(f"OCR with the '{backend.name}' backend returned no markdown.")
+
+    def convert_image_to_markdown_routed(self, image_path: str | np.ndarray, tile: bool = False, ocr_backend: str = None) -> None:
+        """
+        Converts an image to markdown with the fastest healthy vision model, escalating to
+        a more accurate tier when the OCR fails or no table can be found in its output.
+
+        Clean scans start with the small vision model, images that needed the full
+        preprocessing start with the large one.
+
+        Args:
+            image_path (str | numpy.ndarray): Path to the image file, or the loaded image.
+            tile (bool, optional): Split very tall or dense pages into tiles converted concurrently.
+            ocr_backend (str, optional): Name of the OCR backend. Defaults to the Llama Vision model.
+        """
+        if not get_backend(ocr_backend).routed:
+            self.convert_image_to_markdown(image_path, tile=tile, ocr_backend=ocr_backend)
+            return
+
+        last_tier = router.tier_count("vision") - 1
+        clean = self.metadata.get("preprocessing_profile", FULL) != FULL
+        tier = 0 if clean else last_tier
+        reason = "clean scan" if clean else "full preprocessing"
+        self.metadata["ocr_escalations"] = 0
+
+        while True:
+            model = router.choose("vision", tier, reason)
+            # The router falls back to a higher tier when no model of this one is healthy.
+            tier = router.tier_of("vision", model)
+            try:
+                self.convert_image_to_markdown(image_path, tile=tile, ocr_backend=ocr_backend, model=model)
+                if tier >= last_tier or contains_tables(self.markdown):
+                    return
+                logger.warning(f"No table found in the output of {model}. Escalating")
+            except ValueError:
+                if tier >= last_tier:
+                    raise
+                logger.warning(f"OCR with {model} failed. Escalating")
+            tier += 1
+            reason = "escalation"
+            self.metadata["ocr_escalations"] += 1
+
+    @traced("combined_ocr")
+    def perform_combined_ocr(self, image_path: str | bytes) -> None:
+        """
+        Judges readability and converts the image to formatted markdown with a single
+        multimodal call, instead of separate validation, OCR and formatting calls.
+
+        The original image is only sent in a second call when the fully preprocessed
+        image is judged unreadable.
+
+        Args:
+            image_path (str | bytes): Path of the image to be processed, or its encoded bytes.
+        """
+        logger.info("Performing combined OCR on image...")
+        original_image, self.image, profile = self.load_and_preprocess(image_path)
+
+        is_valid, markdown = image_to_table_md(self.image)
+        if not is_valid and profile == FULL:
+            logger.warning("Preprocessed image is invalid. Using original image")
+            self.image = original_image
+            is_valid, markdown = image_to_table_md(self.image)
+
+        if not markdown:
+            raise ValueError("Combined OCR returned no markdown.")
+        self.markdown = markdown
+        self.formatted = True
+
+    @traced("pdf_ocr")
+    def perform_pdf_ocr(self, pdf: str | bytes, **ocr_options) -> None:
+        """
+        Converts a PDF report to markdown, page by page, joined in page order.
+
+        Pages with a usable text layer are converted locally from their text. Only
+        the pages without one (e.g. scans) are rendered in memory and go through OCR.
+
+        Args:
+            pdf (str | bytes): Path of the PDF file, or its content.
+            **ocr_options: Options of `perform_ocr` applied to every scanned page.
+        """
+        logger.info("Converting PDF to markdown...")
+        markdown_pages = extract_text_markdown(pdf)
+        if not markdown_pages:
+            raise ValueError("No pages found in PDF")
+
+        pages_metadata = [{"page": index + 1, "conversion": "text_layer"} for index in range(len(markdown_pages))]
+        scanned = [index for index, markdown in enumerate(markdown_pages) if markdown is None]
+        set_attributes(page_count=len(markdown_pages), scanned_pages=len(scanned))
+        formatted = []
+        if scanned:
+            logger.info(f"Performing OCR on {len(scanned)} scanned pages...")
+            for index, image in zip(scanned, render_pages(pdf, scanned)):
+                page = Processor()
+                page.perform_ocr(image, **ocr_options)
+                markdown_pages[index] = page.markdown
+                pages_metadata[index] = {"page": index + 1, "conversion": "ocr", **page.metadata}
+                formatted.append(page.formatted)
+
+        self.markdown = "\n\n".join(markdown for markdown in markdown_pages if markdown)
+        if not self.markdown:
+            raise ValueError("No text found in PDF")
+        # Text layer pages still need formatting.
+        self.formatted = len(formatted) == len(markdown_pages) and all(formatted)
+        self.metadata["pages"] = pages_metadata
+
+    @traced("ocr")
+    def perform_ocr(self, file_path: str | bytes = None, tile: bool = False, ocr_backend: str = None, pipeline: str = "chain", speculative: str = "off") -> None:
         """
         Performs OCR on an image, applying preprocessing before conversion.
 
         Args:
-            file_path (str, optional): Path of the image to be processed.
+            file_path (str | bytes, optional): Path of the image or PDF to be processed, or its content.
+            tile (bool, optional): Split very tall or dense pages into tiles converted concurrently.
+            ocr_backend (str, optional): Name of the OCR backend. Defaults to the Llama Vision model.
+            pipeline (str, optional): 'chain' for separate validation, OCR and formatting steps,
+                or 'combined' for a single multimodal call.
+            speculative (str, optional): With the chain pipeline, 'preprocessed' starts the OCR of the
+                preprocessed image during its validation, 'both' also starts the OCR of the original
+                image. 'off' waits for the validation.
         """
         if self.file and file_path:
             raise ValueError("Either 'file' or 'file_path' should be provided, not both.")
         
         logger.info(f"Performing OCR on image...")
-        logger.debug(f"Performing OCR on image: {file_path or self.file}")
-        preprocessed_file_path = self.preprocess_image(file_path or self.file)
-        self.convert_image_to_markdown(preprocessed_file_path)
+        set_attributes(pipeline=pipeline, speculative=speculative, input=describe_source(file_path or self.file))
+        logger.debug(f"Performing OCR on image: {describe_source(file_path or self.file)}")
+        self.metadata = {"pipeline": pipeline}
+        self.formatted = False
+
+        if is_pdf_source(file_path or self.file):
+            self.perform_pdf_ocr(file_path or self.file, tile=tile, ocr_backend=ocr_backend, pipeline=pipeline, speculative=speculative)
+            return
+
+        source = file_path or self.file
+        image_hash = None
+        if dedup_index.enabled:
+            if is_remote_source(source):
+                # Fetched once, for both the hash and the pipeline.
+                source = fetch_image_bytes(source)
+            image_hash = hash_source(source)
+        # The output of a near-duplicate is only reused if it was produced the same way.
+        dedup_options = (ocr_backend or DEFAULT_BACKEND, pipeline, tile, speculative)
+        if image_hash is not None and self.reuse_duplicate(image_hash, dedup_options):
+            return
+
+        if pipeline == "combined":
+            self.perform_combined_ocr(source)
+        elif speculative != "off":
+            self.perform_speculative_ocr(source, tile=tile, ocr_backend=ocr_backend, speculate_original=speculative == "both")
+        else:
+            preprocessed_file_path = self.preprocess_image(source)
+            self.convert_image_to_markdown_routed(preprocessed_file_path, tile=tile, ocr_backend=ocr_backend)
+
+        if image_hash is not None:
+            dedup_index.add(image_hash, {"markdown": self.markdown, "formatted": self.formatted, "metadata": dict(self.metadata)}, options=dedup_options)
+
+    @traced("dedup")
+    def reuse_duplicate(self, image_hash: tuple[int, int], options: tuple = ()) -> bool:
+        """
+        Reuses the OCR output of a near-identical image processed recently, skipping the
+        preprocessing, the validation and the OCR.
+
+        Args:
+            image_hash (tuple[int, int]): Perceptual hashes of the image.
+            options (tuple, optional): OCR options the output must have been produced with.
+
+        Returns:
+            bool: True if a near-duplicate was found and its output reused.
+        """
+        match = dedup_index.lookup(image_hash, options)
+        if match is None:
+            set_attributes(dedup="miss")
+            return False
+        entry, distance = match
+        logger.info(f"Reusing the OCR output of a near-identical image, {distance} bits apart")
+        self.markdown = entry["markdown"]
+        self.formatted = entry["formatted"]
+        self.metadata.update(entry["metadata"])
+        self.metadata["dedup"] = {"distance": distance}
+        set_attributes(dedup="hit", dedup_distance=distance)
+        return True
 
     def set_markdown(self, markdown: str) -> None:
         """
@@ -97,30 +423,137 @@ class Processor:
         """
         logger.info("Setting OCR markdown content...")
         self.markdown = markdown
+        self.metadata = {}
+        self.formatted = False
 
+    @traced("format")
     def format_markdown(self, markdown: str) -> None:
         """
         Formats the OCR markdown content.
 
+        Tables that only need small fixes are normalized locally. A table that
+        cannot be mapped is formatted by the LLM on its own, and the whole markdown
+        only when the local normalization fails. The markdown is then minimized
+        before it is embedded in the prompt.
+
+        Long reports are split on their section headings into parts formatted
+        concurrently, joined back in order, so that the formatting takes about as
+        long as the longest part.
+
         Args:
             markdown (str): Raw OCR markdown output.
         """
         logger.info("Formatting markdown content...")
-        self.markdown = format_markdown(markdown)
+        set_attributes(input_chars=len(markdown))
+        normalized_markdown = normalize_markdown(markdown, format_table=self.format_table)
+        if normalized_markdown:
+            self.metadata["formatting"] = "partial" if self.metadata.get("llm_tables") else "local"
+            self.markdown = normalized_markdown
+            return
+
+        self.metadata.pop("llm_tables", None)
+        self.metadata["formatting"] = "llm"
+        prompt_markdown = self.minimize_prompt(markdown) if PROMPT_MINIMIZATION else markdown
+        parts = plan_sections(prompt_markdown)
+        if len(parts) == 1:
+            self.markdown, self.metadata["format_model"] = self.format_part(prompt_markdown)
+            return
+
+        set_attributes(format_parts=len(parts))
+        with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+            # Threads do not inherit the context, e.g. the current span.
+            futures = [pool.submit(contextvars.copy_context().run, self.format_part, part, index) for index, part in enumerate(parts)]
+            try:
+                results = [future.result() for future in futures]
+            except Exception:
+                for future in futures:
+                    future.cancel()
+                raise
+        self.markdown = "\n\n".join(formatted for formatted, _ in results)
+        self.metadata["format_model"] = results[0][1]
+        self.metadata["format_parts"] = [
+            {"estimated_tokens": estimate_tokens(part), "model": model}
+            for part, (_, model) in zip(parts, results)
+        ]
+
+    def format_table(self, table: str) -> str:
+        """
+        Formats a single table the local normalization could not map, with the LLM.
 
+        Args:
+            table (str): The markdown of the table.
+
+        Returns:
+            str: The formatted table.
+        """
+        formatted_table, self.metadata["format_model"] = self.format_part(table)
+        self.metadata["llm_tables"] = self.metadata.get("llm_tables", 0) + 1
+        return formatted_table
+
+    def format_part(self, markdown: str, index: int = 0) -> tuple[str, str]:
+        """
+        Formats markdown with the fastest healthy model, falling back to the next ones.
+
+        Args:
+            markdown (str): The markdown, or a part of it.
+            index (int, optional): Position of the part in the report.
+
+        Returns:
+            tuple[str, str]: The formatted markdown and the model that formatted it.
+
+        Raises:
+            ValueError: If no model returned any content.
+        """
+        with span("format_part", index=index, estimated_tokens=estimate_tokens(markdown)):
+            for attempt, model in enumerate(router.candidates("format")):
+                router.record("format", model, "fastest" if attempt == 0 else "fallback")
+                formatted_markdown = format_markdown(markdown, model_name=model)
+                if formatted_markdown:
+                    return formatted_markdown, model
+                logger.warning(f"Formatting with {model} failed. Falling back")
+        raise ValueError("Formatting the markdown returned no content.")
+
+    def minimize_prompt(self, markdown: str) -> str:
+        """
+        Strips the boilerplate and noise of the markdown sent to the formatting model, and
+        records the estimated prompt tokens and the removed lines in the metadata.
+
+        Args:
+            markdown (str): Raw OCR markdown output.
+
+        Returns:
+            str: The minimized markdown.
+        """
+        minimized_markdown, removed = minimize_markdown(markdown)
+        tokens = estimate_tokens(build_prompt(markdown))
+        minimized_tokens = estimate_tokens(build_prompt(minimized_markdown))
+        self.metadata["prompt"] = {
+            "estimated_tokens": minimized_tokens,
+            "estimated_tokens_saved": tokens - minimized_tokens,
+            "removed_lines": removed,
+        }
+        set_attributes(estimated_prompt_tokens=minimized_tokens, estimated_tokens_saved=tokens - minimized_tokens, removed_lines=len(removed))
+        return minimized_markdown
+
+    @traced("parse")
     def process_chunks(self) -> pd.DataFrame:
         """
-        Processes chunks of text from the OCR markdown.
+        Processes chunks of text from the OCR markdown, and extracts the header of the
+        report (patient fields, report date and sections) into the metadata.
 
         Returns:
             pd.DataFrame: DataFrame containing processed text chunks.
         """
         logger.info("Processing text chunks from OCR markdown...")
-        raw_chunks = batch_chunks(self.markdown)
+        # The header comes out of the same pass over the markdown as the tables.
+        raw_chunks, self.metadata["report_header"] = scan_markdown(self.markdown)
+        logger.debug(f"Report header: \n{self.metadata['report_header']}")
         processed_chunks = [parse_chunks(chunk) for chunk in raw_chunks]
         bundled_chunks = bundle_chunks(processed_chunks)
+        set_attributes(table_count=len(raw_chunks), row_count=0 if bundled_chunks is None else len(bundled_chunks))
         return bundled_chunks
 
+    @traced("detect_phrases")
     def detect_phrases(self, processed_chunks: pd.DataFrame) -> pd.DataFrame:
         """
         Detects meaningful phrases from processed chunks.
@@ -136,8 +569,10 @@ class Processor:
         classified_phrases = detect_phrases(phrases)
         valid_phrases = {p: c for p, c in classified_phrases.items() if c != "Unknown"}
         extracted_data = extract_data(processed_chunks, valid_phrases)
+        set_attributes(classified_count=len(valid_phrases))
         return extracted_data
 
+    @traced("convert_units")
     def convert_units(self, phrase_data: pd.DataFrame) -> pd.DataFrame:
         """
         Converts units in the extracted data.
@@ -150,8 +585,10 @@ class Processor:
         """
         logger.info("Converting units in extracted data...")
         self.data = unit_conversion(phrase_data)
+        set_attributes(result_count=len(self.data or []))
         return self.data
 
+    @traced("process")
     def process(self) -> dict:
         """
         Runs the full OCR processing pipeline: formatting, chunking, phrase detection, and unit conversion.
@@ -163,9 +600,142 @@ class Processor:
             raise ValueError("OCR markdown is not set. Please provide the OCR data.")
         
         logger.info("Starting full OCR processing pipeline...")
-        self.format_markdown(self.markdown)
+        if self.formatted:
+            self.metadata["formatting"] = "combined"
+        else:
+            self.format_markdown(self.markdown)
         processed_chunks = self.process_chunks()
         phrase_data = self.detect_phrases(processed_chunks)
         self.data = self.convert_units(phrase_data)
         logger.info("OCR processing completed successfully")
         return self.data
+
+    def run_stages(self, store: ArtifactStore, report_id: str, source: str = None, markdown: str = None, force: list[str] = None, **ocr_options) -> list:
+        """
+        Runs the pipeline stage by stage, reusing the persisted output of every stage whose
+        code version, data files and upstream outputs did not change.
+
+        The OCR stage takes its source from `source` or `markdown`. When neither is given,
+        the source recorded by the previous run is used, so that archived reports can be
+        reprocessed after a change to a downstream stage without calling the OCR again.
+
+        Args:
+            store (ArtifactStore): Store of the stage artifacts.
+            report_id (str): Id of the report.
+            source (str, optional): Path or URL of the report image.
+            markdown (str, optional): OCR markdown of the report, instead of an image.
+            force (list[str], optional): Stages to recompute even if their output is up to date.
+            **ocr_options: Options of `perform_ocr`, e.g. `ocr_backend`.
+
+        Returns:
+            list: Processed data with standardized units.
+
+        Raises:
+            ValueError: If the OCR stage has to run but no source is known.
+        """
+        force = set(force or [])
+        if source is not None or markdown is not None:
+            inputs = {
+                "source": source,
+                "digest": value_digest(markdown) if markdown is not None else self.source_digest(source),
+                "markdown": markdown,
+                "options": ocr_options,
+            }
+        else:
+            previous = store.load(report_id, "ocr")
+            if previous is None:
+                raise ValueError(f"Report {report_id} has no OCR artifact and no source was given.")
+            inputs = previous["inputs"]
+
+        stages, outputs, digests = {}, {}, {}
+        for stage in STAGES:
+            stage_inputs = {"digest": inputs["digest"], "options": inputs["options"]} if stage.name == "ocr" else None
+            key = stage.key([digests[name] for name in stage.depends_on], stage_inputs)
+            artifact = store.load(report_id, stage.name)
+
+            with span(f"stage.{stage.name}", report_id=report_id) as stage_span:
+                if artifact and artifact["key"] == key and stage.name not in force:
+                    logger.info(f"Reusing the {stage.name} output of report {report_id}")
+                    stages[stage.name] = "reused"
+                else:
+                    logger.info(f"Running the {stage.name} stage of report {report_id}...")
+                    upstream = [outputs[name] for name in stage.depends_on]
+                    value = self.run_stage(stage.name, upstream, inputs)
+                    artifact = store.save(report_id, stage, key, value, inputs if stage.name == "ocr" else None)
+                    stages[stage.name] = "computed"
+                if stage_span:
+                    stage_span.set_attributes(status=stages[stage.name])
+
+            outputs[stage.name] = artifact["value"]
+            digests[stage.name] = artifact["digest"]
+
+        self.metadata = {**outputs["ocr"]["metadata"], "report_header": outputs["parse"]["header"], "stages": stages}
+        self.markdown = outputs["format"]
+        self.data = outputs["convert"]
+        return self.data
+
+    def run_stage(self, name: str, upstream: list, inputs: dict):
+        """
+        Computes the output of a stage from the outputs of the stages it depends on.
+
+        Outputs are JSON serializable: DataFrames are kept in pandas' 'split' layout.
+        """
+        if name == "ocr":
+            if inputs["markdown"] is not None:
+                self.set_markdown(inputs["markdown"])
+            else:
+                if not inputs["source"]:
+                    raise ValueError("The OCR stage has to run again but the source of the report is unknown.")
+                self.perform_ocr(inputs["source"], **inputs["options"])
+            return {"markdown": self.markdown, "formatted": self.formatted, "metadata": self.metadata}
+
+        if name == "format":
+            (ocr,) = upstream
+            self.markdown = ocr["markdown"]
+            if not ocr["formatted"]:
+                self.format_markdown(self.markdown)
+            return self.markdown
+
+        (value,) = upstream
+        if name == "parse":
+            self.markdown = value
+            rows = frame_to_json(self.process_chunks())
+            return {"rows": rows, "header": self.metadata["report_header"]}
+        if name == "classify":
+            return frame_to_json(self.detect_phrases(frame_from_json(value["rows"])))
+        if name == "convert":
+            return self.convert_units(frame_from_json(value))
+        raise ValueError(f"Unknown stage: {name}")
+
+    @staticmethod
+    def source_digest(source: str) -> str:
+        """Identifies a local file by its content, and a remote one by its URL."""
+        return file_digest(source) if Path(source).is_file() else value_digest(source)
+
+def image_size(image: np.ndarray) -> dict:
+    """Returns the size of an image as span attributes."""
+    if image is None:
+        return {}
+    return {"image_height": image.shape[0], "image_width": image.shape[1]}
+
+def describe_source(source) -> str:
+    """Describes an input in log messages, without dumping the content of uploads."""
+    if isinstance(source, bytes):
+        return f"upload of {len(source)} bytes"
+    if isinstance(source, np.ndarray):
+        return f"image of shape {source.shape}"
+    return str(source)
+
+def is_remote_source(source: str | bytes) -> bool:
+    """Checks if an input is the URL of a remote file."""
+    return isinstance(source, str) and source.startswith(("http://", "https://"))
+
+def is_pdf_source(source: str | bytes) -> bool:
+    """Checks if a path or an uploaded file is a PDF."""
+    return is_pdf(source) if isinstance(source, bytes) else source.lower().endswith(".pdf")
+
+def frame_to_json(frame: pd.DataFrame) -> dict:
+    return None if frame is None else frame.to_dict(orient="split")
+
+def frame_from_json(value: dict) -> pd.DataFrame:
+    return None if value is None else pd.DataFrame(**value)
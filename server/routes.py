@@ -1,24 +1,74 @@
-from fastapi import APIRouter, HTTPException, Depends
-from .models import Markdown, FilePath
-from .processor import Processor
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Header
+from fastapi.responses import PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from .models import Markdown, FilePath, ReportInfo, UploadOptions
+from .modules.uploads import read_body, extract_multipart_file, UploadTooLarge
+from .modules.admission import admission, admission_stats, Overloaded
+from .modules.image_memory import image_budget, MemoryBudgetTimeout
+from .modules.tracing import current_trace_id, exporter as trace_exporter
+from .modules.profiler import profiler
+from .modules.artifacts import report_id_for
+from .modules.result_store import result_store
+from .modules.model_executor import executor
+from .modules.rate_limiter import limiter_stats
+from .modules.model_router import router as model_router
+from contextlib import asynccontextmanager
+import threading
+import secrets
+import os
 import logging
-from typing import Optional
+from typing import Annotated, Optional
+from datetime import date
 
 logger = logging.getLogger(__name__)
 
 # Create a router for OCR processing
 router = APIRouter()
 
-# Initialize the OCRProcessor
-processor = Processor()
+# The pipeline is imported on first use, importing it (pandas, OpenCV) is slow
+_processor_class = None
+_processor_lock = threading.Lock()
 
-def validate_input(file_path: Optional[FilePath] = None, input_data: Optional[Markdown] = None):
+def get_processor():
+    """
+    Creates an OCRProcessor, importing the pipeline on first use.
+
+    A processor holds the state of the report it processes, so concurrent requests
+    each get their own.
+
+    Returns:
+        Processor: The processor.
+    """
+    global _processor_class
+    with _processor_lock:
+        if _processor_class is None:
+            from .processor import Processor
+            _processor_class = Processor
+    return _processor_class()
+
+@asynccontextmanager
+async def admitted(pipeline: str):
+    """
+    Holds a slot of the pipeline ('markdown' or 'image') for the duration of the block.
+
+    Raises:
+        HTTPException: With status code 429 if too many requests are queued, or 503 if no
+            slot was freed in time, and a Retry-After header.
+    """
+    try:
+        async with admission[pipeline].admit():
+            yield
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def validate_input(file_path: Optional[FilePath] = None, input_data: Optional[Markdown] = None, report_info: Optional[ReportInfo] = None):
     """
     Validates the input parameters for the OCR processing route.
 
     Args:
         file_path (Optional[FilePath]): Path to the file to be processed.
         input_data (Optional[Markdown]): Markdown input to be processed.
+        report_info (Optional[ReportInfo]): Identifiers of the report, to store its results.
 
     Returns:
         A dictionary containing the file_path and input_data if the input is valid.
@@ -33,7 +83,7 @@ def validate_input(file_path: Optional[FilePath] = None, input_data: Optional[Ma
         if file_path and input_data:
             raise HTTPException(status_code=400, detail="Provide either file_path or input_data, not both.")
         
-        valid_input = {"file_path": file_path, "input_data": input_data}
+        valid_input = {"file_path": file_path, "input_data": input_data, "report_info": report_info or ReportInfo()}
         logger.info("Successfully validated the input")
         return valid_input
     except Exception as e:
@@ -53,6 +103,151 @@ async def root():
         "message": "tata-brp is up and running!"
     }
 
+@router.get("/metrics", tags=["Monitoring"])
+async def metrics():
+    """
+    Metrics endpoint for the API.
+
+    Returns the latency, error and circuit breaker statistics of every remote model provider,
+    the state of their rate limiters, the number of coalesced duplicate requests, the
+    model routing decisions, the queue depth and wait times of the processing pipelines,
+    the memory held by the images being preprocessed, the near-duplicate image hits and
+    the traces written, rotated and dropped.
+    """
+    logger.info("METRICS route hit")
+    # Imported here, hashing images needs OpenCV, which startup does not import
+    from .modules.image_dedup import dedup_index
+
+    return {
+        "admission": admission_stats(),
+        "image_memory": image_budget.snapshot(),
+        "image_dedup": dedup_index.stats(),
+        "providers": executor.stats(),
+        "rate_limits": limiter_stats(),
+        "coalescing": executor.coalescer.snapshot(),
+        "routing": model_router.snapshot(),
+        "tracing": trace_exporter.snapshot(),
+    }
+
+def overloaded_by_images(error: MemoryBudgetTimeout) -> HTTPException:
+    """Turns away a request whose image did not fit in the image memory budget in time."""
+    logger.warning(f"Image memory budget exhausted: {error}")
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(admission["image"].retry_after())})
+
+def store_results(report_info: ReportInfo, source: str | bytes, data: list, metadata: dict, source_name: str = None) -> str:
+    """
+    Stores the processed results of a report.
+
+    Args:
+        report_info (ReportInfo): Identifiers of the report.
+        source (str | bytes): File path, markdown or uploaded content of the report, the report id is
+            derived from it when not given.
+        data (list): Processed results.
+        metadata (dict): Metadata of the processing.
+        source_name (str, optional): Stored as the source instead of `source`, e.g. the name of an uploaded file.
+
+    Returns:
+        str: Id of the stored report, or None if the results could not be stored.
+    """
+    if not data:
+        return None
+    try:
+        report_id = report_info.report_id or report_id_for(source)
+        result_store.save_report(
+            report_id,
+            data,
+            patient_id=report_info.patient_id,
+            lab_id=report_info.lab_id,
+            report_date=report_info.report_date,
+            source=source_name or (source if isinstance(source, str) and len(source) < 2048 else None),
+            metadata=metadata,
+        )
+        return report_id
+    except Exception as e:
+        logger.error(f"Error while storing results: {e}")
+
+def require_admin(x_admin_token: Annotated[Optional[str], Header()] = None) -> None:
+    """
+    Allows a request to the admin endpoints if its X-Admin-Token header matches ADMIN_TOKEN.
+    The admin endpoints are disabled when no ADMIN_TOKEN is set.
+    """
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token or not x_admin_token or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required.")
+
+@router.post("/admin/profile", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def start_profile(seconds: Optional[float] = Query(None, gt=0), requests: Optional[int] = Query(None, gt=0)):
+    """
+    Starts the sampling profiler of this worker for a number of seconds (30 by default)
+    or until a number of /process requests finished.
+
+    Returns the file the collapsed stacks will be written to. Raises an HTTPException
+    with status code 409 if a profile is already running.
+    """
+    logger.info("START PROFILE route hit")
+    try:
+        output = profiler.start(seconds=seconds or (None if requests else 30), requests=requests)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "started", "output": str(output), "pid": os.getpid()}
+
+@router.get("/admin/profile", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def profile_status():
+    """Returns whether a profile is running, and the summary of the last one."""
+    return profiler.status()
+
+@router.delete("/admin/profile", tags=["Admin"], dependencies=[Depends(require_admin)])
+async def stop_profile():
+    """Stops the running profile, which is then written out."""
+    profiler.stop()
+    return {"status": "stopping"}
+
+@router.get("/admin/profile/latest", tags=["Admin"], dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+async def latest_profile():
+    """
+    Returns the last profile as collapsed stacks, e.g. for `flamegraph.pl` or speedscope.
+
+    Raises an HTTPException with status code 404 if no profile was written yet.
+    """
+    if not profiler.last_profile:
+        raise HTTPException(status_code=404, detail="No profile was written yet.")
+    with open(profiler.last_profile["output"], "r", encoding="utf-8") as profile_file:
+        return profile_file.read()
+
+@router.get("/patients/{patient_id}/analytes", tags=["Results"])
+def patient_analytes(patient_id: str):
+    """
+    Returns the analytes stored for a patient, with their number of results and the date of the last one.
+    """
+    logger.info("PATIENT ANALYTES route hit")
+    return {"patient_id": patient_id, "analytes": result_store.patient_analytes(patient_id)}
+
+@router.get("/patients/{patient_id}/analytes/{analyte}", tags=["Results"])
+def analyte_history(patient_id: str, analyte: str, start: Optional[date] = None, end: Optional[date] = None):
+    """
+    Returns the history of an analyte for a patient, oldest first, optionally between two report dates.
+
+    Raises an HTTPException with status code 404 if no result is stored.
+    """
+    logger.info("ANALYTE HISTORY route hit")
+    history = result_store.analyte_history(patient_id, analyte, start=start, end=end)
+    if not history:
+        raise HTTPException(status_code=404, detail=f"No results of {analyte} for patient {patient_id}")
+    return {"patient_id": patient_id, "analyte": analyte, "results": history}
+
+@router.get("/reports/{report_id}", tags=["Results"])
+def get_report(report_id: str):
+    """
+    Returns a stored report with its results.
+
+    Raises an HTTPException with status code 404 if the report is not stored.
+    """
+    logger.info("REPORT route hit")
+    report = result_store.get_report(report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Report not found: {report_id}")
+    return report
+
 @router.post("/process", tags=["Blood Report Processing"])
 async def process(input_params: dict = Depends(validate_input)) -> dict:
     """
@@ -62,18 +257,27 @@ async def process(input_params: dict = Depends(validate_input)) -> dict:
     The value for 'file_path' should be a string representing a valid file path.
     The value for 'input_data' should be another JSON object with a 'markdown' key
     whose value is a string representing the markdown input to be processed.
+    An optional 'report_info' object carries the report, patient and lab ids and the
+    report date the results are stored with.
 
-    Returns a JSON object with a single key 'data' containing the processed result.
+    Returns a JSON object with a key 'data' containing the processed result, a key
+    'metadata' describing how the input was processed (e.g. the preprocessing profile)
+    and the 'report_id' the results are stored under.
 
     Raises an HTTPException with status code 400 if the input is invalid.
+    Raises an HTTPException with status code 429 or 503 if the server is overloaded.
     Raises an HTTPException with status code 500 if an error occurs during processing.
     """
-    file_path = input_params["file_path"]
-    input_data = input_params["input_data"]
-
     logger.info("PROCESS route hit")
 
+    async with admitted("markdown" if input_params["input_data"] else "image"):
+        # The pipeline blocks, it runs in the threadpool to keep serving other requests.
+        return await run_in_threadpool(process_input, **input_params)
+
+def process_input(file_path: Optional[FilePath], input_data: Optional[Markdown], report_info: ReportInfo) -> dict:
+    """Processes the input of a /process request."""
     try:
+        processor = get_processor()
         data = {}
 
         if input_data:
@@ -86,11 +290,75 @@ async def process(input_params: dict = Depends(validate_input)) -> dict:
             # Process from image
             logger.info(f"Processing file...")
             logger.debug(f"Processing file from path: {file_path.file_path}")
-            processor.perform_ocr(file_path.file_path)
+            processor.perform_ocr(file_path.file_path, **file_path.ocr_options())
             data = processor.process()
 
-        return {"data": data} if data else logger.error("Returned data is empty"); raise HTTPException(status_code=204, detail=f"Processing the input returned No Content: {e}")
+        # Stored with the results, to find the trace of a slow report.
+        processor.metadata["trace_id"] = current_trace_id()
+        report_id = store_results(report_info, file_path.file_path if file_path else input_data.markdown, data, processor.metadata)
+
+        return {"data": data, "metadata": processor.metadata, "report_id": report_id} if data else logger.error("Returned data is empty"); raise HTTPException(status_code=204, detail=f"Processing the input returned No Content: {e}")
     
+    except MemoryBudgetTimeout as e:
+        raise overloaded_by_images(e)
     except Exception as e:
         logger.error(f"Error processing markdown: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing markdown: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing markdown: {str(e)}")
+
+@router.post("/process/upload", tags=["Blood Report Processing"])
+async def process_upload(request: Request, options: Annotated[UploadOptions, Query()]) -> dict:
+    """
+    Process a blood report image or PDF uploaded with the request.
+
+    The file is sent either as the raw request body or as the 'file' field of a
+    multipart/form-data body. It is read into memory, up to `MAX_UPLOAD_BYTES`, and
+    decoded from there: nothing is written to disk. The OCR options and the report
+    info are given as query parameters.
+
+    Returns a JSON object with the processed 'data', its 'metadata' and the 'report_id'
+    the results are stored under.
+
+    Raises an HTTPException with status code 400 if the upload is empty or malformed.
+    Raises an HTTPException with status code 413 if the upload is too large.
+    Raises an HTTPException with status code 429 or 503 if the server is overloaded.
+    Raises an HTTPException with status code 500 if an error occurs during processing.
+    """
+    logger.info("PROCESS UPLOAD route hit")
+
+    content_type = request.headers.get("content-type", "")
+    content_length = request.headers.get("content-length")
+    # Admitted before reading the body, so that queued uploads are not held in memory.
+    async with admitted("image"):
+        try:
+            body = await read_body(request.stream(), content_length=int(content_length) if content_length else None)
+            filename = None
+            if content_type.startswith("multipart/form-data"):
+                body, filename = extract_multipart_file(body, content_type)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid upload: {e}")
+        if not body:
+            raise HTTPException(status_code=400, detail="The upload is empty.")
+
+        return await run_in_threadpool(process_upload_body, body, filename, options)
+
+def process_upload_body(body: bytes, filename: str, options: UploadOptions) -> dict:
+    """Processes the file of a /process/upload request."""
+    try:
+        processor = get_processor()
+        logger.info("Processing uploaded file...")
+        processor.perform_ocr(body, **options.ocr_options())
+        data = processor.process()
+
+        processor.metadata["trace_id"] = current_trace_id()
+        report_id = store_results(options, body, data, processor.metadata, source_name=filename)
+        if not data:
+            raise ValueError("Processing the upload returned no data")
+        return {"data": data, "metadata": processor.metadata, "report_id": report_id}
+
+    except MemoryBudgetTimeout as e:
+        raise overloaded_by_images(e)
+    except Exception as e:
+        logger.error(f"Error processing upload: {e}")
+        raise HTTPException(status_code=500, detail=f"Error processing upload: {str(e)}")